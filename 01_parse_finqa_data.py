@@ -1,50 +1,26 @@
-# Import necessary helper functions and the regular expression module
-import re
-
-from helpers import from_json_file, glob_files, to_json
-
-# Glob pattern to match all JSON files in the 'data/original' directory
-data_files = glob_files("data/original/*.json")
-
-# Open a new JSON file for writing processed data
-with open("data/finqa_data.json", "w", encoding="utf-8") as f_out:
-    # Iterate over each data file found in the directory
-    for data_file in data_files:
-        # Load instances (data points) from the current JSON file
-        instances = from_json_file(data_file)
-        # Process each instance individually
-        for instance in instances:
-            # Extract pre-text, post-text, and table information from the instance
-            pre_text = instance["pre_text"]
-            post_text = instance["post_text"]
-            table = instance["table_ori"]
-
-            # Initialize a list to hold question-answer pairs
-            qa_pairs = []
-
-            # Iterate through keys in the instance, sorted numerically if applicable
-            for key in list(sorted(list(instance.keys()))):
-                # Use a regular expression to identify question-answer pair keys
-                match = re.search(r"^qa_?(\d+)?$", key)
-
-                # If a matching key is found
-                if match is not None:
-                    # Check for question number anomalies (e.g., greater than 9, indicating a sorting issue)
-                    q_num = match.group(1)
-                    if q_num is not None:
-                        if int(q_num) > 9:
-                            raise ValueError("Sort broken")
-
-                    # Append the question-answer pair to the list
-                    qa_pairs.append({
-                        "question": instance[key]["question"],
-                        "answer": instance[key]["answer"]
-                    })
-
-            # Write the processed instance to the output file as a JSON string, followed by a newline
-            f_out.write(to_json({
-                "pre_text": " ".join(pre_text),  # Combine pre-text strings
-                "table": "\n".join(["\t".join(row) for row in table]),  # Format the table as a tab-delimited string
-                "post_text": " ".join(post_text),  # Combine post-text strings
-                "qa_pairs": qa_pairs,  # Include the processed question-answer pairs
-            }) + "\n")
+# Import the argparse module to read the sharding settings
+import argparse
+
+# Import necessary helper functions and the streaming parser
+from helpers import glob_files
+from parsing import parse_files
+
+# The guard keeps the worker processes, which import this module, from parsing the data again
+if __name__ == "__main__":
+    # Parse the sharding and parallelism settings
+    parser = argparse.ArgumentParser(description="Parse the original FinQA data into JSONL.")
+    parser.add_argument("--shard-size", type=int, default=1000, help="Number of instances per shard")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args()
+
+    # Glob pattern to match all JSON files in the 'data/original' directory
+    data_files = glob_files("data/original/*.json")
+
+    # Stream each data file in a worker process, writing the processed instances to shards in 'data/shards'
+    # and combining them into 'data/finqa_data.json' once every file has been parsed
+    shards = parse_files(data_files,
+                         output_path="data/finqa_data.json",
+                         shard_dir="data/shards",
+                         shard_size=args.shard_size,
+                         workers=args.workers)
+    print(f"Parsed {sum(shard['count'] for shard in shards)} instances into {len(shards)} shards")
@@ -1,74 +1,148 @@
-from collections import defaultdict
-from helpers import *
+# Import the argparse module to read the analysis options
+import argparse
+
+# Parse the analysis options
+parser = argparse.ArgumentParser(description="Score the enriched FinQA data.")
+parser.add_argument("--check-parity", action="store_true",
+                    help="Verify the vectorized scores against the scalar essentially_equals checks")
+parser.add_argument("--sweep", action="store_true", help="Report the accuracy over a grid of tolerances")
+parser.add_argument("--store", default=None,
+                    help="Read the columnar results store in this directory instead of the JSONL files")
+parser.add_argument("--model", action="append", default=None, help="Only score this model of the store")
+parser.add_argument("--question-count", type=int, default=None,
+                    help="Only score store instances with this number of questions")
+parser.add_argument("--metrics", default=None,
+                    help="Write the load and scoring times to this file, as JSON if it ends in .json and as "
+                         "Prometheus text otherwise")
+parser.add_argument("--source", action="append", default=list(), metavar="NAME=PATH",
+                    help="Also score this enriched JSONL file, such as the output of an experiment variant")
+parser.add_argument("--verdicts", default="data/verdict_cache.sqlite",
+                    help="Cache of per-item verdicts, so only new or changed JSONL lines are scored")
+parser.add_argument("--rescore", action="store_true", help="Score every item from scratch, bypassing the cache")
+parser.add_argument("--report", nargs="?", const="-", default=None, metavar="PATH",
+                    help="Report the accuracy per slice with bootstrap confidence intervals and compare the models "
+                         "pairwise, as Markdown written to this file, or printed without one")
+parser.add_argument("--plots", default=None, metavar="DIR",
+                    help="Plot the accuracy per slice and the pairwise differences into this directory "
+                         "(needs matplotlib)")
+parser.add_argument("--resamples", type=int, default=2000, help="Bootstrap resamples of the report")
+parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the report intervals")
+parser.add_argument("--seed", type=int, default=0, help="Random seed of the bootstrap resampling")
+args = parser.parse_args()
+
+# NumPy and the scoring modules are imported once the arguments are parsed, so --help returns at once
+import numpy as np
+from metrics import DEFAULT_METRICS
+from scoring import REASONS, check_parity, load_values, score_values, sweep_tolerances
 
 # Define a dictionary to map model names to their respective data sources
 sources = {
-    "claude-3": "finqa_data_enriched_anthropic.json",
-    "gpt-4": "finqa_data_enriched_openai.json"
+    "claude-3": "data/finqa_data_enriched_anthropic.json",
+    "gpt-4": "data/finqa_data_enriched_openai.json"
 }
+sources.update(source.split("=", 1) for source in args.source)
 
-# Initialize a nested defaultdict to store metrics for each model
-metrics = defaultdict(lambda: defaultdict(float))
+# The tolerance grid reported by --sweep
+absolute_tolerances = [0.0, 0.01, 0.1, 0.5, 1.0]
+relative_tolerances = [0.0, 0.001, 0.005, 0.01, 0.05]
 
-for source in sources:
-    filename = sources[source]
-    with open(f"data/{filename}", encoding="utf-8") as f_in:
-        for line in f_in:
-            data = from_json(line)
-            qa_pairs = data["qa_pairs"]
-            source_answers: List[Any] = list()
-            source_response = data["response"]
 
-            # Process source response to extract answers
-            if len(qa_pairs) > 1:
-                source_response = re.sub(r"\\\\n", " ", source_response)
-                source_response = re.sub(r"\\t", " ", source_response)
-                source_response = re.sub(r"\n", " ", source_response)
-                source_answers.extend(re.findall(r"(\S+)", source_response,
-                                                 re.DOTALL | re.IGNORECASE))
-            else:
-                source_answers.append(source_response)
+def score_sources():
+    """
+    Score each source, reusing the cached verdicts of the JSONL items scored by earlier runs.
 
-            # Handle special cases where source response starts with specific text
-            if source_response.startswith("The document"):
-                source_answers.extend([None for _ in range(len(qa_pairs))])
+    Yields:
+        Tuple[str, np.ndarray, Callable]: The source name, the number of items per entry of REASONS, and a
+        function returning the target and predicted values of the source.
+    """
+    if args.store:
+        # Only the partitions and row groups matching the filters are read, and only the value columns
+        from results_store import load_values as load_store_values
+        with DEFAULT_METRICS.span("score_load", source=args.store):
+            values = load_store_values(args.store, args.model, args.question_count)
+        for (provider, model, run), (targets, predictions) in sorted(values.items()):
+            source = f"{provider}/{model}/{run}"
+            # Score every pair at once, recording which rule each correct pair matched
+            with DEFAULT_METRICS.span("score", source=source):
+                reasons = score_values(targets, predictions)
+            DEFAULT_METRICS.increment("scoring_items_total", len(reasons), source=source)
+            yield source, np.bincount(reasons, minlength=len(REASONS)), lambda: (targets, predictions)
+    elif args.rescore:
+        for source, file_path in sources.items():
+            # Extract the target and predicted value of every question-answer pair into arrays
+            with DEFAULT_METRICS.span("score_load", source=source):
+                targets, predictions = load_values(file_path)
+            with DEFAULT_METRICS.span("score", source=source):
+                reasons = score_values(targets, predictions)
+            DEFAULT_METRICS.increment("scoring_items_total", len(reasons), source=source)
+            yield source, np.bincount(reasons, minlength=len(REASONS)), lambda: (targets, predictions)
+    else:
+        from verdicts import VerdictCache
+        with VerdictCache(args.verdicts) as verdicts:
+            for source, file_path in sources.items():
+                # Only the lines added or changed since the last run are parsed and scored
+                with DEFAULT_METRICS.span("score", source=source):
+                    stats = verdicts.update(source, file_path)
+                DEFAULT_METRICS.increment("scoring_items_total", stats["scored_items"], source=source)
+                print(f"Source {source}. Verdict cache: {stats}.")
+                yield source, verdicts.totals(source), lambda: verdicts.values(source)[:2]
 
-            # Compare source answers with target answers and update metrics
-            for i in range(len(qa_pairs)):
-                source_answer = source_answers[i]
-                target_answer = qa_pairs[i]['answer']
 
-                # Convert yes/no answers to float if needed
-                if is_yes_or_no_answer(qa_pairs[i]['answer']):
-                    target_answer = str(yes_or_no_answer_to_float(qa_pairs[i]['answer']))
-                if is_yes_or_no_answer(source_answers[i]):
-                    source_answer = str(yes_or_no_answer_to_float(source_answers[i]))
+for source, counts, read_values in score_sources():
+    correct = counts[1:].sum()
+    accuracy = correct / counts.sum()
+    print(f"Source {source}. Accuracy: {accuracy}.")
+    print("  " + ", ".join(f"{reason}: {count}" for reason, count in zip(REASONS, counts)))
 
-                # If target answer is empty, use source answer
-                if len(qa_pairs[i]['answer'].strip()) == 0:
-                    target_answer = source_answer
+    if args.check_parity or args.sweep:
+        targets, predictions = read_values()
 
-                # Parse numerical values from answers
-                target_value = parse_numerical_values(target_answer)[0]
-                source_values = parse_numerical_values(source_answer)
-                source_value = source_values[0] if len(source_values) else math.nan
-                question = qa_pairs[i]['question']
+    if args.check_parity:
+        # Any disagreement with the scalar checks is a bug in the vectorized scoring
+        mismatches = check_parity(targets, predictions)
+        print(f"  Parity with essentially_equals: {len(targets) - len(mismatches)}/{len(targets)} items agree.")
+        for index in mismatches[:10]:
+            print(f"    Item {index}: target {targets[index]}, prediction {predictions[index]}")
 
-                # Update metrics based on answer comparison
-                if essentially_equals(target_value, source_value):
-                    metrics[source]["correct"] += 1
-                elif essentially_equals(abs(target_value), abs(source_value)):
-                    metrics[source]["correct"] += 1
-                elif essentially_equals(100 * abs(target_value), abs(source_value)):
-                    metrics[source]["correct"] += 1
-                elif essentially_equals(abs(target_value), 100 * abs(source_value)):
-                    metrics[source]["correct"] += 1
-                else:
-                    metrics[source]["incorrect"] += 1
+    if args.sweep:
+        # Evaluate the whole tolerance grid in one pass over the arrays
+        grid = sweep_tolerances(targets, predictions, absolute_tolerances, relative_tolerances)
+        print("  Accuracy by absolute (rows) and relative (columns) tolerance:")
+        print("  " + "".join(f"{tolerance:>9}" for tolerance in ["abs/rel"] + relative_tolerances))
+        for absolute_tolerance, row in zip(absolute_tolerances, grid):
+            print("  " + f"{absolute_tolerance:>9}" + "".join(f"{value:>9.4f}" for value in row))
 
-# Calculate and print the accuracy for each data source.
-for source in sources:
-    correct = metrics[source]["correct"]
-    incorrect = metrics[source]["incorrect"]
-    accuracy = correct / (correct + incorrect)
-    print(f"Source {source}. Accuracy: {accuracy}.")
+if args.report or args.plots:
+    import analysis
+    # Every model is read into one item table, so the resamples are drawn once and shared by all the models
+    with DEFAULT_METRICS.span("analysis_load"):
+        if args.store:
+            from results_store import load_items as load_store_items
+            items = {"/".join(name): arrays for name, arrays in sorted(
+                load_store_items(args.store, args.model, args.question_count).items())}
+        else:
+            items = {source: analysis.load_items(file_path) for source, file_path in sources.items()}
+        table = analysis.ItemTable.from_items(items)
+    with DEFAULT_METRICS.span("analysis"):
+        report = analysis.analyze(table, args.resamples, args.confidence, args.seed)
+    if args.report:
+        text = analysis.format_report(report)
+        if args.report == "-":
+            print(text)
+        else:
+            with open(args.report, "w", encoding="utf-8") as f_out:
+                f_out.write(text)
+            print(f"Report on {len(table.models)} models and {table.reasons.shape[1]} paired items written to "
+                  f"{args.report}")
+    if args.plots:
+        try:
+            paths = analysis.plot_report(report, args.plots)
+        except ImportError:
+            raise SystemExit("Plotting needs matplotlib: pip install matplotlib")
+        print(f"Plots written to {', '.join(paths)}")
+
+if args.metrics:
+    DEFAULT_METRICS.write(args.metrics)
+    items = DEFAULT_METRICS.value("scoring_items_total")
+    seconds = DEFAULT_METRICS.histogram("score_seconds").sum
+    print(f"Metrics written to {args.metrics}, scored {items / seconds if seconds else 0:.0f} items per second")
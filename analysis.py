@@ -0,0 +1,323 @@
+import os  # Module for file system operations
+from typing import Any, Dict, List, Optional, Tuple  # Type hints for variables and functions
+
+import numpy as np  # NumPy, a library for numerical computing
+
+from helpers import create_instance_key, from_json, is_yes_or_no_answer
+from scoring import REASONS, extract_pair_values, score_values
+
+# The reasons that count as correct without rescaling either value by 100
+STRICT_REASONS = (REASONS.index("exact"), REASONS.index("absolute"))
+
+# The largest number of resampling weights drawn at once, bounding the memory of a bootstrap to a few tens of MB
+CHUNK_CELLS = 1 << 22
+
+
+def load_items(file_path: str) -> Dict[str, np.ndarray]:
+    """
+    Extract the items of an enriched JSONL file, with what the slices of a report need.
+
+    Args:
+        file_path (str): The path of the enriched JSONL file.
+
+    Returns:
+        Dict[str, np.ndarray]: Per question-answer pair, the item "id" (instance key and question index),
+        the "question_count" of its instance, whether its gold answer is "yes_no", and its float64 "target"
+        and "predicted" values.
+    """
+    ids, question_counts, yes_no, targets, predictions = list(), list(), list(), list(), list()
+    with open(file_path, encoding="utf-8") as f_in:
+        for line in f_in:
+            data = from_json(line)
+            key = create_instance_key(data)
+            qa_pairs = data["qa_pairs"]
+            for qa_index, (qa_pair, (target, predicted)) in enumerate(zip(qa_pairs, extract_pair_values(data))):
+                ids.append(f"{key}:{qa_index}")
+                question_counts.append(len(qa_pairs))
+                yes_no.append(is_yes_or_no_answer(qa_pair["answer"]))
+                targets.append(target)
+                predictions.append(predicted)
+    return {
+        "id": np.array(ids, dtype=str),
+        "question_count": np.array(question_counts, dtype=np.int8),
+        "yes_no": np.array(yes_no, dtype=bool),
+        "target": np.array(targets, dtype=np.float64),
+        "predicted": np.array(predictions, dtype=np.float64),
+    }
+
+
+class ItemTable:
+    """
+    The scoring reason of every item for every model, over the items all the models answered, so models are
+    compared on the same items.
+
+    Args:
+        models (List[str]): The model names, one per row.
+        reasons (np.ndarray): The index into REASONS of each item, shape (models, items).
+        question_counts (np.ndarray): The number of questions of the instance of each item.
+        yes_no (np.ndarray): Whether the gold answer of each item is yes or no.
+        dropped (Dict[str, int]): The number of items of each model left out because another model lacks them.
+    """
+
+    def __init__(self,
+                 models: List[str],
+                 reasons: np.ndarray,
+                 question_counts: np.ndarray,
+                 yes_no: np.ndarray,
+                 dropped: Optional[Dict[str, int]] = None):
+        self.models = models
+        self.reasons = reasons
+        self.question_counts = question_counts
+        self.yes_no = yes_no
+        self.dropped = dropped or dict()
+
+    @classmethod
+    def from_items(cls, items: Dict[str, Dict[str, np.ndarray]]) -> "ItemTable":
+        """
+        Pair the items of several models by item ID and score them all at once.
+
+        Args:
+            items (Dict[str, Dict[str, np.ndarray]]): The items of each model, as returned by load_items. An item
+                listed twice for a model is scored once, from its first occurrence.
+
+        Returns:
+            ItemTable: The table over the items every model answered.
+        """
+        unique = dict()
+        common = None
+        for model, arrays in items.items():
+            ids, first = np.unique(arrays["id"], return_index=True)
+            unique[model] = (ids, first)
+            common = ids if common is None else np.intersect1d(common, ids, assume_unique=True)
+        if common is None:
+            raise ValueError("No models to analyze")
+
+        models = list(items)
+        reasons = np.zeros((len(models), len(common)), dtype=np.int8)
+        dropped = dict()
+        for row, model in enumerate(models):
+            ids, first = unique[model]
+            # The position in the model's arrays of each common item, found by binary search over its sorted IDs
+            positions = first[np.searchsorted(ids, common)]
+            arrays = items[model]
+            reasons[row] = score_values(arrays["target"][positions], arrays["predicted"][positions])
+            dropped[model] = len(ids) - len(common)
+            if row == 0:
+                question_counts = arrays["question_count"][positions]
+                yes_no = arrays["yes_no"][positions]
+        return cls(models, reasons, question_counts, yes_no, dropped)
+
+    def slices(self) -> Dict[str, np.ndarray]:
+        """
+        Build the item masks of the slices reported.
+
+        Returns:
+            Dict[str, np.ndarray]: The boolean mask of each slice, by name; empty slices are left out.
+        """
+        masks = {
+            "all": np.ones(len(self.yes_no), dtype=bool),
+            "1 question": self.question_counts == 1,
+            "2 questions": self.question_counts == 2,
+            "yes/no": self.yes_no,
+            "numeric": ~self.yes_no,
+        }
+        return {name: mask for name, mask in masks.items() if mask.any()}
+
+
+def bootstrap_means(values: np.ndarray, resamples: int = 2000, seed: int = 0) -> np.ndarray:
+    """
+    Compute the mean of each row over bootstrap resamples of the columns, sharing the resamples between rows.
+
+    Each resample is a vector of weights counting how often each item was drawn, so a chunk of resamples is one
+    matrix product with the values: every model and metric is resampled at once, without a Python loop over
+    the resamples. The rows share the same draws, so differences between rows are paired.
+
+    Args:
+        values (np.ndarray): The values, shape (rows, items), such as the correctness of each model.
+        resamples (int): The number of bootstrap resamples.
+        seed (int): The random seed, so reports are reproducible.
+
+    Returns:
+        np.ndarray: The mean of each row in each resample, shape (resamples, rows).
+    """
+    rows, count = values.shape
+    means = np.empty((resamples, rows))
+    if count == 0:
+        means.fill(np.nan)
+        return means
+    rng = np.random.default_rng(seed)
+    values = values.astype(np.float32).T
+    chunk = max(1, min(resamples, CHUNK_CELLS // count))
+    for start in range(0, resamples, chunk):
+        size = min(chunk, resamples - start)
+        draws = rng.integers(0, count, size=(size, count))
+        # Offset the draws of each resample into a block of its own, so one bincount counts them all
+        weights = np.bincount((draws + (np.arange(size) * count)[:, None]).ravel(), minlength=size * count)
+        means[start:start + size] = weights.reshape(size, count).astype(np.float32) @ values / count
+    return means
+
+
+def analyze(table: ItemTable, resamples: int = 2000, confidence: float = 0.95, seed: int = 0) -> Dict[str, Any]:
+    """
+    Estimate the accuracy of every model on every slice with bootstrap confidence intervals, and compare every
+    pair of models on all items.
+
+    Args:
+        table (ItemTable): The paired items.
+        resamples (int): The number of bootstrap resamples.
+        confidence (float): The confidence level of the intervals.
+        seed (int): The random seed.
+
+    Returns:
+        Dict[str, Any]: The "slices", each with its number of "items" and, per model, the "accuracy", its
+        interval "low" and "high", the "strict" accuracy, which does not count answers off by a factor of
+        100, and the "percent_scaled" share of items that only the percent rules count correct; and the
+        "comparisons" of every pair of models, with the accuracy "difference", its interval and the
+        two-sided bootstrap "p_value". Also the "resamples" and "confidence" used.
+    """
+    tail = (1 - confidence) / 2 * 100
+    correct = table.reasons > 0
+    strict = np.isin(table.reasons, STRICT_REASONS)
+    model_count = len(table.models)
+    report = {"resamples": resamples, "confidence": confidence, "slices": dict(), "comparisons": list(),
+              "dropped": table.dropped}
+    for name, mask in table.slices().items():
+        # Accuracy and strict accuracy of every model are resampled together, on the same draws
+        values = np.concatenate([correct[:, mask], strict[:, mask]])
+        means = bootstrap_means(values, resamples, seed)
+        low, high = np.percentile(means[:, :model_count], [tail, 100 - tail], axis=0)
+        accuracy = correct[:, mask].mean(axis=1)
+        strict_accuracy = strict[:, mask].mean(axis=1)
+        report["slices"][name] = {
+            "items": int(mask.sum()),
+            "models": {model: {"accuracy": float(accuracy[row]),
+                               "low": float(low[row]),
+                               "high": float(high[row]),
+                               "strict": float(strict_accuracy[row]),
+                               "percent_scaled": float(accuracy[row] - strict_accuracy[row])}
+                       for row, model in enumerate(table.models)},
+        }
+        if name == "all":
+            # Every pair of models at once: the resampled differences, shape (resamples, models, models)
+            differences = means[:, :model_count, None] - means[:, None, :model_count]
+            difference_low, difference_high = np.percentile(differences, [tail, 100 - tail], axis=0)
+            p_values = np.minimum(1.0, 2 * np.minimum((differences <= 0).mean(axis=0),
+                                                      (differences >= 0).mean(axis=0)))
+            for first in range(model_count):
+                for second in range(first + 1, model_count):
+                    report["comparisons"].append({
+                        "model_a": table.models[first],
+                        "model_b": table.models[second],
+                        "difference": float(accuracy[first] - accuracy[second]),
+                        "low": float(difference_low[first, second]),
+                        "high": float(difference_high[first, second]),
+                        "p_value": float(p_values[first, second]),
+                    })
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """
+    Render a report as Markdown tables.
+
+    Args:
+        report (Dict[str, Any]): The report, as returned by analyze.
+
+    Returns:
+        str: The Markdown report.
+    """
+    level = f"{report['confidence']:.0%}"
+    lines = [f"# Accuracy with {level} bootstrap confidence intervals ({report['resamples']} paired resamples)", ""]
+    for name, result in report["slices"].items():
+        lines += [f"## {name} ({result['items']} items)", "",
+                  f"| model | accuracy | {level} CI | strict accuracy | percent-scaled |",
+                  "|---|---|---|---|---|"]
+        for model, stats in result["models"].items():
+            lines.append(f"| {model} | {stats['accuracy']:.4f} | {stats['low']:.4f} to {stats['high']:.4f} | "
+                         f"{stats['strict']:.4f} | {stats['percent_scaled']:.4f} |")
+        lines.append("")
+    if report["comparisons"]:
+        lines += ["## Paired differences on all items", "",
+                  f"| model A | model B | A - B | {level} CI | p |", "|---|---|---|---|---|"]
+        for comparison in report["comparisons"]:
+            # No resample reversing the difference only bounds the p-value by the number of resamples
+            p_value = f"{comparison['p_value']:.4f}" if comparison["p_value"] else f"< {1 / report['resamples']:.4f}"
+            lines.append(f"| {comparison['model_a']} | {comparison['model_b']} | {comparison['difference']:+.4f} | "
+                         f"{comparison['low']:+.4f} to {comparison['high']:+.4f} | {p_value} |")
+        lines.append("")
+    dropped = {model: count for model, count in report["dropped"].items() if count}
+    if dropped:
+        lines.append("Items left out because another model lacks them: "
+                     + ", ".join(f"{model} {count}" for model, count in dropped.items()))
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def plot_report(report: Dict[str, Any], output_dir: str) -> List[str]:
+    """
+    Plot the accuracy of every model on every slice with its interval, and the paired differences between
+    models.
+
+    Args:
+        report (Dict[str, Any]): The report, as returned by analyze.
+        output_dir (str): The directory the PNG files are written to.
+
+    Returns:
+        List[str]: The paths of the plots written.
+    """
+    # Matplotlib is only needed for plots, and its non-interactive backend works without a display
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = list()
+    slices = report["slices"]
+    models = list(next(iter(slices.values()))["models"])
+    positions = np.arange(len(models))
+
+    # One panel per slice, with a horizontal interval per model
+    figure, axes = plt.subplots(1, len(slices), figsize=(4 * len(slices), 1 + 0.35 * len(models)),
+                                sharey=True, squeeze=False)
+    for axis, (name, result) in zip(axes[0], slices.items()):
+        stats = [result["models"][model] for model in models]
+        accuracy = np.array([entry["accuracy"] for entry in stats])
+        errors = np.array([[entry["accuracy"] - entry["low"] for entry in stats],
+                           [entry["high"] - entry["accuracy"] for entry in stats]])
+        axis.errorbar(accuracy, positions, xerr=errors, fmt="o", capsize=3)
+        axis.set_title(f"{name} ({result['items']})")
+        axis.set_xlabel("accuracy")
+        axis.grid(axis="x", alpha=0.3)
+    axes[0][0].set_yticks(positions)
+    axes[0][0].set_yticklabels(models)
+    axes[0][0].invert_yaxis()
+    figure.tight_layout()
+    paths.append(os.path.join(output_dir, "accuracy_by_slice.png"))
+    figure.savefig(paths[-1], dpi=150)
+    plt.close(figure)
+
+    if len(models) > 1:
+        # The paired difference of every pair of models, marking those whose interval excludes zero
+        matrix = np.zeros((len(models), len(models)))
+        significant = np.zeros_like(matrix, dtype=bool)
+        index = {model: position for position, model in enumerate(models)}
+        for comparison in report["comparisons"]:
+            first, second = index[comparison["model_a"]], index[comparison["model_b"]]
+            matrix[first, second], matrix[second, first] = comparison["difference"], -comparison["difference"]
+            significant[first, second] = significant[second, first] = comparison["low"] > 0 or comparison["high"] < 0
+        limit = max(np.abs(matrix).max(), 1e-9)
+        figure, axis = plt.subplots(figsize=(1.5 + 0.5 * len(models), 1 + 0.5 * len(models)))
+        image = axis.imshow(matrix, cmap="RdBu", vmin=-limit, vmax=limit)
+        for (row, column), flag in np.ndenumerate(significant):
+            if flag:
+                axis.text(column, row, "*", ha="center", va="center")
+        axis.set_xticks(positions)
+        axis.set_xticklabels(models, rotation=90)
+        axis.set_yticks(positions)
+        axis.set_yticklabels(models)
+        axis.set_title("accuracy of row minus column (* interval excludes 0)")
+        figure.colorbar(image, ax=axis)
+        figure.tight_layout()
+        paths.append(os.path.join(output_dir, "pairwise_differences.png"))
+        figure.savefig(paths[-1], dpi=150)
+        plt.close(figure)
+    return paths
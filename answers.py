@@ -0,0 +1,184 @@
+import math  # Module providing mathematical functions
+import re  # Module for regular expressions
+from typing import List, Optional, Sequence  # Type hints for variables and functions
+
+# A single pattern recognising every token an answer is made of, so a response is tokenized in one pass.
+# Separators between answers are tabs and newlines, including their escaped forms. Numbers may carry a
+# currency sign, thousands separators, a percent sign and a leading minus, or be wrapped in parentheses
+# to mark them as negative. A minus right after a digit is the hyphen of a range such as 2019-2020, not a sign.
+TOKEN_PATTERN = re.compile(r"""
+    (?P<separator>\t|\n|\\t|\\n)
+  | (?P<equals>=)
+  | (?P<negative>\(\s*\$?\s*(?P<negative_value>(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?|\.\d+)\s*%?\s*\))
+  | (?P<number>(?:(?<!\d)(?P<sign>[-−]))?\$?\s*(?P<value>(?:\d{1,3}(?:,\d{3})+(?!\d)|\d+)(?:\.\d+)?|\.\d+)%?)
+  | (?P<word>[^\W\d_]+)
+""", re.VERBOSE)
+
+# The answers recognised as booleans when they make up a whole answer, and their values
+BOOLEAN_WORDS = {"yes": 1.0, "no": 0.0}
+
+
+class Segment:
+    """
+    The tokens of a single answer within a response.
+    """
+
+    __slots__ = ("values", "words", "tail")
+
+    def __init__(self):
+        # The numbers in the answer, in order
+        self.values = list()
+        # The words in the answer, lowercased
+        self.words = list()
+        # The numbers after the last "=", if there is one
+        self.tail = None
+
+    def value(self) -> float:
+        """
+        Reduce the answer to a single value.
+
+        Returns:
+            float: The first number after the last "=", otherwise the first number, otherwise 1 or 0 for a
+            lone yes or no, otherwise NaN.
+        """
+        if self.tail:
+            return self.tail[0]
+        if self.values:
+            return self.values[0]
+        if len(self.words) == 1 and self.words[0] in BOOLEAN_WORDS:
+            return BOOLEAN_WORDS[self.words[0]]
+        return math.nan
+
+
+def tokenize(text: str) -> List[Segment]:
+    """
+    Split a response into answers and tokenize each of them, in a single pass over the text.
+
+    Args:
+        text (str): The response.
+
+    Returns:
+        List[Segment]: The non-empty answers, in order.
+    """
+    segments = list()
+    segment = Segment()
+    for match in TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == "separator":
+            # Close the current answer unless it is empty, which collapses runs of separators
+            if segment.values or segment.words:
+                segments.append(segment)
+                segment = Segment()
+        elif kind == "equals":
+            # Only the numbers after the last "=" of an answer count as its result
+            segment.tail = list()
+        elif kind == "word":
+            segment.words.append(match.group("word").lower())
+        else:
+            if kind == "negative":
+                value = -float(match.group("negative_value").replace(",", ""))
+            else:
+                value = float(match.group("value").replace(",", ""))
+                if match.group("sign"):
+                    value = -value
+            segment.values.append(value)
+            if segment.tail is not None:
+                segment.tail.append(value)
+    if segment.values or segment.words:
+        segments.append(segment)
+    return segments
+
+
+def is_refusal(text: Optional[str]) -> bool:
+    """
+    Check whether a response declines to answer, which models signal by describing the document.
+
+    Args:
+        text (Optional[str]): The response.
+
+    Returns:
+        bool: True if the response is missing or starts with "The".
+    """
+    return text is None or text.startswith("The")
+
+
+def parse_answer(text: Optional[str]) -> float:
+    """
+    Parse a single answer into a number.
+
+    Args:
+        text (Optional[str]): The answer, such as "12.5%", "(1,234)", "x = 3" or "yes".
+
+    Returns:
+        float: The value of the answer, or NaN if it holds none.
+    """
+    if is_refusal(text):
+        return math.nan
+    segment = Segment()
+    # Treat the whole text as one answer by folding every segment into one
+    for part in tokenize(text):
+        segment.values.extend(part.values)
+        segment.words.extend(part.words)
+        if part.tail is not None:
+            segment.tail = part.tail
+    return segment.value()
+
+
+def extract_answers(response: Optional[str], count: int) -> List[float]:
+    """
+    Extract the answers to a number of questions from a response.
+
+    A response to several questions is split on tabs and newlines. When that yields fewer answers than
+    questions, the numbers in the response (or its yes/no words) are assigned to the questions in order
+    instead.
+
+    Args:
+        response (Optional[str]): The response.
+        count (int): The number of questions asked.
+
+    Returns:
+        List[float]: One value per question, NaN where no answer was found.
+    """
+    if is_refusal(response):
+        return [math.nan] * count
+    if count == 1:
+        return [parse_answer(response)]
+    segments = tokenize(response)
+    if len(segments) >= count:
+        return [segment.value() for segment in segments[:count]]
+    # The answers were not separated, so fall back to the numbers, or failing that the yes/no words,
+    # in order of appearance
+    values = list()
+    for segment in segments:
+        if segment.values:
+            values.extend(segment.tail or segment.values)
+        else:
+            values.extend(BOOLEAN_WORDS[word] for word in segment.words if word in BOOLEAN_WORDS)
+    return [values[i] if i < len(values) else math.nan for i in range(count)]
+
+
+def parse_answers_batch(texts: Sequence[Optional[str]]) -> List[float]:
+    """
+    Parse a list of single answers.
+
+    Args:
+        texts (Sequence[Optional[str]]): The answers.
+
+    Returns:
+        List[float]: The value of each answer.
+    """
+    return [parse_answer(text) for text in texts]
+
+
+def extract_answers_batch(responses: Sequence[Optional[str]], counts: Sequence[int]) -> List[List[float]]:
+    """
+    Extract the answers from a list of responses.
+
+    Args:
+        responses (Sequence[Optional[str]]): The responses.
+        counts (Sequence[int]): The number of questions asked in each response.
+
+    Returns:
+        List[List[float]]: One list of values per response, with one value per question.
+    """
+    return [extract_answers(response, count) for response, count in zip(responses, counts)]
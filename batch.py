@@ -0,0 +1,438 @@
+import json  # Module for JSON serialization and deserialization
+import os  # Module for file system operations
+import time  # Module for sleeping between status polls
+from abc import ABC, abstractmethod  # Abstract base classes for the provider interface
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple  # Type hints
+
+import requests  # HTTP client used to talk to the batch APIs
+
+from cache import ResponseCache
+from helpers import create_instance_key, create_message_body, from_json, to_json
+from instance_keys import KEY_SCHEMES, KEY_VERSION, key_function
+from journal import EnrichmentJournal
+
+
+class BatchProvider(ABC):
+    """
+    The interface shared by the provider batch APIs.
+
+    A provider turns messages into batch request entries, submits a list of entries as one job, reports
+    whether a job has ended and streams back the results of an ended job by custom ID. Its `params` are the
+    request parameters shared by every entry.
+    """
+
+    # The name used in log messages and cache keys, the same as that of the synchronous provider
+    name = "provider"
+    # The largest number of requests accepted in a single job
+    max_requests = 10000
+
+    @abstractmethod
+    def build_request(self, custom_id: str, message: str) -> Dict[str, Any]:
+        """
+        Build the batch entry for a single message.
+
+        Args:
+            custom_id (str): The ID used to match the result back to the request.
+            message (str): The user message.
+
+        Returns:
+            Dict[str, Any]: The batch entry.
+        """
+
+    @abstractmethod
+    def submit(self, entries: List[Dict[str, Any]]) -> str:
+        """
+        Submit a batch job.
+
+        Args:
+            entries (List[Dict[str, Any]]): The entries built by `build_request`.
+
+        Returns:
+            str: The ID of the submitted job.
+        """
+
+    @abstractmethod
+    def has_ended(self, job_id: str) -> bool:
+        """
+        Check whether a job has finished processing, successfully or not.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            bool: True once the results of the job can be fetched.
+        """
+
+    @abstractmethod
+    def results(self, job_id: str) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        Stream the results of an ended job.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Yields:
+            Tuple[str, Optional[str]]: The custom ID and the response text, or None if the request failed.
+        """
+
+    def cache_key(self, message: str) -> str:
+        """
+        Build the response cache key of a message, which matches that of the synchronous provider sending the
+        same message with the same parameters.
+
+        Args:
+            message (str): The user message.
+
+        Returns:
+            str: The cache key.
+        """
+        return ResponseCache.make_key(self.name, self.params, message)
+
+
+def iter_jsonl_response(response: requests.Response) -> Iterator[Dict[str, Any]]:
+    """
+    Parse a streamed JSONL response body line by line.
+
+    Args:
+        response (requests.Response): A response opened with stream=True.
+
+    Yields:
+        Dict[str, Any]: Each JSON object in the body.
+    """
+    response.raise_for_status()
+    for line in response.iter_lines():
+        if line:
+            yield from_json(line)
+
+
+class AnthropicBatchProvider(BatchProvider):
+    """
+    The Anthropic Message Batches API.
+
+    Args:
+        api_key (str): The Anthropic API key.
+        params (Dict[str, Any]): The message parameters shared by every request, such as model and max_tokens.
+        base_url (str): The API base URL.
+    """
+
+    name = "anthropic"
+    max_requests = 100000
+
+    def __init__(self, api_key: str, params: Dict[str, Any], base_url: str = "https://api.anthropic.com"):
+        self.params = params
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers.update({
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json"
+        })
+
+    def build_request(self, custom_id: str, message: str) -> Dict[str, Any]:
+        return {
+            "custom_id": custom_id,
+            "params": dict(self.params, messages=[{
+                "role": "user",
+                "content": [{"type": "text", "text": message}]
+            }])
+        }
+
+    def submit(self, entries: List[Dict[str, Any]]) -> str:
+        response = self.session.post(f"{self.base_url}/v1/messages/batches",
+                                     data=to_json({"requests": entries}).encode("utf-8"))
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def has_ended(self, job_id: str) -> bool:
+        response = self.session.get(f"{self.base_url}/v1/messages/batches/{job_id}")
+        response.raise_for_status()
+        return response.json()["processing_status"] == "ended"
+
+    def results(self, job_id: str) -> Iterator[Tuple[str, Optional[str]]]:
+        response = self.session.get(f"{self.base_url}/v1/messages/batches/{job_id}")
+        response.raise_for_status()
+        results_url = response.json()["results_url"]
+        with self.session.get(results_url, stream=True) as response:
+            for result in iter_jsonl_response(response):
+                # Errored, canceled and expired requests carry no message
+                if result["result"]["type"] != "succeeded":
+                    yield result["custom_id"], None
+                    continue
+                content = result["result"]["message"]["content"]
+                yield result["custom_id"], content[0]["text"] if content else None
+
+
+class OpenAIBatchProvider(BatchProvider):
+    """
+    The OpenAI Batch API over the chat completions endpoint.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        body (Dict[str, Any]): The chat completion parameters shared by every request, such as model.
+        base_url (str): The API base URL.
+        organization (Optional[str]): The OpenAI organization to bill.
+        message_limit (Optional[int]): The number of characters each message is truncated to, or None to send
+            messages whole.
+    """
+
+    name = "openai"
+    max_requests = 50000
+
+    def __init__(self,
+                 api_key: str,
+                 body: Dict[str, Any],
+                 base_url: str = "https://api.openai.com",
+                 organization: Optional[str] = None,
+                 message_limit: Optional[int] = None):
+        self.params = body
+        self.base_url = base_url.rstrip("/")
+        self.message_limit = message_limit
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+        if organization:
+            self.session.headers.update({"OpenAI-Organization": organization})
+
+    def build_request(self, custom_id: str, message: str) -> Dict[str, Any]:
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": dict(self.params, messages=[{"role": "user", "content": message[:self.message_limit]}])
+        }
+
+    def cache_key(self, message: str) -> str:
+        # Truncate before building the key, so it matches the message actually sent
+        return super().cache_key(message[:self.message_limit])
+
+    def submit(self, entries: List[Dict[str, Any]]) -> str:
+        # The requests are uploaded as a JSONL file, which the batch then refers to
+        payload = "".join(to_json(entry) + "\n" for entry in entries).encode("utf-8")
+        response = self.session.post(f"{self.base_url}/v1/files",
+                                     data={"purpose": "batch"},
+                                     files={"file": ("batch.jsonl", payload, "application/jsonl")})
+        response.raise_for_status()
+        response = self.session.post(f"{self.base_url}/v1/batches", json={
+            "input_file_id": response.json()["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h"
+        })
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def has_ended(self, job_id: str) -> bool:
+        response = self.session.get(f"{self.base_url}/v1/batches/{job_id}")
+        response.raise_for_status()
+        return response.json()["status"] in ("completed", "failed", "expired", "cancelled")
+
+    def results(self, job_id: str) -> Iterator[Tuple[str, Optional[str]]]:
+        response = self.session.get(f"{self.base_url}/v1/batches/{job_id}")
+        response.raise_for_status()
+        job = response.json()
+        # Requests that failed outright are listed in the error file; they are simply not yielded here
+        if job.get("output_file_id") is None:
+            return
+        with self.session.get(f"{self.base_url}/v1/files/{job['output_file_id']}/content",
+                              stream=True) as response:
+            for result in iter_jsonl_response(response):
+                if result.get("error") or result["response"]["status_code"] != 200:
+                    yield result["custom_id"], None
+                    continue
+                body = result["response"]["body"]
+                yield result["custom_id"], body["choices"][0]["message"]["content"].strip()
+
+
+class BatchEnrichment:
+    """
+    Enrich the input instances through a provider batch API, recording the results in a journal.
+
+    Submitted job IDs are saved next to the journal, so a restarted run resumes polling its jobs instead
+    of paying for them again. Requests that fail inside a job are left out of the journal and are
+    resubmitted by the next run. Instances whose response is in the response cache are journalled without
+    being submitted, and harvested responses are added to the cache, shared with the synchronous runs.
+
+    Args:
+        provider (BatchProvider): The batch API to use.
+        journal (EnrichmentJournal): The journal that receives the enriched records.
+        input_path (str): The path of the input JSONL file.
+        message_of (Callable[[Dict[str, Any]], str]): Builds the message for an instance.
+        poll_interval (float): The number of seconds between job status checks.
+        cache (Optional[ResponseCache]): The response cache, or None to submit every pending instance.
+    """
+
+    def __init__(self,
+                 provider: BatchProvider,
+                 journal: EnrichmentJournal,
+                 input_path: str = "data/finqa_data.json",
+                 message_of: Callable[[Dict[str, Any]], str] = create_message_body,
+                 poll_interval: float = 60.0,
+                 cache: Optional[ResponseCache] = None):
+        self.provider = provider
+        self.journal = journal
+        self.input_path = input_path
+        self.message_of = message_of
+        self.poll_interval = poll_interval
+        self.cache = cache
+        self.jobs_path = os.path.splitext(journal.path)[0] + ".batches.json"
+
+    def load_jobs(self) -> Dict[str, List[str]]:
+        """
+        Load the outstanding jobs, moving their keys to the current key scheme if they were saved with another.
+
+        Returns:
+            Dict[str, List[str]]: The instance keys of each outstanding job, by job ID.
+        """
+        if not os.path.isfile(self.jobs_path):
+            return dict()
+        with open(self.jobs_path, encoding="utf-8") as f_in:
+            saved = json.load(f_in)
+        # Files saved before key schemes were versioned hold the jobs alone, with keys of the first scheme
+        jobs, key_version = (saved["jobs"], saved["key_version"]) if "key_version" in saved else (saved, 1)
+        if key_version != KEY_VERSION:
+            old_key_of = key_function(key_version)
+            # Instances that shared a key under the old scheme may not under this one, and harvest gives the
+            # response of an old key to the first instance holding it, so the first one is the one in flight
+            new_keys = dict()
+            for key, data in self.read_instances():
+                new_keys.setdefault(old_key_of(data), key)
+            jobs = {job_id: [new_keys.get(key, key) for key in keys] for job_id, keys in jobs.items()}
+            self.save_jobs(jobs)
+        return jobs
+
+    def save_jobs(self, jobs: Dict[str, List[str]]):
+        """
+        Save the outstanding jobs, replacing the previous file atomically.
+
+        Args:
+            jobs (Dict[str, List[str]]): The instance keys of each outstanding job, by job ID.
+        """
+        with open(self.jobs_path + ".tmp", "w", encoding="utf-8") as f_out:
+            f_out.write(to_json({"key_version": KEY_VERSION, "jobs": jobs}))
+        os.replace(self.jobs_path + ".tmp", self.jobs_path)
+
+    def read_instances(self) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        """
+        Read the input instances with their keys.
+
+        Yields:
+            Tuple[str, Dict[str, Any]]: The instance key and the instance.
+        """
+        with open(self.input_path, encoding="utf-8") as f_in:
+            for line in f_in:
+                data = from_json(line)
+                yield create_instance_key(data), data
+
+    def submit_pending(self, jobs: Dict[str, List[str]]):
+        """
+        Submit jobs for every instance that is neither journalled nor part of an outstanding job.
+
+        Args:
+            jobs (Dict[str, List[str]]): The outstanding jobs, updated in place as jobs are submitted.
+        """
+        skip = self.journal.scan()
+        for keys in jobs.values():
+            skip.update(keys)
+
+        entries, keys = list(), list()
+        cached = 0
+        for key, data in self.read_instances():
+            if key in skip:
+                continue
+            # Identical instances share a key, so only the first one is requested
+            skip.add(key)
+            message = self.message_of(data)
+            if self.cache is not None:
+                # A response cached by an earlier run, batch or not, costs nothing
+                response = self.cache.get(self.provider.cache_key(message))
+                if response is not None:
+                    data["response"] = response
+                    self.journal.append(data, key)
+                    cached += 1
+                    continue
+            entries.append(self.provider.build_request(key, message))
+            keys.append(key)
+            if len(entries) == self.provider.max_requests:
+                self.submit(jobs, entries, keys)
+                entries, keys = list(), list()
+        if entries:
+            self.submit(jobs, entries, keys)
+        if cached:
+            print(f"Journalled {cached} cached responses without submitting them")
+
+    def submit(self, jobs: Dict[str, List[str]], entries: List[Dict[str, Any]], keys: List[str]):
+        job_id = self.provider.submit(entries)
+        print(f"Submitted {self.provider.name} batch {job_id} with {len(entries)} requests")
+        jobs[job_id] = keys
+        self.save_jobs(jobs)
+
+    def harvest(self, job_id: str) -> Tuple[int, int]:
+        """
+        Append the successful results of an ended job to the journal.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            Tuple[int, int]: The number of successful and failed requests.
+        """
+        responses = dict()
+        failed = 0
+        for custom_id, text in self.provider.results(job_id):
+            if text is None:
+                failed += 1
+            else:
+                responses[custom_id] = text
+        # Stream the input again to attach each response to its instance, in input order
+        succeeded = 0
+        for key, data in self.read_instances():
+            if key in responses:
+                self.record(data, key, responses.pop(key))
+                succeeded += 1
+        # Jobs submitted before the key scheme changed use keys of an older scheme as custom IDs
+        if responses:
+            old_key_ofs = [key_function(version) for version in KEY_SCHEMES if version != KEY_VERSION]
+            for key, data in self.read_instances():
+                for old_key_of in old_key_ofs:
+                    try:
+                        custom_id = old_key_of(data)
+                    except ImportError:
+                        continue
+                    if custom_id in responses:
+                        self.record(data, key, responses.pop(custom_id))
+                        succeeded += 1
+                        break
+        return succeeded, failed
+
+    def record(self, data: Dict[str, Any], key: str, response: str):
+        """
+        Append a harvested response to the journal and the response cache.
+
+        Args:
+            data (Dict[str, Any]): The instance.
+            key (str): The instance key.
+            response (str): The response text.
+        """
+        if self.cache is not None:
+            self.cache.put(self.provider.cache_key(self.message_of(data)), self.provider.name,
+                           self.provider.params, response)
+        data["response"] = response
+        self.journal.append(data, key)
+
+    def run(self):
+        """
+        Submit the pending instances and poll until every outstanding job has been harvested.
+        """
+        jobs = self.load_jobs()
+        self.submit_pending(jobs)
+        while jobs:
+            for job_id in list(jobs):
+                if not self.provider.has_ended(job_id):
+                    continue
+                succeeded, failed = self.harvest(job_id)
+                print(f"Harvested {self.provider.name} batch {job_id}: {succeeded} succeeded, {failed} failed")
+                del jobs[job_id]
+                self.save_jobs(jobs)
+            if jobs:
+                time.sleep(self.poll_interval)
+        # Every job has been harvested, so there is nothing left to resume
+        if os.path.isfile(self.jobs_path):
+            os.remove(self.jobs_path)
@@ -0,0 +1,109 @@
+# Microbenchmark of the single-pass answer extractor against the regex chain in helpers
+import argparse
+import math
+import random
+import re
+import time
+from typing import Any, List, Optional
+
+from answers import extract_answers_batch
+from helpers import is_yes_or_no_answer, parse_numerical_values, yes_or_no_answer_to_float
+
+# Answer shapes seen in model responses
+ANSWERS = ["12.5", "-3.2", "45%", "0.45", "yes", "No", "1,234.5", "(12)", "$1,234", "x = 14.2",
+           "The document does not say", "2019", "-0.07", "100"]
+
+
+def legacy_extract(response: Optional[str], count: int) -> List[float]:
+    """
+    Extract the answers from a response with the chain of regular expressions used before answers.py.
+
+    Args:
+        response (Optional[str]): The response.
+        count (int): The number of questions asked.
+
+    Returns:
+        List[float]: One value per question.
+    """
+    source_answers: List[Any] = list()
+    # Process source response to extract answers
+    if count > 1:
+        response = re.sub(r"\\\\n", " ", response)
+        response = re.sub(r"\\t", " ", response)
+        response = re.sub(r"\n", " ", response)
+        source_answers.extend(re.findall(r"(\S+)", response, re.DOTALL | re.IGNORECASE))
+    else:
+        source_answers.append(response)
+    # Handle special cases where source response starts with specific text
+    if response.startswith("The document"):
+        source_answers.extend([None for _ in range(count)])
+    values = list()
+    for i in range(count):
+        source_answer = source_answers[i] if i < len(source_answers) else None
+        # Convert yes/no answers to float if needed
+        if is_yes_or_no_answer(source_answer):
+            source_answer = str(yes_or_no_answer_to_float(source_answer))
+        source_values = parse_numerical_values(source_answer)
+        values.append(source_values[0] if len(source_values) else math.nan)
+    return values
+
+
+def generate_responses(count: int, seed: int = 0):
+    """
+    Generate synthetic responses to one or two questions.
+
+    Args:
+        count (int): The number of responses.
+        seed (int): The random seed.
+
+    Returns:
+        Tuple[List[str], List[int]]: The responses and the number of questions in each.
+    """
+    rng = random.Random(seed)
+    responses, counts = list(), list()
+    for _ in range(count):
+        questions = rng.choice([1, 2])
+        answers = [rng.choice(ANSWERS) for _ in range(questions)]
+        responses.append(rng.choice(["\t", "\n", "\\n"]).join(answers))
+        counts.append(questions)
+    return responses, counts
+
+
+def best_time(function, repeat: int) -> float:
+    """
+    Time a function, keeping the best of several runs.
+
+    Args:
+        function: The function to time, called without arguments.
+        repeat (int): The number of runs.
+
+    Returns:
+        float: The fastest run time in seconds.
+    """
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the answer extractors.")
+    parser.add_argument("--responses", type=int, default=100000, help="Number of synthetic responses")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs per extractor")
+    args = parser.parse_args()
+
+    responses, counts = generate_responses(args.responses)
+    legacy_time = best_time(lambda: [legacy_extract(r, c) for r, c in zip(responses, counts)], args.repeat)
+    new_time = best_time(lambda: extract_answers_batch(responses, counts), args.repeat)
+
+    # Count the answers where both extractors agree, treating two NaNs as agreement
+    legacy = [legacy_extract(r, c) for r, c in zip(responses, counts)]
+    new = extract_answers_batch(responses, counts)
+    pairs = [(a, b) for x, y in zip(legacy, new) for a, b in zip(x, y)]
+    agreed = sum(1 for a, b in pairs if a == b or (math.isnan(a) and math.isnan(b)))
+
+    print(f"helpers regex chain: {legacy_time:.3f}s ({args.responses / legacy_time:,.0f} responses/s)")
+    print(f"answers.py:          {new_time:.3f}s ({args.responses / new_time:,.0f} responses/s)")
+    print(f"Speedup: {legacy_time / new_time:.2f}x. Agreement: {agreed}/{len(pairs)} answers.")
@@ -0,0 +1,288 @@
+# Benchmark of every pipeline stage on synthetic FinQA-shaped data
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from enrichment import EnrichmentEngine, RateLimitError
+from helpers import create_instance_key, create_message_body, from_json, to_json
+from journal import EnrichmentJournal
+from parsing import parse_files
+from scoring import load_values, score_values
+
+# Vocabulary for the synthetic documents
+WORDS = ["revenue", "net", "income", "increased", "decreased", "million", "compared", "fiscal", "year",
+         "operating", "expenses", "total", "assets", "cash", "flow", "the", "of", "in", "and", "to"]
+
+
+def generate_instance(rng: random.Random, index: int, text_words: int, table_rows: int, questions: int):
+    """
+    Generate one instance in the format of the original FinQA data.
+
+    Args:
+        rng (random.Random): The random number generator.
+        index (int): The position of the instance, used to make its document unique.
+        text_words (int): The number of words in each of the pre-text and post-text.
+        table_rows (int): The number of table rows.
+        questions (int): The number of question-answer pairs.
+
+    Returns:
+        Dict[str, Any]: The instance.
+    """
+    def sentences(count: int) -> List[str]:
+        words = [rng.choice(WORDS) for _ in range(count)]
+        return [" ".join(words[i:i + 12]) + " ." for i in range(0, count, 12)]
+
+    instance = {
+        "id": f"synthetic-{index}",
+        "pre_text": [f"document {index}"] + sentences(text_words),
+        "post_text": sentences(text_words),
+        "table_ori": [["", "2019", "2018"]] + [[rng.choice(WORDS), f"${rng.randint(1, 9999):,}",
+                                                 f"{rng.uniform(-50, 50):.1f}%"] for _ in range(table_rows)],
+    }
+    keys = ["qa"] if questions == 1 else [f"qa_{i}" for i in range(questions)]
+    for key in keys:
+        answer = rng.choice([f"{rng.uniform(-100, 100):.1f}", f"{rng.uniform(0, 50):.2f}%", "yes"])
+        instance[key] = {"question": f"what was the change in {rng.choice(WORDS)}?", "answer": answer}
+    return instance
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Calculate a percentile by nearest rank.
+
+    Args:
+        values (List[float]): The measurements.
+        fraction (float): The percentile as a fraction, such as 0.99.
+
+    Returns:
+        float: The percentile, or NaN if there are no measurements.
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(items: int, elapsed: float, latencies: List[float]) -> Dict[str, Any]:
+    """
+    Summarize a stage run.
+
+    Args:
+        items (int): The number of items processed.
+        elapsed (float): The wall time of the stage in seconds.
+        latencies (List[float]): The per-item latencies in seconds.
+
+    Returns:
+        Dict[str, Any]: The throughput, latency percentiles and peak RSS of the stage.
+    """
+    return {
+        "items": items,
+        "seconds": elapsed,
+        "throughput": items / elapsed if elapsed else float("inf"),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        # On Linux ru_maxrss is in kilobytes
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def timed_map(function: Callable, items: List[Any]) -> Dict[str, Any]:
+    """
+    Apply a function to every item, timing each call.
+
+    Args:
+        function (Callable): The function under test.
+        items (List[Any]): The inputs.
+
+    Returns:
+        Dict[str, Any]: The stage summary.
+    """
+    latencies = list()
+    start = time.perf_counter()
+    for item in items:
+        call_start = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(len(items), time.perf_counter() - start, latencies)
+
+
+def read_records(work_dir: str) -> List[Dict[str, Any]]:
+    """
+    Read the parsed instances of a benchmark run.
+
+    Args:
+        work_dir (str): The benchmark working directory.
+
+    Returns:
+        List[Dict[str, Any]]: The parsed instances.
+    """
+    with open(os.path.join(work_dir, "finqa_data.json"), encoding="utf-8") as f_in:
+        return [from_json(line) for line in f_in]
+
+
+def stage_parse(work_dir: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    original_dir = os.path.join(work_dir, "original")
+    data_files = sorted(os.path.join(original_dir, name) for name in os.listdir(original_dir))
+    start = time.perf_counter()
+    shards = parse_files(data_files,
+                         output_path=os.path.join(work_dir, "finqa_data.json"),
+                         shard_dir=os.path.join(work_dir, "shards"),
+                         workers=config["workers"])
+    elapsed = time.perf_counter() - start
+    # Parsing is measured per file, so there are no per-instance latencies
+    return summarize(sum(shard["count"] for shard in shards), elapsed, [])
+
+
+def stage_prompt(work_dir: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    return timed_map(create_message_body, read_records(work_dir))
+
+
+def stage_hash(work_dir: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    return timed_map(create_instance_key, read_records(work_dir))
+
+
+def stage_enrich(work_dir: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    rng = random.Random(config["seed"])
+    latencies = list()
+
+    async def mock_provider(message: str) -> str:
+        # Simulate a provider with log-normal latency that sometimes rejects requests
+        start = time.perf_counter()
+        await asyncio.sleep(config["latency"] * rng.lognormvariate(0, 0.5))
+        if rng.random() < config["error_rate"]:
+            raise RateLimitError("Mock rate limit", retry_after=config["latency"])
+        latencies.append(time.perf_counter() - start)
+        return "42"
+
+    journal_path = os.path.join(work_dir, "finqa_data_enriched_mock.journal")
+    if os.path.isfile(journal_path):
+        os.remove(journal_path)
+    records = read_records(work_dir)
+    engine = EnrichmentEngine(mock_provider,
+                              concurrency=config["concurrency"],
+                              requests_per_minute=1e9,
+                              tokens_per_minute=1e12,
+                              max_retries=100,
+                              base_backoff=config["latency"])
+    start = time.perf_counter()
+    with EnrichmentJournal(journal_path, fsync=False) as journal:
+        engine.run(records, journal.append)
+        journal.compact(os.path.join(work_dir, "finqa_data.json"),
+                        os.path.join(work_dir, "finqa_data_enriched_mock.json"))
+    return summarize(len(records), time.perf_counter() - start, latencies)
+
+
+def stage_score(work_dir: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    targets, predictions = load_values(os.path.join(work_dir, "finqa_data_enriched_mock.json"))
+    score_values(targets, predictions)
+    return summarize(len(targets), time.perf_counter() - start, [])
+
+
+# The stages in pipeline order; each one reads the output of the previous one
+STAGES = {
+    "parse": stage_parse,
+    "prompt": stage_prompt,
+    "hash": stage_hash,
+    "enrich": stage_enrich,
+    "score": stage_score,
+}
+
+
+def run_stage(name: str, work_dir: str, config: Dict[str, Any], queue):
+    # Report failures to the parent instead of leaving it waiting on the queue
+    try:
+        queue.put(STAGES[name](work_dir, config))
+    except Exception as e:
+        queue.put(e)
+        raise
+
+
+def generate_data(work_dir: str, config: Dict[str, Any]):
+    """
+    Write the synthetic original files, split like the train and dev files of FinQA.
+
+    Args:
+        work_dir (str): The directory to write to.
+        config (Dict[str, Any]): The benchmark configuration.
+    """
+    rng = random.Random(config["seed"])
+    os.makedirs(os.path.join(work_dir, "original"), exist_ok=True)
+    split = int(config["instances"] * 0.8)
+    for name, indices in (("train", range(split)), ("dev", range(split, config["instances"]))):
+        with open(os.path.join(work_dir, "original", f"{name}.json"), "w", encoding="utf-8") as f_out:
+            f_out.write(to_json([generate_instance(rng, index, config["text_words"], config["table_rows"],
+                                                   rng.choice([1, 2])) for index in indices]))
+
+
+def git_commit() -> str:
+    """
+    Find the commit being benchmarked.
+
+    Returns:
+        str: The hash of HEAD, or "unknown" outside a git checkout.
+    """
+    try:
+        result = subprocess.run(["git", "-C", os.path.dirname(os.path.abspath(__file__)), "rev-parse", "HEAD"],
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data.")
+    parser.add_argument("--instances", type=int, default=2000, help="Number of synthetic instances")
+    parser.add_argument("--text-words", type=int, default=300, help="Words in each of pre_text and post_text")
+    parser.add_argument("--table-rows", type=int, default=10, help="Rows in each table")
+    parser.add_argument("--workers", type=int, default=None, help="Parser worker processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="Mock provider requests in flight")
+    parser.add_argument("--latency", type=float, default=0.05, help="Median mock provider latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Mock provider rate limit probability")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages to run")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="Earlier JSON results to compare throughput against")
+    args = parser.parse_args()
+    config = {key: value for key, value in vars(args).items() if key not in ("stages", "output", "compare")}
+
+    results = {"commit": git_commit(), "config": config, "stages": dict()}
+    with tempfile.TemporaryDirectory() as work_dir:
+        generate_data(work_dir, config)
+        selected = args.stages.split(",")
+        # Stages read the output of the stages before them, so those run too, but are not reported
+        last = max(list(STAGES).index(name) for name in selected)
+        for name in list(STAGES)[:last + 1]:
+            # Each stage runs in a fresh process so its peak RSS is its own
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_stage, args=(name, work_dir, config, queue))
+            process.start()
+            stage = queue.get()
+            process.join()
+            if isinstance(stage, Exception):
+                raise stage
+            if name not in selected:
+                continue
+            results["stages"][name] = stage
+            print(f"{name:>7}: {stage['items']:>7} items, {stage['throughput']:>12,.1f} items/s, "
+                  f"p50 {stage['p50_ms']:8.3f} ms, p99 {stage['p99_ms']:8.3f} ms, "
+                  f"peak RSS {stage['peak_rss_mb']:7.1f} MB")
+
+    with open(args.output, "w", encoding="utf-8") as f_out:
+        f_out.write(to_json(results, indent=2))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f_in:
+            baseline = json.load(f_in)
+        print(f"Throughput relative to {baseline['commit'][:12]}:")
+        for name, stage in results["stages"].items():
+            if name in baseline["stages"]:
+                print(f"{name:>7}: {stage['throughput'] / baseline['stages'][name]['throughput']:.2f}x")
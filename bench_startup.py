@@ -0,0 +1,69 @@
+# Check the cold start of every stage of `python -m convfinqa` against its budget
+import argparse
+import subprocess
+import sys
+import time
+from typing import List
+
+from convfinqa import ROOT, STAGES
+
+# The startup budget of each stage, in milliseconds on top of the bare interpreter, so the budgets hold on faster
+# and slower machines alike. The enrichment and scoring stages defer NumPy, httpcore and the provider clients
+# until their arguments are parsed; the others load what every one of their runs needs.
+STARTUP_BUDGETS = {
+    "parse": 100,
+    "enrich-anthropic": 100,
+    "enrich-openai": 100,
+    "score": 100,
+    "experiment": 300,
+    "store": 500,
+    "index": 300,
+    "keys": 100,
+    "stub": 200,
+    "bench-answers": 150,
+    "bench-tables": 250,
+    "bench-pipeline": 350,
+}
+
+
+def startup_time(command: List[str], repeat: int) -> float:
+    """
+    Time a command from a cold start, keeping the best of several runs.
+
+    Args:
+        command (List[str]): The command.
+        repeat (int): The number of runs.
+
+    Returns:
+        float: The best wall time, in milliseconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} failed: {result.stderr.decode('utf-8', 'replace')}")
+        best = min(best, elapsed)
+    return best * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the startup time of every stage against its budget.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per stage, of which the fastest counts")
+    parser.add_argument("--stage", action="append", default=None, choices=sorted(STARTUP_BUDGETS),
+                        help="Only check this stage")
+    args = parser.parse_args()
+
+    # `--help` parses the arguments and returns, so it measures the imports done before the work starts
+    interpreter = startup_time([sys.executable, "-c", "pass"], args.repeat)
+    print(f"{'interpreter':<18}{interpreter:8.1f} ms")
+    over_budget = list()
+    for stage in args.stage or STARTUP_BUDGETS:
+        elapsed = startup_time([sys.executable, "-m", "convfinqa", stage, "--help"], args.repeat) - interpreter
+        budget = STARTUP_BUDGETS[stage]
+        print(f"{stage:<18}{elapsed:8.1f} ms  budget {budget} ms{'  OVER BUDGET' if elapsed > budget else ''}")
+        if elapsed > budget:
+            over_budget.append(stage)
+    if over_budget:
+        sys.exit(f"Over the startup budget: {', '.join(over_budget)}; see python -X importtime")
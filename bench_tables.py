@@ -0,0 +1,70 @@
+# Measure the prompt tokens saved by each table format and by pruning, instance by instance
+import argparse
+import csv
+import os
+import random
+from typing import Any, Dict, List
+
+import numpy as np
+
+from bench_pipeline import generate_instance
+from helpers import create_message_body, from_json
+from parsing import process_instance
+from prompts import get_tokenizer
+from tables import TABLE_FORMATS
+
+# The renderings compared, as (name, table format, prune)
+CONFIGURATIONS = [(table_format, table_format, False) for table_format in TABLE_FORMATS]
+CONFIGURATIONS += [(f"{table_format}+prune", table_format, True) for table_format in TABLE_FORMATS[1:]]
+
+
+def load_instances(file_path: str, count: int, seed: int) -> List[Dict[str, Any]]:
+    """
+    Load parsed instances, or generate synthetic ones if the parsed data is not available.
+
+    Args:
+        file_path (str): The parsed JSONL file.
+        count (int): The largest number of instances to use.
+        seed (int): The random seed of the synthetic instances.
+
+    Returns:
+        List[Dict[str, Any]]: The instances.
+    """
+    if os.path.isfile(file_path):
+        with open(file_path, encoding="utf-8") as f_in:
+            return [from_json(line) for _, line in zip(range(count), f_in)]
+    print(f"{file_path} not found, using synthetic instances")
+    rng = random.Random(seed)
+    return [process_instance(generate_instance(rng, index, 200, rng.randint(3, 20), rng.choice([1, 2])))
+            for index in range(count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the prompt tokens saved by compact table formats.")
+    parser.add_argument("--input", default="data/finqa_data.json", help="Parsed JSONL file")
+    parser.add_argument("--instances", type=int, default=2000, help="Largest number of instances to measure")
+    parser.add_argument("--provider", default="anthropic", help="Provider whose tokenizer is used")
+    parser.add_argument("--model", default="claude-3-opus-20240229", help="Model whose tokenizer is used")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="CSV file for the per-instance token counts")
+    args = parser.parse_args()
+
+    tokenizer = get_tokenizer(args.provider, args.model)
+    instances = load_instances(args.input, args.instances, args.seed)
+    # Count the prompt tokens of every instance under every configuration
+    counts = np.array([[tokenizer.count(create_message_body(data, table_format, prune))
+                        for _, table_format, prune in CONFIGURATIONS] for data in instances])
+    flat = counts[:, 0]
+
+    print(f"{len(instances)} instances, tokens per prompt and savings relative to the flat table:")
+    print(f"{'format':>16} {'mean':>8} {'saved':>8} {'median saved':>13} {'p90 saved':>10} {'worse':>7}")
+    for index, (name, _, _) in enumerate(CONFIGURATIONS):
+        saved = (flat - counts[:, index]) / flat
+        print(f"{name:>16} {counts[:, index].mean():8.1f} {1 - counts[:, index].sum() / flat.sum():8.1%} "
+              f"{np.median(saved):13.1%} {np.percentile(saved, 90):10.1%} {np.mean(saved < 0):7.1%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f_out:
+            writer = csv.writer(f_out)
+            writer.writerow(["instance"] + [name for name, _, _ in CONFIGURATIONS])
+            writer.writerows([index] + row.tolist() for index, row in enumerate(counts))
@@ -0,0 +1,172 @@
+import hashlib  # Module for hashing functions
+import json  # Module for JSON serialization and deserialization
+import sqlite3  # Module for the on-disk SQLite database
+import threading  # Module for serializing access from worker threads
+import time  # Module for entry timestamps
+from typing import Any, Dict, Optional  # Type hints for variables and functions
+
+# The ways a cache can be used: read and write, write only to replace entries with fresh samples, or not at all
+CACHE_MODES = ("use", "refresh", "off")
+
+
+class ResponseCache:
+    """
+    A persistent response cache shared across runs, models and prompt versions.
+
+    Entries are keyed by a hash of the provider, the request parameters and the rendered prompt, so changing
+    any of them misses the cache. Entries older than `max_age` are dropped, and the least recently used entries
+    are dropped when the cache holds more than `max_entries` entries or `max_bytes` bytes of responses.
+
+    Args:
+        path (str): The path of the SQLite database.
+        mode (str): "use" to read and write the cache, "refresh" to skip reads but still store new responses,
+            for example to draw fresh samples at a high temperature, or "off" to bypass the cache entirely.
+        max_entries (Optional[int]): The maximum number of entries kept.
+        max_bytes (Optional[int]): The maximum total size of the stored responses, in bytes.
+        max_age (Optional[float]): The maximum age of an entry, in seconds.
+    """
+
+    def __init__(self,
+                 path: str = "data/response_cache.sqlite",
+                 mode: str = "use",
+                 max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 max_age: Optional[float] = None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unexpected cache mode {mode}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        if mode != "off":
+            # Worker threads share the connection under the lock; WAL lets parallel scripts share the file
+            self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    model TEXT,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )""")
+            self.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Apply the eviction limits and close the database.
+        """
+        if self._connection is not None:
+            self.evict()
+            self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def make_key(provider: str, params: Dict[str, Any], prompt: str) -> str:
+        """
+        Calculate the cache key of a request.
+
+        Args:
+            provider (str): The provider name, such as "anthropic" or "openai".
+            params (Dict[str, Any]): The model and sampling parameters of the request.
+            prompt (str): The rendered prompt.
+
+        Returns:
+            str: The SHA-256 of the canonical JSON encoding of the request.
+        """
+        # Sorting the keys makes the key independent of the order the parameters were written in
+        request = json.dumps([provider, params, prompt], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): The key calculated by `make_key`.
+
+        Returns:
+            Optional[str]: The cached response, or None on a miss or when reads are disabled.
+        """
+        if self.mode != "use":
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT response, created FROM responses WHERE key = ?",
+                                           (key,)).fetchone()
+            now = time.time()
+            # Entries past their age limit count as misses even before they are evicted
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                                     (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, provider: str, params: Dict[str, Any], response: str):
+        """
+        Store a response, replacing any existing entry for the key.
+
+        Args:
+            key (str): The key calculated by `make_key`.
+            provider (str): The provider name.
+            params (Dict[str, Any]): The model and sampling parameters of the request.
+            response (str): The response to store.
+        """
+        if self.mode == "off":
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, provider, model, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, params.get("model"), response, len(response.encode("utf-8")), now, now))
+
+    def evict(self):
+        """
+        Drop the entries that are too old, then the least recently used entries beyond the size limits.
+        """
+        with self._lock:
+            if self.max_age is not None:
+                self._connection.execute("DELETE FROM responses WHERE created < ?",
+                                         (time.time() - self.max_age,))
+            if self.max_entries is not None:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,))
+            if self.max_bytes is not None:
+                # Keep the most recently used entries whose running total fits in the byte budget
+                self._connection.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS total "
+                    "FROM responses) WHERE total > ?)",
+                    (self.max_bytes,))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Report the hit and miss counters of this run and the size of the cache.
+
+        Returns:
+            Dict[str, int]: The hits, misses, entries and total bytes.
+        """
+        entries, size = 0, 0
+        if self._connection is not None:
+            with self._lock:
+                entries, size = self._connection.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
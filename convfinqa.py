@@ -0,0 +1,67 @@
+import argparse  # Module for parsing command-line arguments
+import os  # Module for file system operations
+import runpy  # Module for running a script as __main__
+import sys  # Module for the command-line arguments and import path
+from typing import List, Optional  # Type hints for variables and functions
+
+# The stages of the pipeline and the tools around it: the script each one runs, and what it does. Only the script
+# of the chosen stage is loaded, so every stage starts as fast as its own imports allow.
+STAGES = {
+    "parse": ("01_parse_finqa_data.py", "Parse the original FinQA data into JSONL"),
+    "enrich-anthropic": ("02_enrich_finqa_data_anthropic.py", "Enrich the FinQA data using the Anthropic API"),
+    "enrich-openai": ("03_enrich_finqa_data_openai.py", "Enrich the FinQA data using the OpenAI API"),
+    "score": ("04_plot_finqa_results.py", "Score the enriched FinQA data"),
+    "experiment": ("experiment.py", "Enrich the FinQA data with several models and prompts at once"),
+    "store": ("results_store.py", "Convert an enriched JSONL file into the columnar results store"),
+    "index": ("jsonl_index.py", "Index a JSONL file by instance key and inspect its instances"),
+    "keys": ("instance_keys.py", "Migrate stored instance keys to another key scheme"),
+    "stub": ("stub_server.py", "Serve a local stub of the OpenAI and Anthropic chat APIs"),
+    "bench-answers": ("bench_answers.py", "Benchmark the answer extractors"),
+    "bench-tables": ("bench_tables.py", "Measure the prompt tokens saved by compact table formats"),
+    "bench-pipeline": ("bench_pipeline.py", "Benchmark every pipeline stage on synthetic data"),
+    "bench-startup": ("bench_startup.py", "Check the startup time of every stage against its budget"),
+}
+
+# The directory of the scripts, which also holds the modules they import
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def script_path(stage: str) -> str:
+    """
+    Find the script of a stage.
+
+    Args:
+        stage (str): The stage name, one of STAGES.
+
+    Returns:
+        str: The path of the script.
+    """
+    return os.path.join(ROOT, STAGES[stage][0])
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Run a stage with the arguments that follow its name, as if its script had been run directly.
+
+    Args:
+        argv (Optional[List[str]]): The command-line arguments. Defaults to those of the process.
+    """
+    parser = argparse.ArgumentParser(prog="python -m convfinqa",
+                                     description="Run a stage of the ConvFinQA pipeline.",
+                                     epilog="stages:\n" + "\n".join(f"  {name:<18}{description}"
+                                                                    for name, (_, description) in STAGES.items()),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stage", choices=STAGES, metavar="stage", help="The stage to run, see below")
+    parser.add_argument("arguments", nargs=argparse.REMAINDER, help="The arguments of the stage, see its --help")
+    args = parser.parse_args(argv)
+
+    path = script_path(args.stage)
+    # The script sees its own name and arguments, and imports its modules from the repository
+    sys.argv = [path] + args.arguments
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    runpy.run_path(path, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import argparse  # Module for parsing command-line arguments
+import os  # Module for file system operations
+from contextlib import nullcontext  # Stands in for the dashboard when it is off
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, Optional, Set  # Type hints
+
+from cache import CACHE_MODES
+
+if TYPE_CHECKING:
+    # The modules of a run are imported once the arguments are parsed, so --help and argument errors return at once
+    from batch import BatchProvider
+    from cache import ResponseCache
+    from providers import ChatProvider
+
+
+class EnrichmentPaths:
+    """
+    The files of a provider's enrichment run.
+
+    Args:
+        provider (str): The provider name, which tells apart the files of each provider.
+        data_dir (str): The directory holding the input and every file the run writes.
+    """
+
+    def __init__(self, provider: str, data_dir: str = "data"):
+        self.provider = provider
+        self.input = os.path.join(data_dir, "finqa_data.json")
+        stem = os.path.join(data_dir, f"finqa_data_enriched_{provider}")
+        # The enriched file in input order, written once the run ends
+        self.output = stem + ".json"
+        self.journal = stem + ".journal"
+        self.dead_letters = stem + ".dead.jsonl"
+        # The journals and leases of the workers sharing the input, see workers.py
+        self.shards = stem + ".shards"
+
+
+def parse_enrichment_args(description: str,
+                          batch_api: str,
+                          concurrency: int,
+                          requests_per_minute: float,
+                          tokens_per_minute: float,
+                          max_prompt_tokens: Optional[int] = None,
+                          argv: Optional[list] = None) -> argparse.Namespace:
+    """
+    Parse the arguments of an enrichment script, with the defaults of its provider.
+
+    Args:
+        description (str): The description of the script.
+        batch_api (str): The name of the provider's batch API, for the help text.
+        concurrency (int): The default maximum number of requests in flight.
+        requests_per_minute (float): The default request budget per minute.
+        tokens_per_minute (float): The default token budget per minute.
+        max_prompt_tokens (Optional[int]): The default prompt token budget, or None for the context window.
+        argv (Optional[list]): The arguments. Defaults to those of the process.
+
+    Returns:
+        argparse.Namespace: The arguments.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--concurrency", type=int, default=concurrency, help="Maximum number of requests in flight")
+    parser.add_argument("--rpm", type=float, default=requests_per_minute, help="Requests per minute budget")
+    parser.add_argument("--tpm", type=float, default=tokens_per_minute, help="Tokens per minute budget")
+    parser.add_argument("--batch", action="store_true", help=f"Enrich through the {batch_api} instead")
+    parser.add_argument("--cache", choices=CACHE_MODES, default="use",
+                        help="Use the response cache, refresh it with fresh samples, or turn it off")
+    parser.add_argument("--max-prompt-tokens", type=int, default=max_prompt_tokens,
+                        help="Prompt token budget, below the context window")
+    parser.add_argument("--max-connections", type=int, default=None,
+                        help="Largest number of pooled connections, defaulting to the concurrency")
+    parser.add_argument("--timeout", type=float, default=600, help="Read timeout of each request, in seconds")
+    parser.add_argument("--dashboard", action="store_true",
+                        help="Show a live status line with rate, ETA, errors and spend instead of a line per instance")
+    parser.add_argument("--metrics", default=None,
+                        help="Write the run's metrics and trace spans to this file, as JSON if it ends in .json and "
+                             "as Prometheus text otherwise")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="Draw up to this many samples per instance and keep the majority answer")
+    parser.add_argument("--no-early-stop", action="store_true",
+                        help="Always draw every sample, instead of stopping once the majority is decided")
+    parser.add_argument("--pack", type=int, default=1,
+                        help="Pack up to this many instances into each request, to cut the requests per minute")
+    parser.add_argument("--worker", action="store_true",
+                        help="Claim shards of the input alongside other workers sharing the data directory, "
+                             "see workers.py")
+    parser.add_argument("--shard-size", type=int, default=100,
+                        help="Input lines per shard, the same for every worker")
+    parser.add_argument("--lease", type=float, default=120,
+                        help="Seconds a worker's shard stays claimed without a heartbeat before others reclaim it")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report how many instances are left to enrich and exit, without credentials or API "
+                             "clients")
+    args = parser.parse_args(argv)
+    if args.samples > 1 and args.batch:
+        parser.error("--samples cannot be combined with --batch")
+    if args.pack > 1 and (args.batch or args.samples > 1):
+        parser.error("--pack cannot be combined with --batch or --samples")
+    if args.worker and args.batch:
+        parser.error("--worker cannot be combined with --batch")
+    return args
+
+
+def count_pending(input_path: str, completed_keys: Set[str]) -> int:
+    """
+    Count the input instances left to enrich, from the index of the input file without parsing its lines.
+
+    Args:
+        input_path (str): The path of the input JSONL file.
+        completed_keys (Set[str]): The keys of the instances already enriched.
+
+    Returns:
+        int: The number of input lines whose key is not completed.
+    """
+    from jsonl_index import JsonlIndex
+    with JsonlIndex(input_path) as index:
+        return sum(1 for key, _ in index.keys_in_order() if key not in completed_keys)
+
+
+def dry_run(paths: EnrichmentPaths, args: argparse.Namespace):
+    """
+    Report where a run would resume, without writing anything and before any credentials, tokenizers or API
+    clients are needed: the journal is neither imported into nor migrated, only read.
+
+    Args:
+        paths (EnrichmentPaths): The files of the run.
+        args (argparse.Namespace): The arguments of the run.
+    """
+    from journal import EnrichmentJournal, enriched_keys
+    if os.path.isfile(paths.journal):
+        completed_keys = EnrichmentJournal(paths.journal).keys()
+    elif os.path.isfile(paths.output):
+        completed_keys = enriched_keys(paths.output)
+    else:
+        completed_keys = set()
+    print(f"{len(completed_keys)} instances journalled, {count_pending(paths.input, completed_keys)} left to enrich")
+    if args.worker and os.path.isdir(paths.shards):
+        from workers import ShardWorker
+        worker = ShardWorker(paths.input, paths.shards, args.shard_size, lease_seconds=args.lease)
+        print(f"Shards: {worker.status()}")
+
+
+def run_enrichment(create_provider: Callable[["ResponseCache"], "ChatProvider"],
+                   create_batch_provider: Callable[[], "BatchProvider"],
+                   paths: EnrichmentPaths,
+                   args: argparse.Namespace):
+    """
+    Enrich the input instances through a provider, resuming where the last run stopped, and write the enriched
+    file in input order.
+
+    Each enriched record is appended to a journal as soon as it is received, so an interrupted run, for example
+    by network failures or strict token rate limits, resumes by loading only the keys of the completed records.
+
+    Args:
+        create_provider (Callable[[ResponseCache], ChatProvider]): Creates the provider, with its credentials and
+            request parameters, around the response cache. Only called when the run sends requests.
+        create_batch_provider (Callable[[], BatchProvider]): Creates the batch API of the provider, for --batch.
+        paths (EnrichmentPaths): The files of the run.
+        args (argparse.Namespace): The arguments, as parsed by parse_enrichment_args.
+    """
+    if args.dry_run:
+        dry_run(paths, args)
+        return
+
+    from batch import BatchEnrichment
+    from cache import ResponseCache
+    from enrichment import EnrichmentEngine
+    from helpers import from_json
+    from instance_keys import KEY_VERSION
+    from journal import DeadLetterLog, EnrichmentJournal
+    from jsonl_index import JsonlIndex
+    from metrics import DEFAULT_METRICS, Dashboard
+    from packing import Packer
+    from prompts import PromptBuilder
+    from voting import SelfConsistency
+    from workers import ShardWorker
+
+    journal = EnrichmentJournal(paths.journal)
+    # Seed the journal from an enriched file written before the journal existed
+    if not os.path.isfile(journal.path) and os.path.isfile(paths.output):
+        journal.import_jsonl(paths.output)
+    # A journal keyed with an older key scheme is migrated, so the run resumes where it stopped
+    if journal.migrate_keys():
+        print(f"Migrated {journal.path} to instance key scheme {KEY_VERSION}")
+    # Load the keys of the instances that have already been enriched
+    completed_keys = journal.scan()
+    if journal.corrupt_lines:
+        print(f"Skipped {journal.corrupt_lines} damaged lines of {journal.path}; their instances are requested again")
+    # Instances that still fail after every retry are logged here instead of stopping the run, and retried by the
+    # next run
+    dead_letters = DeadLetterLog(paths.dead_letters)
+
+    def read_records() -> Iterator[Dict[str, Any]]:
+        """
+        Read the input instances that have not been enriched yet.
+
+        Yields:
+            Dict[str, Any]: An instance without a response.
+        """
+        # The index of the input file gives the key of every line without parsing it, so only the lines still to
+        # be enriched are read
+        with JsonlIndex(paths.input) as index:
+            for line_count, (key, position) in enumerate(index.keys_in_order()):
+                # Print progress information
+                if not args.dashboard:
+                    print(f"{line_count} {key}")
+                # Skip the instances that are already in the journal
+                if key in completed_keys:
+                    continue
+                yield from_json(index.line(position).decode("utf-8"))
+
+    # Workers share the input with each other through leases on its shards
+    worker = None
+    if args.worker:
+        worker = ShardWorker(paths.input, paths.shards, args.shard_size, skip_keys=completed_keys,
+                             lease_seconds=args.lease)
+
+    # Open the response cache shared by all runs, models and prompt versions
+    cache = ResponseCache(mode=args.cache)
+    # Get responses from the provider, reusing cached responses for the same model, parameters and prompt
+    get_response = create_provider(cache)
+    # Fit each prompt to the token budget with the local tokenizer, trimming the document but keeping the questions
+    prompt_builder = PromptBuilder.for_model(paths.provider, get_response.model, get_response.params["max_tokens"],
+                                             args.max_prompt_tokens)
+
+    with journal, dead_letters, cache, get_response:
+        if args.batch:
+            # Submit the pending instances missing from the response cache as batch jobs, and harvest the results
+            # into the journal and the cache
+            BatchEnrichment(create_batch_provider(), journal, paths.input, message_of=prompt_builder.build,
+                            cache=cache).run()
+        else:
+            # Keep several requests in flight within the request and token budgets
+            engine = EnrichmentEngine(get_response,
+                                      concurrency=args.concurrency,
+                                      requests_per_minute=args.rpm,
+                                      tokens_per_minute=args.tpm,
+                                      expected_output_tokens=get_response.params["max_tokens"],
+                                      count_tokens=prompt_builder.count,
+                                      # Vote on several samples per instance when asked to
+                                      self_consistency=(SelfConsistency(args.samples, not args.no_early_stop)
+                                                        if args.samples > 1 else None),
+                                      # Pack several short instances into each request when asked to
+                                      packer=Packer(prompt_builder, args.pack) if args.pack > 1 else None)
+            dashboard = nullcontext()
+            if args.dashboard:
+                # Count the pending instances for the ETA, unknown to a worker sharing the input with others
+                dashboard = Dashboard(total=None if args.worker else count_pending(paths.input, completed_keys))
+            if args.worker:
+                # Enrich the shards claimed by this worker into journals of its own, next to those of the other
+                # workers
+                with dashboard:
+                    shards = worker.run(lambda records, write, on_failure: engine.run(
+                        records, write, message_of=prompt_builder.build, on_failure=on_failure))
+                print(f"Shards: {shards}")
+            else:
+                # Append each enriched record to the journal as soon as it is received
+                with dashboard:
+                    engine.run(read_records(), journal.append, message_of=prompt_builder.build,
+                               on_failure=dead_letters.append)
+        if args.worker:
+            # A worker stops once no other worker holds a shard, so every worker merges the journals of all of them
+            missing = worker.merge(paths.output, [journal])
+        else:
+            # Write the final enriched file in input order
+            missing = journal.compact(paths.input, paths.output)
+        if missing:
+            print(f"{missing} instances are missing from the journal")
+        if dead_letters.count:
+            print(f"{dead_letters.count} instances failed after every retry, see {dead_letters.path}")
+        # Report how many requests the response cache saved
+        print(f"Response cache: {cache.stats()}")
+        # Report the size of the prompts sent and how many had to be trimmed
+        print(f"Prompt tokens: {prompt_builder.stats()}")
+        if args.pack > 1:
+            # Report how many instances were packed and how many the model skipped
+            print(f"Packing: {DEFAULT_METRICS.value('packing_requests_total'):.0f} packed requests for "
+                  f"{DEFAULT_METRICS.value('packing_instances_total'):.0f} instances, "
+                  f"{DEFAULT_METRICS.value('packing_fallbacks_total'):.0f} asked again alone")
+        # Report the connection reuse and the latency of each request phase
+        if get_response.transport_stats() is not None:
+            print(f"Transport: {get_response.transport_stats()}")
+        if args.metrics:
+            # Export the request latencies, retries, token usage and spans for later analysis
+            DEFAULT_METRICS.write(args.metrics)
+            print(f"Metrics written to {args.metrics}, estimated spend ${DEFAULT_METRICS.spend():.2f}")
+            if DEFAULT_METRICS.unpriced_models():
+                print(f"No price known for {', '.join(DEFAULT_METRICS.unpriced_models())}, left out of the spend")
@@ -0,0 +1,604 @@
+import asyncio  # Module for asynchronous I/O and concurrency
+import random  # Module for generating jitter on backoff delays
+import time  # Module providing a monotonic clock
+from functools import partial  # Binds the window slots held by a task
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union  # Type hints
+
+from helpers import create_message_body
+from metrics import DEFAULT_METRICS, Metrics
+
+if TYPE_CHECKING:
+    # Only needed for the annotations; voting loads NumPy through the scoring tolerances
+    from packing import Packer
+    from voting import SelfConsistency
+
+
+class TransientError(Exception):
+    """
+    Raised by a provider call for a failure that may succeed when retried: a network error, a timeout, a
+    server error or a malformed response.
+
+    Args:
+        message (str): A description of the failure.
+        retry_after (Optional[float]): The number of seconds the provider asked us to wait, if known.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitError(TransientError):
+    """
+    Raised by a provider call when the provider rejects a request because of rate limits or overload.
+
+    Args:
+        message (str): A description of the failure.
+        retry_after (Optional[float]): The number of seconds the provider asked us to wait, if known.
+    """
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse the value of a Retry-After header into a number of seconds.
+
+    Args:
+        value (Optional[str]): The raw header value.
+
+    Returns:
+        Optional[float]: The number of seconds to wait, or None if the header is missing or not numeric.
+    """
+    # HTTP dates are legal in Retry-After, but providers send seconds, so anything else is ignored
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base_backoff: float, max_backoff: float, retry_after: Optional[float] = None) -> float:
+    """
+    Choose how long to wait before retrying a failed request.
+
+    Args:
+        attempt (int): The number of failed attempts so far, starting at 1.
+        base_backoff (float): The delay after the first failure, in seconds, doubled on each further failure.
+        max_backoff (float): The largest delay, in seconds.
+        retry_after (Optional[float]): The delay the provider asked for, which takes precedence.
+
+    Returns:
+        float: The delay in seconds. Computed delays are jittered, so clients that failed together do not
+        all retry together.
+    """
+    if retry_after is not None:
+        return retry_after
+    return min(max_backoff, base_backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+def estimate_tokens(message: str) -> int:
+    """
+    Estimate the number of tokens in a message without a tokenizer.
+
+    Args:
+        message (str): The message to estimate.
+
+    Returns:
+        int: A rough token count, assuming four characters per token.
+    """
+    return max(1, len(message) // 4)
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at a per-minute rate.
+
+    Args:
+        rate_per_minute (float): The number of tokens added to the bucket each minute.
+        capacity (Optional[float]): The maximum number of tokens held. Defaults to one minute of budget.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = None
+
+    def _refill(self, now: float):
+        # Add the tokens accrued since the last update, without overflowing the bucket
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float):
+        """
+        Stop handing out tokens for the given number of seconds and drain the bucket.
+
+        Args:
+            seconds (float): How long to pause for.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    async def acquire(self, amount: float = 1.0):
+        """
+        Wait until the requested number of tokens is available and take them.
+
+        Args:
+            amount (float): The number of tokens to take. Clamped to the bucket capacity.
+        """
+        # The lock is created lazily so the bucket can be built outside of a running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        amount = min(amount, self.capacity)
+        # Waiters are served one at a time in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrency:
+    """
+    A concurrency limit that halves on rate limiting and grows back by one after a window of successes.
+
+    Args:
+        maximum (int): The largest number of requests allowed in flight.
+        minimum (int): The smallest number of requests allowed in flight.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = None
+
+    async def acquire(self):
+        """
+        Wait for a free slot under the current limit and take it.
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        """
+        Give back a slot and wake up any waiters.
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        """
+        Record a successful request, growing the limit after a full window of successes.
+        """
+        self._successes += 1
+        if self._successes >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1)
+            self._successes = 0
+
+    def on_rate_limited(self):
+        """
+        Record a rate-limited request, halving the limit.
+        """
+        self.limit = max(self.minimum, self.limit // 2)
+        self._successes = 0
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a provider that keeps failing, and probe it until it recovers.
+
+    After `failure_threshold` consecutive transient failures the circuit opens: requests wait instead of
+    being sent, so an outage costs neither retries nor dead letters. After the reset timeout a single probe
+    request is let through; if it succeeds the circuit closes, otherwise it opens again for twice as long.
+    Rate limiting is not a failure here, since it shows the provider is up.
+
+    Args:
+        failure_threshold (int): The number of consecutive failures that opens the circuit.
+        reset_timeout (float): How long the circuit first stays open, in seconds.
+        max_reset_timeout (float): The longest the circuit stays open, in seconds.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, max_reset_timeout: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.timeout = reset_timeout
+        self.opened_at = 0.0
+        self.probing = False
+
+    async def acquire(self) -> bool:
+        """
+        Wait until a request may be sent.
+
+        Returns:
+            bool: Whether the request is the probe of a half open circuit, which must then be settled by
+            record_success or record_failure whatever its outcome, or the circuit stays half open for good.
+        """
+        while True:
+            if self.state == "closed":
+                return False
+            if self.state == "open":
+                remaining = self.opened_at + self.timeout - time.monotonic()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+                    continue
+                self.state = "half_open"
+            # Half open: one probe at a time, the other requests wait for its outcome
+            if not self.probing:
+                self.probing = True
+                return True
+            await asyncio.sleep(min(1.0, self.reset_timeout))
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.trips += 1
+
+    def record_success(self):
+        """
+        Record a request the provider answered, closing the circuit.
+        """
+        self.failures = 0
+        self.probing = False
+        if self.state != "closed":
+            self.state = "closed"
+            self.timeout = self.reset_timeout
+
+    def record_failure(self):
+        """
+        Record a transient failure, opening the circuit after too many in a row or after a failed probe.
+        """
+        self.failures += 1
+        if self.state == "half_open" and self.probing:
+            self.probing = False
+            self.timeout = min(self.max_reset_timeout, self.timeout * 2)
+            self._open()
+        elif self.state == "closed" and self.failures >= self.failure_threshold:
+            self._open()
+
+
+async def call_provider(call: Callable[[str], Union[str, Awaitable[str]]], message: str) -> str:
+    """
+    Call a provider from the event loop.
+
+    Args:
+        call (Callable): The provider call. Plain functions are run in a worker thread; coroutine functions
+            are awaited directly.
+        message (str): The message to send.
+
+    Returns:
+        str: The response.
+    """
+    # Blocking provider clients are moved off the event loop
+    if asyncio.iscoroutinefunction(call):
+        return await call(message)
+    return await asyncio.to_thread(call, message)
+
+
+class ProviderPool:
+    """
+    The request budget, token budget, adaptive concurrency limit and circuit breaker of a provider, shared
+    by every request sent to it, with retries and backoff on rate limiting and transient failures.
+
+    The budgets are created lazily, so a pool can be built outside of a running event loop, but a pool must
+    only be used within a single event loop.
+
+    Args:
+        concurrency (int): The maximum number of requests in flight.
+        requests_per_minute (float): The request budget per minute.
+        tokens_per_minute (float): The token budget per minute.
+        expected_output_tokens (int): The number of output tokens budgeted for each request.
+        max_retries (int): The number of rate-limited attempts allowed per request before giving up.
+        base_backoff (float): The initial backoff delay in seconds, doubled on each retry.
+        max_backoff (float): The largest backoff delay in seconds.
+        count_tokens (Callable[[str], int]): Counts the tokens of a message, for the token budget.
+        metrics (Metrics): The registry receiving the time spent waiting for budget, the retries, the adaptive
+            concurrency limit and the circuit state, labelled with the provider's name.
+        max_transient_retries (int): The number of transient failures allowed per request before giving up.
+        failure_threshold (int): The number of consecutive transient failures that opens the circuit.
+        reset_timeout (float): How long the circuit first stays open, in seconds.
+    """
+
+    def __init__(self,
+                 concurrency: int = 8,
+                 requests_per_minute: float = 50,
+                 tokens_per_minute: float = 40000,
+                 expected_output_tokens: int = 256,
+                 max_retries: int = 8,
+                 base_backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 count_tokens: Callable[[str], int] = estimate_tokens,
+                 metrics: Metrics = DEFAULT_METRICS,
+                 max_transient_retries: int = 4,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        self.concurrency = concurrency
+        self.expected_output_tokens = expected_output_tokens
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.count_tokens = count_tokens
+        self.metrics = metrics
+        self.max_transient_retries = max_transient_retries
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.slots = AdaptiveConcurrency(concurrency)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    async def request(self, call: Callable[[str], Union[str, Awaitable[str]]], message: str, samples: int = 1) -> Any:
+        """
+        Send a message within the budgets, retrying with backoff when the provider rate limits it or fails
+        transiently.
+
+        Args:
+            call (Callable): The provider call, mapping a message to a response.
+            message (str): The message to send.
+            samples (int): The number of responses the call asks for in one request, each budgeted for
+                expected_output_tokens.
+
+        Returns:
+            str: The response.
+
+        Raises:
+            RateLimitError: If the request is still rate limited after max_retries attempts.
+            TransientError: If the request still fails after max_transient_retries attempts.
+            Exception: Any other failure of the call, which is not retried.
+        """
+        provider = getattr(call, "name", "provider")
+        attempt = 0
+        failures = 0
+        while True:
+            # Wait out an open circuit, then take budget for the request and its tokens, then a concurrency slot
+            start = time.perf_counter()
+            probe = await self.breaker.acquire()
+            await self.requests.acquire(1)
+            await self.tokens.acquire(self.count_tokens(message) + self.expected_output_tokens * samples)
+            await self.slots.acquire()
+            # Time spent waiting here means the budgets, not the provider, are the bottleneck
+            self.metrics.observe("pool_wait_seconds", time.perf_counter() - start, provider=provider)
+            self.metrics.set("pool_in_flight", self.slots.in_flight, provider=provider)
+            retry_in = None
+            try:
+                response = await call_provider(call, message)
+            except RateLimitError as e:
+                # The provider answered, so the circuit stays closed
+                self.breaker.record_success()
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                # Back off for every request to the provider, honouring its hint when it gives one
+                delay = backoff_delay(attempt, self.base_backoff, self.max_backoff, e.retry_after)
+                self.slots.on_rate_limited()
+                self.metrics.increment("pool_retries_total", provider=provider, reason="rate_limited")
+                self.metrics.set("pool_concurrency_limit", self.slots.limit, provider=provider)
+                self.requests.pause(delay)
+                self.tokens.pause(delay)
+                continue
+            except TransientError as e:
+                trips = self.breaker.trips
+                self.breaker.record_failure()
+                if self.breaker.trips > trips:
+                    self.metrics.increment("pool_circuit_trips_total", provider=provider)
+                self.metrics.set("pool_circuit_open", int(self.breaker.state != "closed"), provider=provider)
+                failures += 1
+                if failures > self.max_transient_retries:
+                    raise
+                self.metrics.increment("pool_retries_total", provider=provider, reason="transient")
+                retry_in = backoff_delay(failures, self.base_backoff, self.max_backoff, e.retry_after)
+            except Exception:
+                # The provider answered, with an error retrying cannot fix, such as a bad request or an
+                # unparseable response
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+            finally:
+                # A probe cancelled before its outcome is known counts as failed, so a later request probes again
+                # instead of every request waiting on a probe that never settles
+                if probe and self.breaker.probing:
+                    self.breaker.record_failure()
+                await self.slots.release()
+            if retry_in is not None:
+                # Back off for this request only, without holding a slot; a provider that keeps failing is
+                # paused as a whole by the circuit breaker
+                await asyncio.sleep(retry_in)
+                continue
+            self.slots.on_success()
+            self.metrics.set("pool_concurrency_limit", self.slots.limit, provider=provider)
+            self.metrics.set("pool_circuit_open", 0, provider=provider)
+            return response
+
+
+class EnrichmentEngine:
+    """
+    Keep several provider requests in flight while respecting request and token budgets.
+
+    Records are processed concurrently, but are written back strictly in input order.
+
+    Args:
+        call (Callable): The provider call, mapping a message to a response. Plain functions are run in a
+            worker thread; coroutine functions are awaited directly.
+        concurrency (int): The maximum number of requests in flight.
+        requests_per_minute (float): The request budget per minute.
+        tokens_per_minute (float): The token budget per minute.
+        expected_output_tokens (int): The number of output tokens budgeted for each request.
+        max_retries (int): The number of rate-limited attempts allowed per record before giving up.
+        base_backoff (float): The initial backoff delay in seconds, doubled on each retry.
+        max_backoff (float): The largest backoff delay in seconds.
+        count_tokens (Callable[[str], int]): Counts the tokens of a message, for the token budget.
+        metrics (Metrics): The registry receiving the records written and the budget metrics of the pool.
+        max_transient_retries (int): The number of transient failures allowed per record before giving up.
+        failure_threshold (int): The number of consecutive transient failures that opens the circuit.
+        reset_timeout (float): How long the circuit first stays open, in seconds.
+        self_consistency (Optional[SelfConsistency]): Draws several samples per record and votes on their
+            answers instead of requesting one response, see voting.SelfConsistency. The call must then be a
+            ChatProvider.
+        packer (Optional[Packer]): Packs several records into each request, see packing.Packer. Packed
+            records are built by the packer, so message_of is not used for them.
+    """
+
+    def __init__(self,
+                 call: Callable[[str], Union[str, Awaitable[str]]],
+                 concurrency: int = 8,
+                 requests_per_minute: float = 50,
+                 tokens_per_minute: float = 40000,
+                 expected_output_tokens: int = 256,
+                 max_retries: int = 8,
+                 base_backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 count_tokens: Callable[[str], int] = estimate_tokens,
+                 metrics: Metrics = DEFAULT_METRICS,
+                 max_transient_retries: int = 4,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0,
+                 self_consistency: Optional["SelfConsistency"] = None,
+                 packer: Optional["Packer"] = None):
+        if self_consistency is not None and not hasattr(call, "sample"):
+            raise ValueError("Self-consistency sampling needs a provider that can draw numbered samples")
+        if self_consistency is not None and packer is not None:
+            raise ValueError("Packed requests cannot be combined with self-consistency sampling")
+        self.call = call
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.expected_output_tokens = expected_output_tokens
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.count_tokens = count_tokens
+        self.metrics = metrics
+        self.max_transient_retries = max_transient_retries
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.self_consistency = self_consistency
+        self.packer = packer
+
+    def run(self,
+            records: Iterable[Dict[str, Any]],
+            write: Callable[[Dict[str, Any]], None],
+            message_of: Callable[[Dict[str, Any]], str] = create_message_body,
+            on_failure: Optional[Callable[[Dict[str, Any], Exception], None]] = None):
+        """
+        Enrich the records with a "response" field and write them out in input order.
+
+        Records that already carry a "response" are passed straight through without a request.
+
+        Args:
+            records (Iterable[Dict[str, Any]]): The records to enrich.
+            write (Callable[[Dict[str, Any]], None]): Called once per record, in input order.
+            message_of (Callable[[Dict[str, Any]], str]): Builds the message for a record.
+            on_failure (Optional[Callable[[Dict[str, Any], Exception], None]]): Called with each record whose
+                request failed after every retry, which is then skipped so the run carries on. If None, the
+                first failure stops the run and is raised.
+        """
+        with self.metrics.span("enrichment_run"):
+            asyncio.run(self._run(records, write, message_of, on_failure))
+
+    async def _run(self, records, write, message_of, on_failure):
+        # A fresh pool per run, since its budgets belong to the event loop of the run
+        pool = ProviderPool(self.concurrency,
+                            self.requests_per_minute,
+                            self.tokens_per_minute,
+                            self.expected_output_tokens,
+                            self.max_retries,
+                            self.base_backoff,
+                            self.max_backoff,
+                            self.count_tokens,
+                            self.metrics,
+                            self.max_transient_retries,
+                            self.failure_threshold,
+                            self.reset_timeout)
+
+        # Finished records wait here until every record before them has been written, failed records as None
+        finished: Dict[int, Optional[Dict[str, Any]]] = dict()
+        next_index = 0
+        # Bound how far reading can run ahead of writing, so memory stays flat on large inputs. The window
+        # counts records and a group takes a slot per record, so it holds four full groups per request in
+        # flight; a window smaller than one pack would never let the first pack start.
+        group_size = self.packer.max_instances if self.packer is not None else 1
+        window = asyncio.Semaphore(self.concurrency * 4 * group_size)
+
+        async def enrich(group: List[Dict[str, Any]]):
+            pending = [record for record in group if "response" not in record]
+            if not pending:
+                return
+            if self.packer is not None:
+                for record, response in zip(pending, await self.packer.request(pool, self.call, pending)):
+                    record["response"] = response
+            elif self.self_consistency is not None:
+                record = pending[0]
+                record.update(await self.self_consistency.draw(pool, self.call, message_of(record),
+                                                               len(record["qa_pairs"])))
+            else:
+                pending[0]["response"] = await pool.request(self.call, message_of(pending[0]))
+
+        async def process(index: int, group: List[Dict[str, Any]]):
+            nonlocal next_index
+            try:
+                await enrich(group)
+            except Exception as e:
+                if on_failure is None:
+                    raise
+                for record in group:
+                    if "response" not in record:
+                        on_failure(record, e)
+                        self.metrics.increment("enrichment_failures_total")
+            for offset, record in enumerate(group):
+                finished[index + offset] = record if "response" in record else None
+            # Flush the contiguous run of finished records starting at the write cursor
+            while next_index in finished:
+                record = finished.pop(next_index)
+                if record is not None:
+                    write(record)
+                    self.metrics.increment("enrichment_records_total")
+                next_index += 1
+                window.release()
+
+        def on_done(size: int, task: asyncio.Task):
+            tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                failures.append(task.exception())
+                # Wake the reader, which may be waiting on the window slots held by the failed records
+                for _ in range(size):
+                    window.release()
+
+        tasks = set()
+        failures = list()
+        # Each group is one request: a pack of records, or a single record
+        groups = self.packer.pack(records) if self.packer is not None else ([record] for record in records)
+        index = 0
+        try:
+            for group in groups:
+                for _ in group:
+                    await window.acquire()
+                # Surface failures as soon as they happen instead of after the whole input is read
+                if failures:
+                    raise failures[0]
+                task = asyncio.create_task(process(index, group))
+                index += len(group)
+                tasks.add(task)
+                task.add_done_callback(partial(on_done, len(group)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in list(tasks):
+                task.cancel()
+        if failures:
+            raise failures[0]
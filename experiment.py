@@ -0,0 +1,306 @@
+import argparse  # Module for parsing command-line arguments
+import asyncio  # Module for asynchronous I/O and concurrency
+import json  # Module for JSON serialization and deserialization
+import os  # Module for file system operations
+from concurrent.futures import ThreadPoolExecutor  # Worker threads for the blocking provider clients
+from contextlib import nullcontext  # Stands in for the dashboard when it is off
+from functools import partial  # Binds the prompt template of a variant
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple  # Type hints for variables and functions
+
+from cache import CACHE_MODES, ResponseCache
+from enrichment import ProviderPool
+from helpers import create_message_body, from_json
+from journal import DeadLetterLog, EnrichmentJournal
+from jsonl_index import JsonlIndex
+from metrics import DEFAULT_METRICS, Dashboard, Metrics
+from prompts import PromptBuilder, answer_max_tokens
+from providers import ChatProvider, create_provider
+from voting import SelfConsistency
+
+if TYPE_CHECKING:
+    from transport import Transport
+
+# The budgets of each provider when the experiment config does not give them
+DEFAULT_POOLS = {
+    "anthropic": {"concurrency": 4, "requests_per_minute": 50, "tokens_per_minute": 40000},
+    "openai": {"concurrency": 8, "requests_per_minute": 500, "tokens_per_minute": 10000},
+}
+
+
+def render_prompt(template: Optional[str],
+                  data: Dict[str, Any],
+                  table_format: str = "flat",
+                  prune_table: bool = False) -> str:
+    """
+    Build the message for an instance from a prompt template.
+
+    The template is formatted with the fields `message` (the default message built by create_message_body),
+    `pre_text`, `table` (tab-delimited, as parsed), `post_text` and `questions` (the questions, one per line).
+    Literal braces must be doubled.
+
+    Args:
+        template (Optional[str]): The prompt template, or None for the default message.
+        data (Dict[str, Any]): The instance.
+        table_format (str): How the default message renders the table, one of tables.TABLE_FORMATS.
+        prune_table (bool): Whether the default message drops the table rows and columns the questions do
+            not mention.
+
+    Returns:
+        str: The message.
+    """
+    message = create_message_body(data, table_format, prune_table)
+    if template is None:
+        return message
+    return template.format(message=message,
+                           pre_text=data["pre_text"],
+                           table=data["table"],
+                           post_text=data["post_text"],
+                           questions="\n".join(qa_pair["question"] for qa_pair in data["qa_pairs"]))
+
+
+class Variant:
+    """
+    One configuration under evaluation: a provider, its request parameters and a prompt template.
+
+    Args:
+        name (str): The variant name, unique within the experiment. Used as the run of the result store.
+        provider (ChatProvider): The provider, which also carries the request parameters.
+        prompt_builder (PromptBuilder): Renders the prompt template of the variant within its token budget.
+        journal (EnrichmentJournal): The journal receiving the enriched records of the variant.
+        dead_letters (DeadLetterLog): The log of the instances that failed after every retry.
+        self_consistency (Optional[SelfConsistency]): Votes on several samples per instance, or None to
+            request one response.
+    """
+
+    def __init__(self,
+                 name: str,
+                 provider: ChatProvider,
+                 prompt_builder: PromptBuilder,
+                 journal: EnrichmentJournal,
+                 dead_letters: DeadLetterLog,
+                 self_consistency: Optional[SelfConsistency] = None):
+        self.name = name
+        self.provider = provider
+        self.prompt_builder = prompt_builder
+        self.journal = journal
+        self.dead_letters = dead_letters
+        self.self_consistency = self_consistency
+        self.completed = 0
+        self.failed = 0
+
+
+class ExperimentRunner:
+    """
+    Enrich the input with many (provider, parameters, prompt) variants at once, in a single process.
+
+    The input is read once and fanned out as (variant, instance) work items. Each provider has a work queue
+    shared by all of its variants and a pool of workers bounded by the provider's budgets, so every variant
+    progresses together and a slow provider never holds up a fast one. Each variant journals its records,
+    so an interrupted experiment resumes where it stopped, and the finished variants are converted into the
+    columnar result store, keyed by provider, model and variant name.
+
+    Args:
+        config (Dict[str, Any]): The experiment config, see README.md.
+        cache (Optional[ResponseCache]): The response cache shared by every variant.
+        input_path (str): The path of the input JSONL file.
+        output_dir (str): The directory for the journals and enriched files of the experiment.
+        store_dir (str): The root directory of the result store.
+        metrics (Metrics): The registry receiving the metrics of every provider, pool and variant.
+    """
+
+    def __init__(self,
+                 config: Dict[str, Any],
+                 cache: Optional[ResponseCache] = None,
+                 input_path: str = "data/finqa_data.json",
+                 output_dir: Optional[str] = None,
+                 store_dir: str = "data/results",
+                 metrics: Metrics = DEFAULT_METRICS):
+        self.input_path = input_path
+        self.metrics = metrics
+        self.output_dir = output_dir or os.path.join("data", "experiments", config["name"])
+        self.store_dir = store_dir
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        # The "transport" options of each provider configure its connection pool, the rest are its budgets
+        budgets = {name: dict(pool) for name, pool in DEFAULT_POOLS.items()}
+        transport_options = dict()
+        for name, provider_config in config.get("providers", dict()).items():
+            provider_config = dict(provider_config)
+            transport_options[name] = provider_config.pop("transport", dict())
+            budgets[name] = dict(budgets.get(name, dict()), **provider_config)
+        # One connection pool per provider, shared by every variant of that provider
+        self.transports: Dict[str, "Transport"] = dict()
+
+        self.variants: List[Variant] = list()
+        for variant_config in config["variants"]:
+            name = variant_config["name"]
+            if any(variant.name == name for variant in self.variants):
+                raise ValueError(f"Duplicate variant {name}")
+            # Responses are numerical answers, so max_tokens is kept tight unless the variant sets it
+            params = dict({"max_tokens": answer_max_tokens()}, **variant_config["params"])
+            provider_name = variant_config["provider"]
+            if provider_name in self.transports:
+                provider = create_provider(provider_name, params, cache, transport=self.transports[provider_name],
+                                           metrics=metrics)
+            else:
+                # Every request in flight holds a connection, so the pool is sized to the concurrency
+                max_connections = budgets.get(provider_name, dict()).get("concurrency", 10)
+                provider = create_provider(provider_name, params, cache, metrics=metrics,
+                                           **dict({"max_connections": max_connections},
+                                                  **transport_options.get(provider_name, dict())))
+                self.transports[provider_name] = provider.transport
+            render = partial(render_prompt,
+                             variant_config.get("prompt"),
+                             table_format=variant_config.get("table_format", "flat"),
+                             prune_table=variant_config.get("prune_table", False))
+            prompt_builder = PromptBuilder.for_model(provider.name, provider.model, params["max_tokens"],
+                                                     variant_config.get("max_prompt_tokens"), render)
+            journal = EnrichmentJournal(os.path.join(self.output_dir, f"{name}.journal"))
+            dead_letters = DeadLetterLog(os.path.join(self.output_dir, f"{name}.dead.jsonl"))
+            # A variant with "samples" above one votes on that many samples per instance
+            self_consistency = None
+            if variant_config.get("samples", 1) > 1:
+                self_consistency = SelfConsistency(variant_config["samples"], variant_config.get("early_stop", True),
+                                                   metrics)
+            self.variants.append(Variant(name, provider, prompt_builder, journal, dead_letters, self_consistency))
+
+        # One pool per provider, shared by every variant of that provider
+        self.pools: Dict[str, ProviderPool] = dict()
+        for variant in self.variants:
+            name = variant.provider.name
+            if name not in self.pools:
+                pool_budgets = dict(budgets.get(name, dict()))
+                # Requests are budgeted with the tokenizer and output limit of the provider's first variant
+                pool_budgets.setdefault("expected_output_tokens", variant.provider.params["max_tokens"])
+                self.pools[name] = ProviderPool(count_tokens=variant.prompt_builder.count, metrics=metrics,
+                                                **pool_budgets)
+
+    def read_work(self) -> Dict[str, List[Tuple[Variant, str, Dict[str, Any]]]]:
+        """
+        Read the input once and list the work items of each provider, skipping journalled instances.
+
+        Returns:
+            Dict[str, List[Tuple[Variant, str, Dict[str, Any]]]]: The variant, instance key and instance of
+            each work item, by provider. Items are interleaved across variants in input order.
+        """
+        for variant in self.variants:
+            # A journal keyed with an older key scheme is migrated, so the variant resumes where it stopped
+            variant.journal.migrate_keys()
+        completed = {variant.name: variant.journal.scan() for variant in self.variants}
+        work = {name: list() for name in self.pools}
+        # The index of the input file gives its keys without parsing it, so only the lines with work are read
+        with JsonlIndex(self.input_path) as index:
+            for key, position in index.keys_in_order():
+                data = None
+                for variant in self.variants:
+                    # Identical instances share a key, so only the first one is requested
+                    if key in completed[variant.name]:
+                        continue
+                    completed[variant.name].add(key)
+                    if data is None:
+                        data = from_json(index.line(position).decode("utf-8"))
+                    work[variant.provider.name].append((variant, key, data))
+        return work
+
+    def run(self, progress: Callable[[str], None] = print, dashboard: bool = False):
+        """
+        Run every variant to completion, then write its enriched file and add it to the result store.
+
+        Args:
+            progress (Callable[[str], None]): Receives progress messages.
+            dashboard (bool): Whether to show a live status line with the rate, ETA, errors and spend.
+        """
+        work = self.read_work()
+        for name, items in work.items():
+            progress(f"{name}: {len(items)} requests across "
+                     f"{sum(variant.provider.name == name for variant in self.variants)} variants")
+        # Blocking provider calls each hold a worker thread, so there must be one per request in flight
+        threads = sum(pool.concurrency for pool in self.pools.values())
+        status = Dashboard(self.metrics, total=sum(map(len, work.values()))) if dashboard else nullcontext()
+        with ThreadPoolExecutor(max_workers=threads) as executor, status, self.metrics.span("experiment_run"):
+            asyncio.run(self._run(work, executor, progress))
+
+        # PyArrow is only loaded once the results are stored, so argument errors and --help return at once
+        from results_store import convert_jsonl
+        for variant in self.variants:
+            variant.journal.close()
+            variant.dead_letters.close()
+            output_path = os.path.join(self.output_dir, f"{variant.name}.json")
+            missing = variant.journal.compact(self.input_path, output_path)
+            rows = convert_jsonl(output_path, self.store_dir, variant.provider.name, variant.provider.model,
+                                 variant.name)
+            progress(f"{variant.name}: {variant.completed} completed, {variant.failed} failed, "
+                     f"{missing} missing, {rows} question-answer pairs stored")
+            progress(f"{variant.name}: prompt tokens {variant.prompt_builder.stats()}")
+        for name, transport in self.transports.items():
+            transport.close()
+            progress(f"{name}: transport {transport.stats()}")
+
+    async def _run(self, work, executor: ThreadPoolExecutor, progress: Callable[[str], None]):
+        asyncio.get_running_loop().set_default_executor(executor)
+
+        async def worker(pool: ProviderPool, queue: asyncio.Queue):
+            while True:
+                variant, key, data = await queue.get()
+                try:
+                    message = variant.prompt_builder.build(data)
+                    if variant.self_consistency is None:
+                        data = dict(data, response=await pool.request(variant.provider, message))
+                    else:
+                        data = dict(data, **await variant.self_consistency.draw(pool, variant.provider, message,
+                                                                                len(data["qa_pairs"])))
+                    variant.journal.append(data, key)
+                    variant.completed += 1
+                    self.metrics.increment("enrichment_records_total", variant=variant.name)
+                except Exception as e:
+                    # A failed item stays out of the journal and is retried by the next run
+                    variant.failed += 1
+                    variant.dead_letters.append(data, e, key)
+                    self.metrics.increment("enrichment_failures_total", variant=variant.name)
+                    progress(f"{variant.name}: {key} failed: {e!r}")
+                finally:
+                    queue.task_done()
+
+        workers = list()
+        queues = list()
+        for name, pool in self.pools.items():
+            queue = asyncio.Queue()
+            for item in work[name]:
+                queue.put_nowait(item)
+            queues.append(queue)
+            # The pool's adaptive limit decides how many of these workers actually have a request in flight
+            workers.extend(asyncio.create_task(worker(pool, queue)) for _ in range(pool.concurrency))
+        try:
+            for queue in queues:
+                await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrich the FinQA data with several models and prompts at once.")
+    parser.add_argument("config", help="Experiment config, such as experiments/finqa_baseline.json")
+    parser.add_argument("--input", default="data/finqa_data.json", help="Input JSONL file")
+    parser.add_argument("--store", default="data/results", help="Root directory of the result store")
+    parser.add_argument("--cache", choices=CACHE_MODES, default="use",
+                        help="Use the response cache, refresh it with fresh samples, or turn it off")
+    parser.add_argument("--dashboard", action="store_true", help="Show a live status line instead of progress only")
+    parser.add_argument("--metrics", default=None,
+                        help="Write the metrics and trace spans to this file, as JSON if it ends in .json and as "
+                             "Prometheus text otherwise")
+    args = parser.parse_args()
+
+    with open(args.config, encoding="utf-8") as f_in:
+        experiment_config = json.load(f_in)
+    with ResponseCache(mode=args.cache) as response_cache:
+        runner = ExperimentRunner(experiment_config, response_cache, input_path=args.input, store_dir=args.store)
+        runner.run(dashboard=args.dashboard)
+        # Report how many requests the response cache saved
+        print(f"Response cache: {response_cache.stats()}")
+    if args.metrics:
+        DEFAULT_METRICS.write(args.metrics)
+        print(f"Metrics written to {args.metrics}, estimated spend ${DEFAULT_METRICS.spend():.2f}")
+        if DEFAULT_METRICS.unpriced_models():
+            print(f"No price known for {', '.join(DEFAULT_METRICS.unpriced_models())}, left out of the spend")
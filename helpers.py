@@ -3,38 +3,65 @@ import hashlib  # Module for hashing functions
 import json  # Module for JSON serialization and deserialization
 import math  # Module providing mathematical functions
 import re  # Module for regular expressions
-from typing import Any, Dict, List  # Type hints for variables and functions
+from typing import Any, Dict, Iterator, List  # Type hints for variables and functions
 
-import numpy as np  # NumPy, a library for numerical computing
+from instance_keys import instance_key
 
 
 def create_instance_key(data: Dict[str, Any]) -> str:
     """
-    Create a unique key for the instance based on its pre-text, table, and post-text.
+    Create a unique key for the instance based on its pre-text, table, post-text and question-answer pairs.
 
     Args:
-        data (Dict[str, Any]): A dictionary containing pre-text, table, and post-text.
+        data (Dict[str, Any]): A dictionary containing pre-text, table, post-text and question-answer pairs.
 
     Returns:
-        str: A unique key for the instance.
+        str: A unique key for the instance, computed with the current scheme of instance_keys.
     """
-    return md5("\t".join([data["pre_text"], data["table"], data["post_text"]]))
+    return instance_key(data)
 
 
-def create_message_body(data: Dict[str, Any]) -> str:
+def create_document(data: Dict[str, Any], table_format: str = "flat", prune_table: bool = False) -> str:
     """
-    Create a message body based on the document and QA pairs.
+    Create the document part of a message: the cleaned pre-text, table and post-text, one per line.
 
     Args:
         data (Dict[str, Any]): A dictionary containing pre-text, table, post-text, and QA pairs.
+        table_format (str): How to render the table, one of tables.TABLE_FORMATS. The default "flat" runs
+            every cell together on one line, as the original prompts did.
+        prune_table (bool): Whether to drop the table rows and columns that the questions do not mention.
 
     Returns:
-        str: The message body.
+        str: The document.
     """
     # Clean pre-text, table, and post-text
     pre_text = re.sub(r"[\n\t\s]+", " ", data["pre_text"])
-    table = re.sub(r"[\n\t\s]+", " ", data["table"])
+    if table_format == "flat" and not prune_table:
+        table = re.sub(r"[\n\t\s]+", " ", data["table"])
+    else:
+        # Keep one table row per line, so the rows and columns stay unambiguous. The table parser needs NumPy,
+        # which only prompts with a table format pay for
+        from tables import render_table
+        questions = [qa_pair["question"] for qa_pair in data["qa_pairs"]] if prune_table else None
+        table = render_table(data["table"], table_format, questions)
     post_text = re.sub(r"[\n\t\s]+", " ", data["post_text"])
+    return f"{pre_text}\n{table}\n{post_text}"
+
+
+def create_message_body(data: Dict[str, Any], table_format: str = "flat", prune_table: bool = False) -> str:
+    """
+    Create a message body based on the document and QA pairs.
+
+    Args:
+        data (Dict[str, Any]): A dictionary containing pre-text, table, post-text, and QA pairs.
+        table_format (str): How to render the table, one of tables.TABLE_FORMATS. The default "flat" runs
+            every cell together on one line, as the original prompts did.
+        prune_table (bool): Whether to drop the table rows and columns that the questions do not mention.
+
+    Returns:
+        str: The message body.
+    """
+    document = create_document(data, table_format, prune_table)
 
     # Extract QA pairs and determine information based on the number of pairs
     qa_pairs = data["qa_pairs"]
@@ -59,7 +86,7 @@ def create_message_body(data: Dict[str, Any]) -> str:
     return (f"Here is a document and {question_info} regarding the document. "
             f"Please respond with the numerical {answer_info} {delimiter_info}.\n\n"
             f"Please be sure to respond only with {numerical_info} and do not reply with words.\n\n"
-            f"DOCUMENT: {pre_text}\n{table}\n{post_text}"
+            f"DOCUMENT: {document}"
             f"{question_header}\n\n{question_text}")
 
 
@@ -177,6 +204,65 @@ def from_json_file(file_path):
         return from_json(json_string)
 
 
+def iter_json_array(file_path: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Incrementally deserialize the elements of a JSON array stored in a file.
+
+    Only the element being decoded and one chunk of the file are held in memory at a time.
+
+    Args:
+        file_path (str): The path to the JSON file, which must hold a top-level array.
+        chunk_size (int): The number of characters read from the file at a time.
+
+    Yields:
+        Any: Each element of the array, in order.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, encoding="utf-8") as f_in:
+        buffer = ""
+        position = 0
+        eof = False
+        started = False
+        read_size = chunk_size
+        while True:
+            # Skip whitespace and separators between elements
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                if eof:
+                    raise ValueError(f"Unexpected end of JSON array in {file_path}")
+                # Drop the consumed part of the buffer before reading more
+                buffer = f_in.read(read_size)
+                position = 0
+                eof = len(buffer) == 0
+                continue
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError(f"Expected a JSON array in {file_path}")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                # A value ending at the buffer boundary may continue in the next chunk
+                if end < len(buffer) or eof:
+                    yield element
+                    position = end
+                    read_size = chunk_size
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # The element is incomplete: read a larger chunk and decode it again from its start
+            chunk = f_in.read(read_size)
+            eof = len(chunk) == 0
+            buffer = buffer[position:] + chunk
+            position = 0
+            read_size *= 2
+
+
 def glob_files(glob_format: str) -> List[str]:
     """
        Glob files based on a specified format.
@@ -222,16 +308,16 @@ def essentially_equals(x: float, y: float) -> bool:
     Returns:
         bool: True if the two numbers are essentially equal, False otherwise.
     """
-    # Check if x is NaN
-    if np.isnan(x):
+    # Check if x is NaN; math.isnan is much cheaper than np.isnan on scalars, and keeps NumPy out of helpers
+    if math.isnan(x):
         # If x is NaN, check if y is also NaN
-        if np.isnan(y):
+        if math.isnan(y):
             return False
         else:
             return True
     else:
         # If x is not NaN, check if y is NaN
-        if np.isnan(y):
+        if math.isnan(y):
             return False
         else:
             # Calculate the absolute difference between x and y
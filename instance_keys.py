@@ -0,0 +1,165 @@
+import argparse  # Module for parsing command-line arguments
+import hashlib  # Module for hashing functions
+import os  # Module for environment variables
+from typing import Any, Callable, Dict, Iterable, List, Optional  # Type hints for variables and functions
+
+# The fields that identify the document of an instance, hashed in this order with a tab between them
+KEY_FIELDS = ("pre_text", "table", "post_text")
+
+# The key scheme of new keys. Every scheme gives 32 hexadecimal digits, so keys of any scheme fit the same
+# journals, indexes and batch request IDs. Schemes 1 to 3 only hash the document, so instances asking different
+# questions about the same page shared a key; schemes 4 and 5 hash the questions and answers too. Set
+# instance_key_version=5 to key with xxhash where it is installed; journals keyed with another scheme are
+# migrated by the enrichment scripts when they start.
+KEY_VERSION = int(os.environ.get("instance_key_version", 4))
+
+
+def _update_fields(hasher, data: Dict[str, Any]):
+    # Each field is fed to the hash on its own, so the document is never copied into one string
+    hasher.update(data["pre_text"].encode())
+    hasher.update(b"\t")
+    hasher.update(data["table"].encode())
+    hasher.update(b"\t")
+    hasher.update(data["post_text"].encode())
+
+
+def _update_questions(hasher, data: Dict[str, Any]):
+    # The questions and answers tell apart the instances asked about the same document
+    for qa_pair in data["qa_pairs"]:
+        hasher.update(b"\n")
+        hasher.update(qa_pair["question"].encode())
+        hasher.update(b"\t")
+        hasher.update(qa_pair["answer"].encode())
+
+
+def _md5_key(data: Dict[str, Any]) -> str:
+    # The original scheme, kept to recognize and migrate the keys of older files
+    return hashlib.md5("\t".join([data[field] for field in KEY_FIELDS]).encode()).hexdigest()
+
+
+def _sha256_key(data: Dict[str, Any]) -> str:
+    # SHA-256 runs on the SHA extensions of current CPUs through OpenSSL, which makes it faster than both MD5
+    # and BLAKE2b in hashlib; half of the digest is kept
+    hasher = hashlib.sha256()
+    _update_fields(hasher, data)
+    return hasher.hexdigest()[:32]
+
+
+def _xxh3_key(data: Dict[str, Any]) -> str:
+    # xxhash is optional and only needed by files that chose this scheme
+    import xxhash
+    hasher = xxhash.xxh3_128()
+    _update_fields(hasher, data)
+    return hasher.hexdigest()
+
+
+def _sha256_instance_key(data: Dict[str, Any]) -> str:
+    hasher = hashlib.sha256()
+    _update_fields(hasher, data)
+    _update_questions(hasher, data)
+    return hasher.hexdigest()[:32]
+
+
+def _xxh3_instance_key(data: Dict[str, Any]) -> str:
+    import xxhash
+    hasher = xxhash.xxh3_128()
+    _update_fields(hasher, data)
+    _update_questions(hasher, data)
+    return hasher.hexdigest()
+
+
+# The key function of each scheme version
+KEY_SCHEMES: Dict[int, Callable[[Dict[str, Any]], str]] = {
+    1: _md5_key,
+    2: _sha256_key,
+    3: _xxh3_key,
+    4: _sha256_instance_key,
+    5: _xxh3_instance_key,
+}
+
+
+def key_function(version: int = KEY_VERSION) -> Callable[[Dict[str, Any]], str]:
+    """
+    Look up the key function of a scheme version.
+
+    Args:
+        version (int): The key scheme version, one of KEY_SCHEMES.
+
+    Returns:
+        Callable[[Dict[str, Any]], str]: Computes the key of an instance as 32 hexadecimal digits.
+    """
+    if version not in KEY_SCHEMES:
+        raise ValueError(f"Unknown key scheme version {version}, expected one of {sorted(KEY_SCHEMES)}")
+    return KEY_SCHEMES[version]
+
+
+def instance_key(data: Dict[str, Any], version: int = KEY_VERSION) -> str:
+    """
+    Compute the key of an instance from its pre-text, table and post-text, and with schemes 4 and 5 its
+    questions and answers.
+
+    Args:
+        data (Dict[str, Any]): An instance, enriched or not.
+        version (int): The key scheme version.
+
+    Returns:
+        str: The key as 32 hexadecimal digits.
+    """
+    return key_function(version)(data)
+
+
+def instance_keys(records: Iterable[Dict[str, Any]], version: int = KEY_VERSION) -> List[str]:
+    """
+    Compute the keys of many instances, looking up the scheme once.
+
+    Args:
+        records (Iterable[Dict[str, Any]]): The instances.
+        version (int): The key scheme version.
+
+    Returns:
+        List[str]: The key of each instance, in order.
+    """
+    key_of = key_function(version)
+    return [key_of(data) for data in records]
+
+
+def key_version_of(key: str, data: Dict[str, Any]) -> Optional[int]:
+    """
+    Find the scheme that produced a key, by computing the key of the instance with each scheme.
+
+    Args:
+        key (str): A stored key.
+        data (Dict[str, Any]): The instance it was stored with.
+
+    Returns:
+        Optional[int]: The scheme version, or None if no available scheme produces the key.
+    """
+    for version, key_of in KEY_SCHEMES.items():
+        try:
+            if key_of(data) == key:
+                return version
+        except ImportError:
+            continue
+    return None
+
+
+if __name__ == "__main__":
+    # Batch job files are migrated when they are loaded, and indexes are rebuilt when the key scheme changes
+    parser = argparse.ArgumentParser(description="Migrate stored instance keys to another key scheme.")
+    parser.add_argument("files", nargs="+",
+                        help="Journals (.journal) and dead letter files (.dead.jsonl)")
+    parser.add_argument("--version", type=int, default=KEY_VERSION, choices=sorted(KEY_SCHEMES),
+                        help="Key scheme to migrate to")
+    args = parser.parse_args()
+
+    # The journal module imports this one, and loads NumPy for its index, so it is imported once it is needed
+    from journal import DeadLetterLog, EnrichmentJournal
+
+    for file_path in args.files:
+        if file_path.endswith(".journal"):
+            changed = EnrichmentJournal(file_path).migrate_keys(args.version)
+        elif file_path.endswith(".dead.jsonl"):
+            changed = DeadLetterLog(file_path).migrate_keys(args.version)
+        else:
+            parser.error(f"Cannot tell the kind of {file_path} from its extension")
+        print(f"{file_path}: {changed} keys changed")
@@ -0,0 +1,402 @@
+import os  # Module for file system operations
+import time  # Module for timestamping dead letters
+import zlib  # Module providing the CRC-32 checksum
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple  # Type hints for variables and functions
+
+from helpers import create_instance_key, from_json, to_json
+from instance_keys import KEY_VERSION, key_function
+from jsonl_index import JsonlIndex
+
+
+def checksum(payload: bytes) -> bytes:
+    """
+    Calculate the checksum stored alongside each journal record.
+
+    Args:
+        payload (bytes): The serialized record.
+
+    Returns:
+        bytes: The CRC-32 of the payload as eight hexadecimal digits.
+    """
+    return b"%08x" % zlib.crc32(payload)
+
+
+class EnrichmentJournal:
+    """
+    An append-only journal of enriched records, keyed by instance key.
+
+    Each line holds the instance key, a checksum of the record and the record itself, separated by tabs.
+    Records are only ever appended, so an interrupted run can lose at most the line being written. Reading
+    never modifies the file: a line that fails its checksum is skipped and counted in `corrupt_lines`, and an
+    incomplete last line is ignored, since its writer may still be finishing it. Only the writer cuts off an
+    incomplete last line, before it appends its first record. The ordered output file is produced by
+    `compact`.
+
+    Args:
+        path (str): The path of the journal file.
+        fsync (bool): Whether to force each appended record to disk before returning.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        # The number of damaged lines skipped by the last full read
+        self.corrupt_lines = 0
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the journal file if it is open for appending.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _lines(self) -> Iterator[Tuple[int, bytes, Optional[List[bytes]]]]:
+        """
+        Iterate over the complete lines of the journal, without modifying it.
+
+        Yields:
+            Tuple[int, bytes, Optional[List[bytes]]]: The byte offset of the line, the line, and its key,
+            checksum and record fields, or None if the line is damaged.
+        """
+        self.corrupt_lines = 0
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "rb") as f_in:
+            offset = 0
+            for line in f_in:
+                # A line without a newline is a record whose write was interrupted or is still going on
+                if not line.endswith(b"\n"):
+                    return
+                fields = line[:-1].split(b"\t", 2)
+                # A line that fails its checksum is damaged, but the records after it are still good
+                if len(fields) != 3 or checksum(fields[2]) != fields[1]:
+                    self.corrupt_lines += 1
+                    fields = None
+                yield offset, line, fields
+                offset += len(line)
+
+    def _entries(self) -> Iterator[Tuple[bytes, int, int]]:
+        """
+        Iterate over the valid entries of the journal, skipping damaged lines.
+
+        Yields:
+            Tuple[bytes, int, int]: The key, the byte offset of the record and the length of the record.
+        """
+        for offset, _, fields in self._lines():
+            if fields is not None:
+                yield fields[0], offset + len(fields[0]) + len(fields[1]) + 2, len(fields[2])
+
+    def repair(self) -> int:
+        """
+        Cut off an incomplete last line left by an interrupted append, so new records start on a line of
+        their own. Only the process writing the journal may call this, since the last line of a journal
+        another process is appending to may simply not be finished yet.
+
+        Returns:
+            int: The number of bytes cut off.
+        """
+        if not os.path.isfile(self.path):
+            return 0
+        with open(self.path, "r+b") as f_out:
+            size = f_out.seek(0, os.SEEK_END)
+            if size == 0:
+                return 0
+            f_out.seek(size - 1)
+            if f_out.read(1) == b"\n":
+                return 0
+            # Walk back block by block to the end of the last complete line
+            end = size
+            keep = 0
+            while end > 0:
+                start = max(0, end - 65536)
+                f_out.seek(start)
+                position = f_out.read(end - start).rfind(b"\n")
+                if position >= 0:
+                    keep = start + position + 1
+                    break
+                end = start
+            f_out.truncate(keep)
+        return size - keep
+
+    def scan(self) -> Set[str]:
+        """
+        Load the set of instance keys that have been completed, without parsing the records.
+
+        Returns:
+            Set[str]: The keys of all valid records in the journal.
+        """
+        return {key.decode("utf-8") for key, _, _ in self._entries()}
+
+    def append(self, record: Dict[str, Any], key: Optional[str] = None):
+        """
+        Append an enriched record to the journal.
+
+        Args:
+            record (Dict[str, Any]): The enriched record.
+            key (Optional[str]): The instance key of the record. Computed from the record if not given.
+        """
+        if key is None:
+            key = create_instance_key(record)
+        if self._file is None:
+            self.repair()
+            self._file = open(self.path, "ab")
+        payload = to_json(record).encode("utf-8")
+        self._file.write(key.encode("utf-8") + b"\t" + checksum(payload) + b"\t" + payload + b"\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _up_to_date(self, key_of, entries) -> bool:
+        # The first and last records tell whether the journal is keyed with the scheme, or whether it was
+        # migrated already; an empty journal has nothing to migrate
+        if not entries:
+            return True
+        with open(self.path, "rb") as f_in:
+            for key, offset, length in (entries[0], entries[-1]):
+                f_in.seek(offset)
+                if key_of(from_json(f_in.read(length).decode("utf-8"))) != key.decode("utf-8"):
+                    return False
+        return True
+
+    def keys(self, version: int = KEY_VERSION) -> Set[str]:
+        """
+        Load the keys of the journalled records under a key scheme, without modifying the journal, for
+        processes that only read it.
+
+        Args:
+            version (int): The key scheme version.
+
+        Returns:
+            Set[str]: The stored keys if the journal is keyed with the scheme, otherwise the keys computed from
+            the records.
+        """
+        key_of = key_function(version)
+        entries = list(self._entries())
+        if self._up_to_date(key_of, entries):
+            return {key.decode("utf-8") for key, _, _ in entries}
+        return {key_of(from_json(fields[2].decode("utf-8"))) for _, _, fields in self._lines() if fields is not None}
+
+    def migrate_keys(self, version: int = KEY_VERSION) -> int:
+        """
+        Rewrite the journal with the keys of a key scheme, if its records were keyed with another.
+
+        Only the first and last records are checked when the journal is already up to date, so this is cheap
+        enough to call before every scan. The journal is rewritten to a temporary file and moved into place,
+        so only the process writing the journal may migrate it. Damaged lines are copied as they are.
+
+        Args:
+            version (int): The key scheme version.
+
+        Returns:
+            int: The number of keys changed. Zero if the journal was up to date.
+        """
+        self.close()
+        self.repair()
+        key_of = key_function(version)
+        if self._up_to_date(key_of, list(self._entries())):
+            return 0
+        changed = 0
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as f_out:
+            for _, line, fields in self._lines():
+                if fields is None:
+                    f_out.write(line)
+                    continue
+                key, _, payload = fields
+                new_key = key_of(from_json(payload.decode("utf-8"))).encode("utf-8")
+                changed += new_key != key
+                f_out.write(new_key + b"\t" + checksum(payload) + b"\t" + payload + b"\n")
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.replace(temporary_path, self.path)
+        return changed
+
+    def import_jsonl(self, file_path: str) -> int:
+        """
+        Seed the journal from an enriched JSONL file written by an earlier version of the scripts.
+
+        Args:
+            file_path (str): The path of the enriched JSONL file.
+
+        Returns:
+            int: The number of records imported.
+        """
+        count = 0
+        with open(file_path, encoding="utf-8") as f_in:
+            for line in f_in:
+                # Skip a torn last line left by an interrupted run
+                if not line.endswith("\n"):
+                    break
+                self.append(from_json(line))
+                count += 1
+        return count
+
+    def compact(self, input_path: str, output_path: str) -> int:
+        """
+        Write the journalled records to an ordered JSONL file, following the order of the input file.
+
+        The output is written to a temporary file and moved into place, so it is never left half written.
+
+        Args:
+            input_path (str): The path of the input JSONL file that defines the order.
+            output_path (str): The path of the ordered JSONL output.
+
+        Returns:
+            int: The number of input instances that had no record in the journal and were left out.
+        """
+        return compact_journals([self], input_path, output_path)
+
+
+def enriched_keys(file_path: str) -> Set[str]:
+    """
+    Load the keys of the records of an enriched JSONL file, as import_jsonl would journal them, without
+    writing anything.
+
+    Args:
+        file_path (str): The path of the enriched JSONL file.
+
+    Returns:
+        Set[str]: The instance keys.
+    """
+    with open(file_path, encoding="utf-8") as f_in:
+        # A torn last line left by an interrupted run is not imported either
+        return {create_instance_key(from_json(line)) for line in f_in if line.endswith("\n")}
+
+
+def compact_journals(journals: Sequence[EnrichmentJournal],
+                     input_path: str,
+                     output_path: str,
+                     temporary_path: Optional[str] = None) -> int:
+    """
+    Merge several journals into one ordered JSONL file, following the order of the input file.
+
+    A key journalled more than once is written once, from the last journal that holds it.
+
+    Args:
+        journals (Sequence[EnrichmentJournal]): The journals, such as those of the workers of a sharded run.
+        input_path (str): The path of the input JSONL file that defines the order.
+        output_path (str): The path of the ordered JSONL output.
+        temporary_path (Optional[str]): Where the output is written before it is moved into place. Processes
+            merging at the same time need temporary paths of their own. Defaults to the output path with
+            ".tmp" appended.
+
+    Returns:
+        int: The number of input instances that had no record in any journal and were left out.
+    """
+    # Map each key to the journal and location of its latest record
+    offsets = dict()
+    for number, journal in enumerate(journals):
+        journal.close()
+        for key, offset, length in journal._entries():
+            offsets[key.decode("utf-8")] = (number, offset, length)
+    missing = 0
+    temporary_path = temporary_path or output_path + ".tmp"
+    files = [open(journal.path, "rb") if os.path.isfile(journal.path) else None for journal in journals]
+    try:
+        # The index of the input file gives its keys in order without parsing it
+        with JsonlIndex(input_path) as index, open(temporary_path, "wb") as f_out:
+            for key, _ in index.keys_in_order():
+                if key not in offsets:
+                    missing += 1
+                    continue
+                number, offset, length = offsets[key]
+                files[number].seek(offset)
+                f_out.write(files[number].read(length) + b"\n")
+            f_out.flush()
+            os.fsync(f_out.fileno())
+    finally:
+        for f_in in files:
+            if f_in is not None:
+                f_in.close()
+    os.replace(temporary_path, output_path)
+    return missing
+
+
+class DeadLetterLog:
+    """
+    A JSONL file of the instances whose request failed after every retry, with the error, so a run can carry
+    on past them. Dead letters are not journalled, so the next run retries them.
+
+    Args:
+        path (str): The path of the dead letter file. It is only created when the first failure is logged.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the dead letter file if it is open.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, record: Dict[str, Any], error: BaseException, key: Optional[str] = None):
+        """
+        Log an instance that could not be enriched.
+
+        Args:
+            record (Dict[str, Any]): The instance.
+            error (BaseException): The last error of its request.
+            key (Optional[str]): The instance key of the record. Computed from the record if not given.
+        """
+        if key is None:
+            key = create_instance_key(record)
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(to_json({
+            "key": key,
+            "time": time.time(),
+            "error_type": type(error).__name__,
+            "error": str(error),
+            "record": record,
+        }) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def migrate_keys(self, version: int = KEY_VERSION) -> int:
+        """
+        Rewrite the keys of the logged instances with a key scheme.
+
+        Args:
+            version (int): The key scheme version.
+
+        Returns:
+            int: The number of keys changed.
+        """
+        self.close()
+        if not os.path.isfile(self.path):
+            return 0
+        key_of = key_function(version)
+        changed = 0
+        temporary_path = self.path + ".tmp"
+        with open(self.path, encoding="utf-8") as f_in, open(temporary_path, "w", encoding="utf-8") as f_out:
+            for line in f_in:
+                # Skip a torn last line left by an interrupted run
+                if not line.endswith("\n"):
+                    break
+                letter = from_json(line)
+                key = key_of(letter["record"])
+                if letter["key"] != key:
+                    letter["key"] = key
+                    changed += 1
+                f_out.write(to_json(letter) + "\n")
+        os.replace(temporary_path, self.path)
+        return changed
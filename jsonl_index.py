@@ -0,0 +1,330 @@
+import argparse  # Module for parsing command-line arguments
+import mmap  # Module for memory-mapping the indexed file
+import os  # Module for file system operations
+import random  # Module for sampling instances
+import struct  # Module for the binary header
+import tempfile  # Module for the temporary file of a rebuilt index
+import zlib  # Module providing the CRC-32 checksum
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple  # Type hints
+
+import numpy as np  # NumPy, a library for numerical computing
+
+from helpers import from_json
+from instance_keys import KEY_VERSION, key_function
+
+# One entry per line: the binary instance key, the byte offset and length of the line without its newline, and
+# the CRC-32 of the line, so two files can be compared without reading them
+ENTRY = np.dtype([("key", "S16"), ("offset", "<u8"), ("length", "<u4"), ("crc", "<u4")])
+
+# The magic, the number of bytes of the file indexed, the number of entries, the number of them sorted by key,
+# and the offset, length and CRC-32 of the first and last lines indexed, to detect a file rewritten rather than
+# appended to
+HEADER = struct.Struct("<8sQQQQQIIII")
+HEADER_SIZE = 64
+MAGIC = b"JSONLIX"
+
+
+class JsonlIndex:
+    """
+    A sidecar index of a JSONL file, mapping each instance key to the byte offset and length of its lines.
+
+    The index lives next to the file, in `<path>.idx`. It holds a prefix of entries sorted by key, searched by
+    bisection, followed by a short tail of entries for lines appended since, searched directly. When the tail
+    grows past an eighth of the index, the whole index is rebuilt sorted. Both the index and the file are
+    memory-mapped, so a lookup reads one index page and the lines it finds, and nothing else.
+
+    `refresh` brings the index up to date: lines appended to the file are added to the tail, and a file that
+    was rewritten, truncated or replaced, or indexed with another key scheme, is indexed again from scratch.
+
+    Args:
+        path (str): The path of the JSONL file.
+        key_version (int): The instance key scheme, one of instance_keys.KEY_SCHEMES.
+        index_path (Optional[str]): The path of the index file. Defaults to `<path>.idx`.
+    """
+
+    def __init__(self, path: str, key_version: int = KEY_VERSION, index_path: Optional[str] = None):
+        self.path = path
+        self.key_of = key_function(key_version)
+        # The key scheme is part of the magic, so an index of another scheme is never read
+        self.magic = MAGIC + bytes([key_version])
+        self.index_path = index_path or path + ".idx"
+        self.indexed_bytes = 0
+        self.entries = np.empty(0, dtype=ENTRY)
+        self.sorted_count = 0
+        self._data = None
+        self._data_file = None
+
+    def __enter__(self):
+        self.refresh()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return len(self._positions(key)) > 0
+
+    def close(self):
+        """
+        Unmap the index and the file.
+        """
+        self.entries = np.empty(0, dtype=ENTRY)
+        if self._data is not None:
+            self._data.close()
+            self._data_file.close()
+            self._data = self._data_file = None
+
+    def _read_header(self) -> Optional[Tuple[int, ...]]:
+        if not os.path.isfile(self.index_path):
+            return None
+        with open(self.index_path, "rb") as f_in:
+            header = f_in.read(HEADER.size)
+        if len(header) < HEADER.size or not header.startswith(self.magic):
+            return None
+        return HEADER.unpack(header)[1:]
+
+    def _scan(self, f_in, start: int) -> Tuple[np.ndarray, int]:
+        """
+        Index the complete lines of the file from a byte offset.
+
+        Returns:
+            Tuple[np.ndarray, int]: The entries, in file order, and the offset just past the last complete line.
+        """
+        entries = list()
+        f_in.seek(start)
+        offset = start
+        for line in f_in:
+            # A line without a newline is still being written and is left for the next refresh
+            if not line.endswith(b"\n"):
+                break
+            content = line[:-1]
+            if content.strip():
+                key = bytes.fromhex(self.key_of(from_json(content.decode("utf-8"))))
+                entries.append((key, offset, len(content), zlib.crc32(content)))
+            offset += len(line)
+        return np.array(entries, dtype=ENTRY), offset
+
+    def _write(self, entries: np.ndarray, sorted_count: int, indexed_bytes: int, append_from: Optional[int] = None):
+        checks = (0, 0, 0, 0, 0, 0)
+        if len(entries):
+            first, last = entries[np.argmin(entries["offset"])], entries[np.argmax(entries["offset"])]
+            checks = (int(first["offset"]), int(last["offset"]), int(first["length"]), int(first["crc"]),
+                      int(last["length"]), int(last["crc"]))
+        header = HEADER.pack(self.magic, indexed_bytes, len(entries), sorted_count, *checks).ljust(HEADER_SIZE, b"\0")
+        if append_from is None:
+            # A rebuilt index replaces the old one atomically, through a temporary file of its own, since
+            # several processes may build the index of the same file at once
+            descriptor, temporary_path = tempfile.mkstemp(prefix=os.path.basename(self.index_path) + ".",
+                                                          suffix=".tmp", dir=os.path.dirname(self.index_path) or ".")
+            try:
+                with os.fdopen(descriptor, "wb") as f_out:
+                    f_out.write(header)
+                    f_out.write(entries.tobytes())
+                os.replace(temporary_path, self.index_path)
+            except BaseException:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+                raise
+        else:
+            # Appended entries are written before the header that counts them, so a crash leaves a valid index
+            with open(self.index_path, "r+b") as f_out:
+                f_out.seek(HEADER_SIZE + append_from * ENTRY.itemsize)
+                f_out.write(entries[append_from:].tobytes())
+                f_out.truncate()
+                f_out.seek(0)
+                f_out.write(header)
+
+    def refresh(self) -> Dict[str, int]:
+        """
+        Bring the index up to date with the file and map both.
+
+        Returns:
+            Dict[str, int]: The number of entries, and the number of lines indexed by this refresh.
+        """
+        self.close()
+        size = os.path.getsize(self.path)
+        header = self._read_header()
+        indexed = 0
+        with open(self.path, "rb") as f_in:
+            valid = False
+            if header is not None:
+                indexed_bytes, count, sorted_count = header[:3]
+                first_offset, last_offset, first_length, first_crc, last_length, last_crc = header[3:]
+                # The file was only appended to if it did not shrink and its first and last indexed lines are
+                # unchanged
+                if indexed_bytes <= size:
+                    f_in.seek(first_offset)
+                    first_line = f_in.read(first_length)
+                    f_in.seek(last_offset)
+                    valid = count == 0 or (zlib.crc32(first_line) == first_crc
+                                           and zlib.crc32(f_in.read(last_length)) == last_crc)
+            if not valid:
+                entries, indexed_bytes = self._scan(f_in, 0)
+                entries.sort(order=("key", "offset"))
+                self._write(entries, len(entries), indexed_bytes)
+                indexed = len(entries)
+            elif indexed_bytes < size:
+                appended, new_indexed_bytes = self._scan(f_in, indexed_bytes)
+                if len(appended):
+                    existing = np.fromfile(self.index_path, dtype=ENTRY, count=count, offset=HEADER_SIZE)
+                    entries = np.concatenate([existing, appended])
+                    if len(entries) - sorted_count > max(1024, sorted_count // 8):
+                        # The tail has grown too long to search directly, so everything is sorted again
+                        entries.sort(order=("key", "offset"))
+                        self._write(entries, len(entries), new_indexed_bytes)
+                    else:
+                        self._write(entries, sorted_count, new_indexed_bytes, append_from=count)
+                    indexed = len(appended)
+
+        indexed_bytes, count, sorted_count = self._read_header()[:3]
+        self.indexed_bytes = indexed_bytes
+        self.sorted_count = sorted_count
+        self.entries = (np.memmap(self.index_path, dtype=ENTRY, mode="r", offset=HEADER_SIZE, shape=(count,))
+                        if count else np.empty(0, dtype=ENTRY))
+        if indexed_bytes:
+            self._data_file = open(self.path, "rb")
+            self._data = mmap.mmap(self._data_file.fileno(), indexed_bytes, access=mmap.ACCESS_READ)
+        return {"entries": count, "indexed": indexed}
+
+    def _positions(self, key: str) -> np.ndarray:
+        """
+        Find the entries of a key.
+
+        Returns:
+            np.ndarray: The positions of the entries in the index, in file order.
+        """
+        binary_key = np.array(bytes.fromhex(key), dtype="S16")
+        sorted_keys = self.entries["key"][:self.sorted_count]
+        start = np.searchsorted(sorted_keys, binary_key, side="left")
+        end = np.searchsorted(sorted_keys, binary_key, side="right")
+        tail = np.flatnonzero(self.entries["key"][self.sorted_count:] == binary_key) + self.sorted_count
+        positions = np.concatenate([np.arange(start, end), tail])
+        return positions[np.argsort(self.entries["offset"][positions], kind="stable")]
+
+    def line(self, position: int) -> bytes:
+        """
+        Read the line of an entry.
+
+        Args:
+            position (int): The position of the entry in the index.
+
+        Returns:
+            bytes: The line, without its newline.
+        """
+        entry = self.entries[position]
+        offset = int(entry["offset"])
+        return self._data[offset:offset + int(entry["length"])]
+
+    def get(self, key: str) -> List[Dict[str, Any]]:
+        """
+        Look up the records of a key.
+
+        Args:
+            key (str): The instance key, as 32 hexadecimal digits.
+
+        Returns:
+            List[Dict[str, Any]]: The records with the key, in file order. Empty if there are none.
+        """
+        return [from_json(self.line(position).decode("utf-8")) for position in self._positions(key)]
+
+    def keys(self) -> Set[str]:
+        """
+        List the distinct keys of the file.
+
+        Returns:
+            Set[str]: The keys, as hexadecimal digits.
+        """
+        # NumPy strips trailing zero bytes from fixed-width strings
+        return {key.ljust(16, b"\0").hex() for key in np.unique(self.entries["key"]).tolist()}
+
+    def keys_in_order(self) -> Iterator[Tuple[str, int]]:
+        """
+        Iterate over the key of every line in file order, without reading the file.
+
+        Yields:
+            Tuple[str, int]: The key of each line, as hexadecimal digits, and the position of its entry, for
+            reading the line with `line`.
+        """
+        order = np.argsort(self.entries["offset"], kind="stable")
+        for key, position in zip(self.entries["key"][order].tolist(), order.tolist()):
+            yield key.ljust(16, b"\0").hex(), position
+
+    def sample(self, count: int, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Draw random records, reading only the sampled lines.
+
+        Args:
+            count (int): The number of records to draw, at most the number of lines.
+            seed (Optional[int]): The random seed.
+
+        Returns:
+            List[Dict[str, Any]]: The records.
+        """
+        positions = random.Random(seed).sample(range(len(self.entries)), min(count, len(self.entries)))
+        return [from_json(self.line(position).decode("utf-8")) for position in positions]
+
+    def diff(self, other: "JsonlIndex") -> Dict[str, List[str]]:
+        """
+        Compare the lines of two indexed files by key and checksum, without reading either file.
+
+        Args:
+            other (JsonlIndex): The index of the other file.
+
+        Returns:
+            Dict[str, List[str]]: The keys only in this file ("removed"), only in the other ("added"), and in
+            both but with different lines ("changed").
+        """
+
+        def lines_by_key(index: "JsonlIndex") -> Dict[bytes, Set[int]]:
+            lines = dict()
+            for key, crc in zip(index.entries["key"].tolist(), index.entries["crc"].tolist()):
+                lines.setdefault(key, set()).add(crc)
+            return lines
+
+        ours, theirs = lines_by_key(self), lines_by_key(other)
+
+        def hexes(keys) -> List[str]:
+            return sorted(key.ljust(16, b"\0").hex() for key in keys)
+
+        return {
+            "removed": hexes(ours.keys() - theirs.keys()),
+            "added": hexes(theirs.keys() - ours.keys()),
+            "changed": hexes(key for key in ours.keys() & theirs.keys() if ours[key] != theirs[key]),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index a JSONL file by instance key and inspect its instances.")
+    parser.add_argument("file", help="JSONL file, such as data/finqa_data.json or an enriched file")
+    parser.add_argument("--key", action="append", default=list(), help="Print the records with this instance key")
+    parser.add_argument("--sample", type=int, default=0, help="Print this many random records")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--field", action="append", default=None,
+                        help="Only print these fields of each record, such as response or qa_pairs")
+    parser.add_argument("--diff", default=None, help="Compare with another JSONL file by key")
+    args = parser.parse_args()
+
+    def show(record: Dict[str, Any]):
+        if args.field:
+            record = {field: record.get(field) for field in args.field}
+        print(record)
+
+    with JsonlIndex(args.file) as index:
+        print(f"{args.file}: {len(index)} lines, {len(index.keys())} keys")
+        for key in args.key:
+            records = index.get(key)
+            if not records:
+                print(f"{key}: not found")
+            for record in records:
+                show(record)
+        for record in index.sample(args.sample, args.seed):
+            show(record)
+        if args.diff:
+            with JsonlIndex(args.diff) as other:
+                for change, keys in index.diff(other).items():
+                    print(f"{change}: {len(keys)}")
+                    for key in keys[:20]:
+                        print(f"  {key}")
@@ -0,0 +1,283 @@
+import json  # Module for JSON serialization and deserialization
+import os  # Module for file system operations
+import re  # Module for regular expressions
+import socket  # Module giving the host name of a worker
+import threading  # Module for the heartbeat thread
+import time  # Module providing the wall clock shared by the workers
+from typing import Any, Dict, Iterable, List, Optional  # Type hints for variables and functions
+
+from metrics import DEFAULT_METRICS, Metrics
+
+# A lease file, named after the work it covers and its generation
+LEASE_FILE = re.compile(r"^(?P<name>.+)\.lease\.(?P<generation>\d+)$")
+
+
+def default_owner() -> str:
+    """
+    Name the current process, uniquely among the workers sharing a lease directory.
+
+    Returns:
+        str: The host name and process ID.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Lease:
+    """
+    A claim on a unit of work, kept alive by a heartbeat until it is released.
+
+    While the lease is entered as a context manager, a background thread renews it every third of the lease
+    period. If another worker took the work over, because a heartbeat came too late, `lost` is set and the
+    holder should stop as soon as it can; whatever it wrote is its own and is never overwritten.
+
+    Args:
+        directory (LeaseDirectory): The directory holding the lease.
+        name (str): The name of the work.
+        generation (int): The number of times the work has been claimed, this claim included.
+    """
+
+    def __init__(self, directory: "LeaseDirectory", name: str, generation: int):
+        self.directory = directory
+        self.name = name
+        self.generation = generation
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def path(self) -> str:
+        return self.directory.lease_path(self.name, self.generation)
+
+    def renew(self) -> bool:
+        """
+        Extend the lease by a lease period, unless it has been taken over.
+
+        Returns:
+            bool: Whether the lease is still held.
+        """
+        if self.lost or max(self.directory.generations(self.name), default=0) > self.generation:
+            self.lost = True
+            self.directory.metrics.increment("lease_lost_total")
+            return False
+        self.directory.write_lease(self.name, self.generation, time.time() + self.directory.lease_seconds)
+        return True
+
+    def release(self, done: bool):
+        """
+        Give the work back.
+
+        Args:
+            done (bool): Whether the work is complete, which marks it done for every worker. Otherwise the
+                lease expires at once, so another worker can claim the work again.
+        """
+        self.stop()
+        if self.lost:
+            return
+        if done:
+            self.directory.mark_done(self.name)
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        else:
+            # The lease file stays, so its generation still counts the claims
+            self.directory.write_lease(self.name, self.generation, 0.0)
+
+    def _loop(self):
+        while not self._stop.wait(self.directory.lease_seconds / 3):
+            if not self.renew():
+                return
+
+    def start(self) -> "Lease":
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class LeaseDirectory:
+    """
+    Leases on named units of work, shared by worker processes through a directory, on one host or on several
+    hosts sharing a filesystem.
+
+    Each claim of a unit creates the file `<name>.lease.<generation>` with the next generation number. The file
+    is created exclusively, so when several workers race to claim or reclaim a unit, exactly one of them wins.
+    The lease holds its owner and its expiry time, pushed forward by the heartbeat of the owner. A unit whose
+    latest lease has expired, because its worker crashed or stalled, can be claimed again. A finished unit is
+    marked by the file `<name>.done`.
+
+    Expiry times are compared across hosts, so their clocks must agree to well within the lease period.
+
+    Args:
+        path (str): The directory, created if missing.
+        owner (Optional[str]): The name of this worker. Defaults to the host name and process ID.
+        lease_seconds (float): How long a lease lasts without a heartbeat.
+        max_claims (int): How many times a unit is claimed before it is given up on, so a unit that fails
+            every worker does not circulate forever.
+        metrics (Metrics): The registry receiving the claims, reclaims and lost leases.
+    """
+
+    def __init__(self,
+                 path: str,
+                 owner: Optional[str] = None,
+                 lease_seconds: float = 120.0,
+                 max_claims: int = 5,
+                 metrics: Metrics = DEFAULT_METRICS):
+        self.path = path
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        self.max_claims = max_claims
+        self.metrics = metrics
+        os.makedirs(path, exist_ok=True)
+
+    def lease_path(self, name: str, generation: int) -> str:
+        return os.path.join(self.path, f"{name}.lease.{generation}")
+
+    def done_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.done")
+
+    def generations(self, name: str) -> List[int]:
+        """
+        List the generations of the lease files of a unit.
+
+        Args:
+            name (str): The name of the unit.
+
+        Returns:
+            List[int]: The generations found, in no particular order.
+        """
+        generations = list()
+        for file_name in os.listdir(self.path):
+            match = LEASE_FILE.match(file_name)
+            if match is not None and match.group("name") == name:
+                generations.append(int(match.group("generation")))
+        return generations
+
+    def read_lease(self, name: str, generation: int) -> Optional[Dict[str, Any]]:
+        """
+        Read a lease file.
+
+        Args:
+            name (str): The name of the unit.
+            generation (int): The generation of the lease.
+
+        Returns:
+            Optional[Dict[str, Any]]: The owner and expiry time of the lease, or None if the file is gone.
+        """
+        path = self.lease_path(name, generation)
+        try:
+            with open(path, encoding="utf-8") as f_in:
+                return json.load(f_in)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # A lease whose first write has not landed yet, or whose owner crashed before it did, expires a
+            # lease period after it was created
+            try:
+                return {"owner": None, "expires": os.path.getmtime(path) + self.lease_seconds}
+            except FileNotFoundError:
+                return None
+
+    def write_lease(self, name: str, generation: int, expires: float):
+        """
+        Replace the content of a lease file held by this worker.
+
+        Args:
+            name (str): The name of the unit.
+            generation (int): The generation of the lease.
+            expires (float): The new expiry time, as a wall clock timestamp.
+        """
+        path = self.lease_path(name, generation)
+        temporary_path = f"{path}.{self.owner}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f_out:
+            json.dump({"owner": self.owner, "expires": expires}, f_out)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.replace(temporary_path, path)
+
+    def is_done(self, name: str) -> bool:
+        return os.path.isfile(self.done_path(name))
+
+    def mark_done(self, name: str):
+        try:
+            with open(self.done_path(name), "x", encoding="utf-8") as f_out:
+                f_out.write(self.owner + "\n")
+        except FileExistsError:
+            # A worker that lost the lease to a stall may have finished the unit too
+            pass
+
+    def claim(self, name: str) -> Optional[Lease]:
+        """
+        Claim a unit of work, if it is neither done, held by a live lease, nor given up on.
+
+        Args:
+            name (str): The name of the unit.
+
+        Returns:
+            Optional[Lease]: The lease, or None if the unit cannot be claimed.
+        """
+        if self.is_done(name):
+            return None
+        latest = max(self.generations(name), default=0)
+        if latest:
+            lease = self.read_lease(name, latest)
+            if lease is not None and lease["expires"] > time.time():
+                return None
+            if latest >= self.max_claims:
+                return None
+        try:
+            # Only one of the workers racing for the next generation creates its file
+            with open(self.lease_path(name, latest + 1), "x", encoding="utf-8") as f_out:
+                json.dump({"owner": self.owner, "expires": time.time() + self.lease_seconds}, f_out)
+                f_out.flush()
+                os.fsync(f_out.fileno())
+        except FileExistsError:
+            return None
+        self.metrics.increment("lease_claims_total")
+        if latest:
+            self.metrics.increment("lease_reclaims_total")
+            # The expired leases of earlier generations are no longer needed
+            for generation in range(1, latest + 1):
+                try:
+                    os.remove(self.lease_path(name, generation))
+                except FileNotFoundError:
+                    pass
+        return Lease(self, name, latest + 1)
+
+    def status(self, names: Iterable[str]) -> Dict[str, int]:
+        """
+        Count the units by state.
+
+        Args:
+            names (Iterable[str]): The names of the units.
+
+        Returns:
+            Dict[str, int]: The numbers of units that are "done", "held" by a live lease, "given_up" on after
+            max_claims claims, and "pending".
+        """
+        counts = {"done": 0, "held": 0, "given_up": 0, "pending": 0}
+        now = time.time()
+        for name in names:
+            if self.is_done(name):
+                counts["done"] += 1
+                continue
+            latest = max(self.generations(name), default=0)
+            lease = self.read_lease(name, latest) if latest else None
+            if lease is not None and lease["expires"] > now:
+                counts["held"] += 1
+            elif latest >= self.max_claims:
+                counts["given_up"] += 1
+            else:
+                counts["pending"] += 1
+        return counts
@@ -0,0 +1,500 @@
+import contextvars  # Module for tracking the current span across threads and tasks
+import itertools  # Module providing a thread-safe counter for span ids
+import json  # Module for JSON serialization and deserialization
+import math  # Module for infinity in bucket bounds
+import re  # Module for matching model names to price families
+import sys  # Module for the standard error stream
+import threading  # Module for locking and the dashboard thread
+import time  # Module providing wall and monotonic clocks
+from bisect import bisect_left  # Finds the bucket of an observation
+from collections import deque  # A bounded history of finished spans
+from contextlib import contextmanager  # Builds the span context manager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, TextIO, Tuple  # Type hints
+
+# The upper bounds of the latency histogram buckets, in seconds, from a cache hit to a slow completion
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# The price in USD per million input and output tokens of each model family. A model name matches a family
+# when it is the family name itself, or the family name followed by a version or date and a preview tag, such as
+# "gpt-4-0613" or "claude-3-opus-20240229"; the longest matching family wins. Other models, such as "gpt-4o"
+# against "gpt-4", are unpriced rather than billed at the price of an unrelated family.
+PRICES = {
+    "claude-3-opus": (15.0, 75.0),
+    "claude-3-sonnet": (3.0, 15.0),
+    "claude-3-haiku": (0.25, 1.25),
+    "claude-3-5-sonnet": (3.0, 15.0),
+    "claude-2": (8.0, 24.0),
+    "claude-2.1": (8.0, 24.0),
+    "claude-instant": (0.8, 2.4),
+    "claude-instant-1.2": (0.8, 2.4),
+    "gpt-4": (30.0, 60.0),
+    "gpt-4-32k": (60.0, 120.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4-0125": (10.0, 30.0),
+    "gpt-4-1106": (10.0, 30.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+
+# What may follow a family name in a priced model name: version numbers or a date, and a preview tag
+PRICE_SUFFIX = re.compile(r"^(-\d+)*(-preview|-latest)?$")
+
+# The span the current thread or task is inside of, the parent of any span opened within it
+_current_span: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("span", default=None)
+_span_ids = itertools.count(1)
+
+# Metric series are keyed by name and sorted label pairs
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def series_key(name: str, labels: Dict[str, Any]) -> SeriesKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def price_of(model: str) -> Optional[Tuple[float, float]]:
+    """
+    Look up the price of a model.
+
+    Args:
+        model (str): The model name.
+
+    Returns:
+        Optional[Tuple[float, float]]: The USD per million input and output tokens, or None if unknown.
+    """
+    matches = [family for family in PRICES
+               if model.startswith(family) and PRICE_SUFFIX.match(model[len(family):])]
+    return PRICES[max(matches, key=len)] if matches else None
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets, as exported to Prometheus.
+
+    Args:
+        bounds (Sequence[float]): The upper bounds of the buckets, in increasing order.
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        # One count per bucket, plus the overflow bucket
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram"):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, fraction: float) -> float:
+        """
+        Estimate a quantile by interpolating linearly within its bucket.
+
+        Args:
+            fraction (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimate, or NaN if nothing was observed. Values in the overflow bucket are reported
+            as the largest bound.
+        """
+        if not self.count:
+            return math.nan
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0.0
+                return lower + (self.bounds[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+
+class Metrics:
+    """
+    A registry of counters, gauges, histograms and trace spans, safe to use from many threads.
+
+    Every component that reports metrics takes a registry, defaulting to DEFAULT_METRICS, so a run can
+    collect into its own registry or switch collection off with NullMetrics.
+
+    Args:
+        span_history (int): The number of finished spans kept for export.
+    """
+
+    def __init__(self, span_history: int = 10000):
+        self.counters: Dict[SeriesKey, float] = dict()
+        self.gauges: Dict[SeriesKey, float] = dict()
+        self.histograms: Dict[SeriesKey, Histogram] = dict()
+        self.spans = deque(maxlen=span_history)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1.0, **labels):
+        """
+        Add to a counter.
+
+        Args:
+            name (str): The counter name, ending in "_total" by convention.
+            value (float): The amount to add.
+            **labels: The labels of the series, such as provider and model.
+        """
+        key = series_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Set a gauge to its current value.
+
+        Args:
+            name (str): The gauge name.
+            value (float): The value.
+            **labels: The labels of the series.
+        """
+        with self._lock:
+            self.gauges[series_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels):
+        """
+        Record an observation in a histogram.
+
+        Args:
+            name (str): The histogram name, ending in its unit by convention, such as "_seconds".
+            value (float): The observation.
+            buckets (Sequence[float]): The bucket bounds, used when the series is first seen.
+            **labels: The labels of the series.
+        """
+        key = series_key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[Dict[str, Any]]:
+        """
+        Time a block of work as a trace span.
+
+        The duration is recorded in the histogram "<name>_seconds" and a failure in the counter
+        "<name>_errors_total", labelled with the exception type. Spans opened inside the block, including in
+        tasks and worker threads started from it, are recorded as its children.
+
+        Args:
+            name (str): The span name.
+            **labels: The labels of the span and its metrics.
+
+        Yields:
+            Dict[str, Any]: The span record, whose "labels" can be extended within the block.
+        """
+        parent = _current_span.get()
+        span_id = next(_span_ids)
+        span = {
+            "name": name,
+            "labels": dict(labels),
+            # A span without a parent starts a new trace, identified by its own id
+            "trace_id": parent["trace_id"] if parent else span_id,
+            "span_id": span_id,
+            "parent_id": parent["span_id"] if parent else None,
+            "start": time.time(),
+            "duration": 0.0,
+            "error": None,
+        }
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = type(e).__name__
+            self.increment(f"{name}_errors_total", error=span["error"], **labels)
+            raise
+        finally:
+            _current_span.reset(token)
+            span["duration"] = time.perf_counter() - start
+            self.observe(f"{name}_seconds", span["duration"], **labels)
+            with self._lock:
+                self.spans.append(span)
+
+    def value(self, name: str, **labels) -> float:
+        """
+        Sum a counter or gauge over every series matching the given labels.
+
+        Args:
+            name (str): The counter or gauge name.
+            **labels: The labels to match. Labels not given match any value.
+
+        Returns:
+            float: The sum, or zero if no series matches.
+        """
+        wanted = {(label, str(value)) for label, value in labels.items()}
+        with self._lock:
+            return sum(value for (series, series_labels), value in
+                       itertools.chain(self.counters.items(), self.gauges.items())
+                       if series == name and wanted.issubset(series_labels))
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        """
+        Merge a histogram over every series matching the given labels.
+
+        Args:
+            name (str): The histogram name.
+            **labels: The labels to match. Labels not given match any value.
+
+        Returns:
+            Histogram: The merged histogram, empty if no series matches.
+        """
+        wanted = {(label, str(value)) for label, value in labels.items()}
+        merged = None
+        with self._lock:
+            for (series, series_labels), histogram in self.histograms.items():
+                if series == name and wanted.issubset(series_labels):
+                    if merged is None:
+                        merged = Histogram(histogram.bounds)
+                    merged.merge(histogram)
+        return merged or Histogram()
+
+    def spend(self) -> float:
+        """
+        Estimate the USD spent from the token usage reported by the providers.
+
+        Returns:
+            float: The spend, leaving out models without a known price.
+        """
+        total = 0.0
+        with self._lock:
+            counters = list(self.counters.items())
+        for (name, labels), value in counters:
+            if name not in ("provider_input_tokens_total", "provider_output_tokens_total"):
+                continue
+            price = price_of(dict(labels).get("model", ""))
+            if price is not None:
+                total += value * price[name == "provider_output_tokens_total"] / 1e6
+        return total
+
+    def unpriced_models(self) -> List[str]:
+        """
+        List the models that reported token usage but have no known price, and so are left out of the spend.
+
+        Returns:
+            List[str]: The model names, sorted.
+        """
+        with self._lock:
+            counters = list(self.counters.items())
+        return sorted({dict(labels).get("model", "") for (name, labels), _ in counters
+                       if name in ("provider_input_tokens_total", "provider_output_tokens_total")
+                       and price_of(dict(labels).get("model", "")) is None})
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Export every metric and the recent spans as JSON-serializable values.
+
+        Returns:
+            Dict[str, Any]: The counters, gauges and histograms, with their labels, and the finished spans.
+        """
+        with self._lock:
+            counters = list(self.counters.items())
+            gauges = list(self.gauges.items())
+            histograms = [(key, histogram.bounds, list(histogram.counts), histogram.count, histogram.sum,
+                           histogram.quantile(0.5), histogram.quantile(0.99))
+                          for key, histogram in self.histograms.items()]
+            spans = list(self.spans)
+        return {
+            "started": self.started,
+            "uptime_seconds": time.time() - self.started,
+            "spend_usd": self.spend(),
+            "unpriced_models": self.unpriced_models(),
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in counters],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                       for (name, labels), value in gauges],
+            "histograms": [{"name": name, "labels": dict(labels), "bounds": list(bounds), "counts": counts,
+                            "count": count, "sum": total,
+                            "p50": None if math.isnan(p50) else p50, "p99": None if math.isnan(p99) else p99}
+                           for (name, labels), bounds, counts, count, total, p50, p99 in histograms],
+            "spans": spans,
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        Export every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition, one sample per line.
+        """
+
+        def format_labels(labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = labels + extra
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{label}="{value}"' for label, value in pairs) + "}"
+
+        lines: List[str] = list()
+        with self._lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                typed = set()
+                for (name, labels), value in sorted(series.items()):
+                    if name not in typed:
+                        lines.append(f"# TYPE {name} {kind}")
+                        typed.add(name)
+                    lines.append(f"{name}{format_labels(labels)} {value:g}")
+            typed = set()
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.bounds + (math.inf,), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else f"{bound:g}"
+                    lines.append(f"{name}_bucket{format_labels(labels, (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        Write every metric to a file, as JSON if the path ends in ".json" and as Prometheus text otherwise.
+
+        Args:
+            path (str): The output path.
+        """
+        with open(path, "w", encoding="utf-8") as f_out:
+            if path.endswith(".json"):
+                json.dump(self.snapshot(), f_out, indent=2)
+            else:
+                f_out.write(self.to_prometheus())
+
+
+class NullMetrics(Metrics):
+    """
+    A registry that discards everything, for runs that should not pay for collection.
+    """
+
+    def increment(self, name: str, value: float = 1.0, **labels):
+        pass
+
+    def set(self, name: str, value: float, **labels):
+        pass
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels):
+        pass
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[Dict[str, Any]]:
+        yield {"name": name, "labels": dict(labels)}
+
+
+# The registry used by every component that is not given one
+DEFAULT_METRICS = Metrics()
+
+
+def format_duration(seconds: float) -> str:
+    if math.isnan(seconds) or math.isinf(seconds):
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class Dashboard:
+    """
+    A live status line for a long run, showing progress, rate, ETA, request latency, errors and spend.
+
+    The line is redrawn in place on a terminal and printed on a new line otherwise, so it can be followed
+    in a log file.
+
+    Args:
+        metrics (Metrics): The registry to read.
+        total (Optional[int]): The number of records the run will write, for the ETA.
+        interval (float): The number of seconds between refreshes.
+        stream (TextIO): Where the status line is written.
+        records (str): The counter of the records written.
+        failures (str): The counter of the records given up on, which count towards progress too.
+    """
+
+    def __init__(self,
+                 metrics: Metrics = DEFAULT_METRICS,
+                 total: Optional[int] = None,
+                 interval: float = 1.0,
+                 stream: TextIO = sys.stderr,
+                 records: str = "enrichment_records_total",
+                 failures: str = "enrichment_failures_total"):
+        self.metrics = metrics
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.records = records
+        self.failures = failures
+        self.started = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def render(self) -> str:
+        """
+        Build the status line from the current metrics.
+
+        Returns:
+            str: The status line.
+        """
+        elapsed = time.monotonic() - self.started
+        failed = int(self.metrics.value(self.failures))
+        done = int(self.metrics.value(self.records)) + failed
+        rate = done / elapsed if elapsed > 0 else 0.0
+        progress = f"{done}" if self.total is None else f"{done}/{self.total}"
+        if failed:
+            progress += f" ({failed} failed)"
+        eta = (self.total - done) / rate if self.total is not None and rate > 0 else math.nan
+        latency = self.metrics.histogram("provider_request_seconds")
+        requests = latency.count
+        rate_limited = self.metrics.value("provider_request_errors_total", error="RateLimitError")
+        errors = self.metrics.value("provider_request_errors_total") - rate_limited
+        error_rate = errors / requests if requests else 0.0
+        p50 = latency.quantile(0.5)
+        return (f"{progress} records | {rate:.2f}/s | elapsed {format_duration(elapsed)} | "
+                f"ETA {format_duration(eta)} | {requests} requests, p50 "
+                f"{'-' if math.isnan(p50) else f'{p50:.2f}s'} | errors {error_rate:.1%} | "
+                f"rate limited {int(rate_limited)} | "
+                f"circuit {'open' if self.metrics.value('pool_circuit_open') else 'closed'} | "
+                f"cache hits {int(self.metrics.value('provider_cache_hits_total'))} | "
+                f"${self.metrics.spend():.2f}")
+
+    def _refresh(self, final: bool = False):
+        line = self.render()
+        if self.stream.isatty():
+            # Clear the rest of the previous line, which may have been longer
+            self.stream.write("\r" + line + "\033[K" + ("\n" if final else ""))
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._refresh()
+
+    def start(self) -> "Dashboard":
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._refresh(final=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,210 @@
+import asyncio  # Module for asynchronous I/O and concurrency
+import re  # Module for regular expressions
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple  # Type hints
+
+from helpers import create_document
+from metrics import DEFAULT_METRICS, Metrics
+from prompts import ANSWER_TOKENS_PER_QUESTION, PromptBuilder
+
+# The answer given for a question the response left out, which the answer extractor reads as missing without
+# shifting the answers after it
+MISSING_ANSWER = "n/a"
+
+# The tokens set aside for the instructions and indices of a packed prompt
+PACK_INSTRUCTION_TOKENS = 256
+
+# An answer line of a packed response, such as "2.1: 12.5". Models decorate the index in many ways, so
+# brackets, markdown emphasis, bullets and the words "document" and "question" around it are all accepted.
+ANSWER_LINE = re.compile(r"""
+    ^[\s>*#\-•]*                                # bullets, quotes and emphasis
+    [\[(]?\s*(?:document\s*)?(?P<instance>\d+)  # the instance number
+    \s*[.,/\-]\s*(?:question\s*)?
+    (?P<question>\d+)\s*[\])]?                  # the question number
+    \**\s*[:=)\]]?\s*\**\s*                     # the separator before the answer
+    (?P<answer>.*?)[\s*]*$                      # the answer, without trailing emphasis
+""", re.VERBOSE | re.IGNORECASE)
+
+
+def create_packed_message(instances: Sequence[Dict[str, Any]],
+                          document_of: Callable[[Dict[str, Any]], str] = create_document) -> str:
+    """
+    Create one message asking the questions of several instances, with an indexed answer format.
+
+    Args:
+        instances (Sequence[Dict[str, Any]]): The instances, each with its own document and questions.
+        document_of (Callable[[Dict[str, Any]], str]): Renders the document of an instance.
+
+    Returns:
+        str: The message body.
+    """
+    sections = list()
+    for number, data in enumerate(instances, start=1):
+        questions = "\n".join(f"{number}.{index} {qa_pair['question']}"
+                              for index, qa_pair in enumerate(data["qa_pairs"], start=1))
+        sections.append(f"DOCUMENT {number}: {document_of(data)}\nQUESTIONS:\n{questions}")
+    return (f"Here are {len(instances)} documents, each followed by questions regarding that document only. "
+            f"Please respond with one line per question, in the form <document>.<question>: <answer>, "
+            f"for example 1.1: 12.5\n\n"
+            f"Please be sure to answer every question, only with a number or yes or no, "
+            f"and do not reply with words.\n\n"
+            + "\n\n".join(sections))
+
+
+def demultiplex(response: Optional[str], question_counts: Sequence[int]) -> List[Optional[str]]:
+    """
+    Split a packed response into the response of each instance.
+
+    Answer lines are matched by their indices, in any order; the first answer to a question wins and
+    indices outside the pack are ignored. A response without any indexed lines but with exactly one line
+    per question is read in order instead.
+
+    Args:
+        response (Optional[str]): The packed response.
+        question_counts (Sequence[int]): The number of questions of each instance, in pack order.
+
+    Returns:
+        List[Optional[str]]: The response of each instance, with its answers tab delimited as in the
+        two-question prompt, MISSING_ANSWER for a question left out, and None for an instance none of whose
+        questions were answered.
+    """
+    answers: Dict[Tuple[int, int], str] = dict()
+    lines = [line for line in (response or "").splitlines() if line.strip()]
+    for line in lines:
+        match = ANSWER_LINE.match(line)
+        if match is None or not match.group("answer"):
+            continue
+        instance, question = int(match.group("instance")) - 1, int(match.group("question")) - 1
+        if 0 <= instance < len(question_counts) and 0 <= question < question_counts[instance]:
+            answers.setdefault((instance, question), match.group("answer"))
+    if not answers and len(lines) == sum(question_counts):
+        # The indices were dropped, but the answers are still one per line in question order
+        positions = [(instance, question)
+                     for instance, count in enumerate(question_counts) for question in range(count)]
+        answers = {position: line.strip() for position, line in zip(positions, lines)}
+
+    responses = list()
+    for instance, count in enumerate(question_counts):
+        found = [answers.get((instance, question)) for question in range(count)]
+        if all(answer is None for answer in found):
+            responses.append(None)
+        else:
+            responses.append("\t".join(MISSING_ANSWER if answer is None else answer for answer in found))
+    return responses
+
+
+class Packer:
+    """
+    Pack consecutive short instances into one request each, to cut the requests per minute and the fixed
+    overhead of each request under strict rate limits.
+
+    Instances are added to a pack while it holds fewer than max_instances instances and max_questions
+    questions, and while its documents and questions fit pack_tokens. An instance that fills the budget on
+    its own is sent alone with its usual prompt, trimmed by the prompt builder. The provider's max_tokens
+    must leave room for max_questions answers, see answer_max_tokens. Instances a packed response does not
+    answer at all are requested again on their own.
+
+    Args:
+        prompt_builder (PromptBuilder): Counts tokens, and builds the prompt of an instance sent alone.
+        max_instances (int): The largest number of instances in a pack.
+        max_questions (Optional[int]): The largest number of questions in a pack. Defaults to two per
+            instance.
+        pack_tokens (int): The token budget of the documents and questions of a pack.
+        document_of (Callable[[Dict[str, Any]], str]): Renders the document of an instance.
+        metrics (Metrics): The registry receiving the packs sent and the instances requested again.
+    """
+
+    def __init__(self,
+                 prompt_builder: PromptBuilder,
+                 max_instances: int = 8,
+                 max_questions: Optional[int] = None,
+                 pack_tokens: int = 4000,
+                 document_of: Callable[[Dict[str, Any]], str] = create_document,
+                 metrics: Metrics = DEFAULT_METRICS):
+        self.prompt_builder = prompt_builder
+        self.max_instances = max_instances
+        self.max_questions = max_questions or 2 * max_instances
+        # The instructions of a packed prompt take the rest of the prompt budget
+        self.pack_tokens = min(pack_tokens, prompt_builder.max_prompt_tokens - PACK_INSTRUCTION_TOKENS)
+        self.document_of = document_of
+        self.metrics = metrics
+
+    @property
+    def max_tokens(self) -> int:
+        # The output tokens a full pack needs
+        return ANSWER_TOKENS_PER_QUESTION * self.max_questions
+
+    def pack(self, records: Iterable[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Group consecutive records into packs, keeping their order.
+
+        Records that already carry a "response" are passed through in a group of their own.
+
+        Args:
+            records (Iterable[Dict[str, Any]]): The records.
+
+        Yields:
+            List[Dict[str, Any]]: The records of each pack.
+        """
+        group: List[Dict[str, Any]] = list()
+        tokens = questions = 0
+        for record in records:
+            if "response" in record:
+                if group:
+                    yield group
+                    group, tokens, questions = list(), 0, 0
+                yield [record]
+                continue
+            questions_text = "\n".join(qa_pair["question"] for qa_pair in record["qa_pairs"])
+            record_tokens = self.prompt_builder.count(f"{self.document_of(record)}\n{questions_text}")
+            record_questions = len(record["qa_pairs"])
+            if group and (len(group) == self.max_instances
+                          or tokens + record_tokens > self.pack_tokens
+                          or questions + record_questions > self.max_questions):
+                yield group
+                group, tokens, questions = list(), 0, 0
+            group.append(record)
+            tokens += record_tokens
+            questions += record_questions
+        if group:
+            yield group
+
+    def message(self, records: Sequence[Dict[str, Any]]) -> str:
+        """
+        Build the prompt of a pack.
+
+        Args:
+            records (Sequence[Dict[str, Any]]): The records of the pack.
+
+        Returns:
+            str: The prompt, packed if there are several records and the usual one otherwise.
+        """
+        if len(records) == 1:
+            return self.prompt_builder.build(records[0])
+        return create_packed_message(records, self.document_of)
+
+    async def request(self, pool, call, records: Sequence[Dict[str, Any]]) -> List[str]:
+        """
+        Request the responses of a pack through a provider pool.
+
+        Args:
+            pool (ProviderPool): The pool whose budgets and retries every request goes through.
+            call (Callable): The provider call, mapping a message to a response.
+            records (Sequence[Dict[str, Any]]): The records of the pack, without responses.
+
+        Returns:
+            List[str]: The response of each record, as if it had been requested alone.
+        """
+        if len(records) == 1:
+            return [await pool.request(call, self.message(records))]
+        response = await pool.request(call, self.message(records))
+        self.metrics.increment("packing_requests_total")
+        self.metrics.increment("packing_instances_total", len(records))
+        responses = demultiplex(response, [len(record["qa_pairs"]) for record in records])
+        # The instances the model skipped are asked on their own
+        skipped = [index for index, text in enumerate(responses) if text is None]
+        self.metrics.increment("packing_fallbacks_total", len(skipped))
+        fallbacks = await asyncio.gather(*(pool.request(call, self.prompt_builder.build(records[index]))
+                                           for index in skipped))
+        for index, text in zip(skipped, fallbacks):
+            responses[index] = text
+        return responses
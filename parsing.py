@@ -0,0 +1,204 @@
+import multiprocessing  # Module providing a queue shared with the worker processes
+import os  # Module for file system operations
+import re  # Module for regular expressions
+import shutil  # Module for concatenating the shards
+from concurrent.futures import ProcessPoolExecutor  # Process pool for parsing files in parallel
+from queue import Empty  # Raised when no shard arrives before the poll timeout
+from typing import Any, Dict, List, Optional  # Type hints for variables and functions
+
+from helpers import iter_json_array, to_json
+
+# Regular expression identifying question-answer pair keys, such as "qa", "qa_0" and "qa_1"
+QA_KEY_PATTERN = re.compile(r"^qa_?(\d+)?$")
+
+# How long the parent waits for a shard before checking whether the workers are still running, in seconds
+POLL_INTERVAL = 0.1
+
+
+def qa_keys(instance: Dict[str, Any]) -> List[str]:
+    """
+    Find the question-answer pair keys of an instance, in question order.
+
+    Args:
+        instance (Dict[str, Any]): An instance from the original FinQA data.
+
+    Returns:
+        List[str]: The matching keys, sorted by question number, with an unnumbered "qa" first.
+    """
+    matches = list()
+    for key in instance:
+        # Only keys starting with "qa" can match, which skips the regular expression for most keys
+        if key.startswith("qa"):
+            match = QA_KEY_PATTERN.match(key)
+            if match is not None:
+                q_num = match.group(1)
+                matches.append((-1 if q_num is None else int(q_num), key))
+    return [key for _, key in sorted(matches)]
+
+
+def process_instance(instance: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert an instance of the original FinQA data into the flattened format used by the pipeline.
+
+    Args:
+        instance (Dict[str, Any]): An instance from the original FinQA data.
+
+    Returns:
+        Dict[str, Any]: The pre-text, table, post-text and question-answer pairs of the instance.
+    """
+    # Collect the question-answer pairs in question order
+    qa_pairs = [{
+        "question": instance[key]["question"],
+        "answer": instance[key]["answer"]
+    } for key in qa_keys(instance)]
+    return {
+        "pre_text": " ".join(instance["pre_text"]),  # Combine pre-text strings
+        "table": "\n".join(["\t".join(row) for row in instance["table_ori"]]),  # Format the table as tab-delimited
+        "post_text": " ".join(instance["post_text"]),  # Combine post-text strings
+        "qa_pairs": qa_pairs,  # Include the processed question-answer pairs
+    }
+
+
+def shard_path(shard_dir: str, data_file: str, index: int) -> str:
+    """
+    Build the path of a shard.
+
+    Args:
+        shard_dir (str): The directory holding the shards.
+        data_file (str): The input file the shard was parsed from.
+        index (int): The position of the shard within the input file.
+
+    Returns:
+        str: The path of the shard.
+    """
+    stem = os.path.splitext(os.path.basename(data_file))[0]
+    return os.path.join(shard_dir, f"{stem}-{index:05d}.jsonl")
+
+
+def parse_file(data_file: str, shard_dir: str, shard_size: int, queue=None) -> List[Dict[str, Any]]:
+    """
+    Stream an input file and write its processed instances to JSONL shards.
+
+    Each shard is written to a temporary file and renamed into place, so a shard that exists is complete.
+
+    Args:
+        data_file (str): The path of the original FinQA JSON file.
+        shard_dir (str): The directory to write the shards to.
+        shard_size (int): The number of instances per shard.
+        queue: An optional queue that receives each shard description as soon as the shard is written.
+
+    Returns:
+        List[Dict[str, Any]]: The descriptions of the shards written, in order.
+    """
+    shards = list()
+
+    def finish_shard(f_out, index: int, count: int):
+        f_out.close()
+        path = shard_path(shard_dir, data_file, index)
+        os.replace(path + ".tmp", path)
+        shard = {"path": path, "source": data_file, "index": index, "count": count}
+        shards.append(shard)
+        if queue is not None:
+            queue.put(shard)
+
+    f_out, index, count = None, 0, 0
+    for instance in iter_json_array(data_file):
+        if f_out is None:
+            f_out = open(shard_path(shard_dir, data_file, index) + ".tmp", "w", encoding="utf-8")
+        # Write the processed instance to the shard as a JSON string, followed by a newline
+        f_out.write(to_json(process_instance(instance)) + "\n")
+        count += 1
+        if count == shard_size:
+            finish_shard(f_out, index, count)
+            f_out, index, count = None, index + 1, 0
+    if f_out is not None:
+        finish_shard(f_out, index, count)
+    return shards
+
+
+def write_manifest(manifest_path: str, output_path: str, shards: List[Dict[str, Any]], complete: bool):
+    """
+    Write the shard manifest, replacing the previous one atomically.
+
+    Args:
+        manifest_path (str): The path of the manifest.
+        output_path (str): The path of the combined output file.
+        shards (List[Dict[str, Any]]): The descriptions of the shards written so far.
+        complete (bool): Whether every input file has been parsed and the combined output written.
+    """
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f_out:
+        f_out.write(to_json({"complete": complete, "output": output_path, "shards": shards}, indent=2))
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def parse_files(data_files: List[str],
+                output_path: str = "data/finqa_data.json",
+                shard_dir: str = "data/shards",
+                shard_size: int = 1000,
+                workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Parse the original FinQA files in parallel into JSONL shards, a manifest and a combined output file.
+
+    The manifest lists every shard as soon as it is written, so downstream stages can start consuming
+    shards before parsing finishes. Once all files are parsed, the shards are concatenated in input order
+    into the combined output file and the manifest is marked complete.
+
+    Args:
+        data_files (List[str]): The paths of the original FinQA JSON files.
+        output_path (str): The path of the combined JSONL output.
+        shard_dir (str): The directory to write the shards and manifest to.
+        shard_size (int): The number of instances per shard.
+        workers (Optional[int]): The number of worker processes. Defaults to one per input file, up to the CPU count.
+
+    Returns:
+        List[Dict[str, Any]]: The descriptions of all shards, in input order.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest_path = os.path.join(shard_dir, "manifest.json")
+    # Remove the shards of a previous run so they cannot be mistaken for new ones
+    for name in os.listdir(shard_dir):
+        if name.endswith(".jsonl") or name.endswith(".tmp") or name == "manifest.json":
+            os.remove(os.path.join(shard_dir, name))
+    write_manifest(manifest_path, output_path, [], False)
+
+    if workers is None:
+        workers = max(1, min(len(data_files), os.cpu_count() or 1))
+    order = {data_file: position for position, data_file in enumerate(data_files)}
+
+    def sort_key(shard: Dict[str, Any]):
+        return order[shard["source"]], shard["index"]
+
+    shards = list()
+
+    def publish(shard: Dict[str, Any]):
+        shards.append(shard)
+        write_manifest(manifest_path, output_path, sorted(shards, key=sort_key), False)
+
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=workers) as executor:
+        queue = manager.Queue()
+        futures = [executor.submit(parse_file, data_file, shard_dir, shard_size, queue)
+                   for data_file in data_files]
+        # Publish each shard in the manifest as soon as a worker reports it. The loop is driven by the futures
+        # rather than by messages from the workers, since a worker killed outright sends nothing, but its
+        # future still completes, failing with BrokenProcessPool
+        while not all(future.done() for future in futures):
+            try:
+                publish(queue.get(timeout=POLL_INTERVAL))
+            except Empty:
+                continue
+        # Every worker has returned, so the shards it reported are all in the queue already
+        while not queue.empty():
+            publish(queue.get())
+        # Raise any error from the workers
+        for future in futures:
+            future.result()
+
+    shards.sort(key=sort_key)
+    # Combine the shards into the single file read by the later stages
+    with open(output_path + ".tmp", "wb") as f_out:
+        for shard in shards:
+            with open(shard["path"], "rb") as f_in:
+                shutil.copyfileobj(f_in, f_out)
+    os.replace(output_path + ".tmp", output_path)
+    write_manifest(manifest_path, output_path, shards, True)
+    return shards
@@ -0,0 +1,280 @@
+from typing import Any, Callable, Dict, List, Optional  # Type hints for variables and functions
+
+from helpers import create_message_body
+
+# The context window of each model family, matched by the longest prefix of the model name
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4o": 128000,
+    "claude-2": 100000,
+    "claude-3": 200000,
+}
+
+# The context window assumed for models missing from CONTEXT_WINDOWS
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# The output tokens allowed per question. Answers are a number or yes/no, so this leaves room for a short
+# working such as "x = 12.5" without paying for long explanations.
+ANSWER_TOKENS_PER_QUESTION = 32
+
+
+class Tokenizer:
+    """
+    A local tokenizer, used to count and trim prompts without calling the provider.
+
+    Args:
+        encode (Callable[[str], List[int]]): Maps text to token IDs.
+        decode (Callable[[List[int]], str]): Maps token IDs back to text.
+    """
+
+    def __init__(self, encode: Callable[[str], List[int]], decode: Callable[[List[int]], str]):
+        self.encode = encode
+        self.decode = decode
+
+    def count(self, text: str) -> int:
+        """
+        Count the tokens in a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            int: The number of tokens.
+        """
+        return len(self.encode(text))
+
+
+def anthropic_tokenizer() -> Tokenizer:
+    """
+    Load the tokenizer bundled with the Anthropic client.
+
+    Returns:
+        Tokenizer: The tokenizer.
+    """
+    import anthropic
+    # The tokenizer is read from a file shipped with the client, so no API key or network access is needed
+    tokenizer = anthropic.Anthropic(api_key="unused").get_tokenizer()
+    return Tokenizer(lambda text: tokenizer.encode(text).ids, tokenizer.decode)
+
+
+def openai_tokenizer(model: str) -> Tokenizer:
+    """
+    Load the tiktoken encoding of an OpenAI model.
+
+    Args:
+        model (str): The model name, such as gpt-4.
+
+    Returns:
+        Tokenizer: The tokenizer.
+    """
+    import tiktoken
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Models newer than the installed tiktoken use the encoding of the GPT-4 family
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return Tokenizer(lambda text: encoding.encode(text, disallowed_special=()), encoding.decode)
+
+
+def get_tokenizer(provider: str, model: str) -> Tokenizer:
+    """
+    Load the local tokenizer of a provider's model.
+
+    Args:
+        provider (str): The provider name, "anthropic" or "openai".
+        model (str): The model name.
+
+    Returns:
+        Tokenizer: The tokenizer.
+
+    Raises:
+        ValueError: If the provider is unknown.
+    """
+    if provider == "anthropic":
+        return anthropic_tokenizer()
+    if provider == "openai":
+        return openai_tokenizer(model)
+    raise ValueError(f"Unexpected provider {provider}")
+
+
+def context_window(model: str) -> int:
+    """
+    Look up the context window of a model.
+
+    Args:
+        model (str): The model name.
+
+    Returns:
+        int: The number of tokens shared by the prompt and the response.
+    """
+    matches = [prefix for prefix in CONTEXT_WINDOWS if model.startswith(prefix)]
+    return CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_WINDOW
+
+
+def answer_max_tokens(question_count: int = 2) -> int:
+    """
+    Choose the max_tokens of a request from the number of questions it asks.
+
+    Args:
+        question_count (int): The largest number of questions asked in a single prompt.
+
+    Returns:
+        int: The output token limit.
+    """
+    return ANSWER_TOKENS_PER_QUESTION * question_count
+
+
+class PromptBuilder:
+    """
+    Build prompts that fit a token budget, trimming the document but never the questions.
+
+    Prompts within the budget are left exactly as rendered. Longer documents are trimmed with the local
+    tokenizer: the table is kept first, since it holds most of the figures the questions ask about, then
+    the remaining budget is shared between the pre-text, which keeps its end, next to the table, and the
+    post-text, which keeps its start. A table that does not fit on its own is cut to the rows that do.
+
+    Args:
+        tokenizer (Tokenizer): The tokenizer of the model.
+        max_prompt_tokens (int): The token budget of each prompt.
+        render (Callable[[Dict[str, Any]], str]): Renders an instance into a prompt.
+    """
+
+    def __init__(self,
+                 tokenizer: Tokenizer,
+                 max_prompt_tokens: int,
+                 render: Callable[[Dict[str, Any]], str] = create_message_body):
+        self.tokenizer = tokenizer
+        self.max_prompt_tokens = max_prompt_tokens
+        self.render = render
+        self.prompts = 0
+        self.trimmed = 0
+        self.prompt_tokens = 0
+        self.removed_tokens = 0
+        self.largest_prompt = 0
+
+    @classmethod
+    def for_model(cls,
+                  provider: str,
+                  model: str,
+                  max_tokens: int,
+                  max_prompt_tokens: Optional[int] = None,
+                  render: Callable[[Dict[str, Any]], str] = create_message_body) -> "PromptBuilder":
+        """
+        Create a builder for a model, budgeting whatever the response leaves of the context window.
+
+        Args:
+            provider (str): The provider name.
+            model (str): The model name.
+            max_tokens (int): The output token limit of each request.
+            max_prompt_tokens (Optional[int]): A tighter prompt budget, to cut cost and latency.
+            render (Callable[[Dict[str, Any]], str]): Renders an instance into a prompt.
+
+        Returns:
+            PromptBuilder: The builder.
+        """
+        budget = context_window(model) - max_tokens
+        if max_prompt_tokens is not None:
+            budget = min(budget, max_prompt_tokens)
+        return cls(get_tokenizer(provider, model), budget, render)
+
+    def count(self, text: str) -> int:
+        return self.tokenizer.count(text)
+
+    def keep_start(self, text: str, tokens: int) -> str:
+        ids = self.tokenizer.encode(text)
+        return text if len(ids) <= tokens else self.tokenizer.decode(ids[:max(0, tokens)])
+
+    def keep_end(self, text: str, tokens: int) -> str:
+        ids = self.tokenizer.encode(text)
+        return text if len(ids) <= tokens else self.tokenizer.decode(ids[len(ids) - max(0, tokens):])
+
+    def keep_rows(self, table: str, tokens: int) -> str:
+        # Keep whole rows from the top, so the header and the rows read with it stay intact
+        rows = list()
+        used = 0
+        for row in table.split("\n"):
+            used += self.count(row) + 1
+            if used > tokens:
+                break
+            rows.append(row)
+        return "\n".join(rows)
+
+    def fit(self, data: Dict[str, Any], budget: int) -> Dict[str, Any]:
+        """
+        Trim the document of an instance so that its parts fit a number of tokens.
+
+        Args:
+            data (Dict[str, Any]): The instance.
+            budget (int): The tokens available to the pre-text, table and post-text together.
+
+        Returns:
+            Dict[str, Any]: A copy of the instance with its document trimmed.
+        """
+        table_tokens = self.count(data["table"])
+        if table_tokens >= budget:
+            return dict(data, pre_text="", table=self.keep_rows(data["table"], budget), post_text="")
+        remaining = budget - table_tokens
+        pre_tokens, post_tokens = self.count(data["pre_text"]), self.count(data["post_text"])
+        # Split the rest evenly, handing any share one side does not need to the other
+        pre_share = max(remaining // 2, remaining - post_tokens)
+        post_share = remaining - min(pre_tokens, pre_share)
+        return dict(data,
+                    pre_text=self.keep_end(data["pre_text"], pre_share),
+                    post_text=self.keep_start(data["post_text"], post_share))
+
+    def build(self, data: Dict[str, Any]) -> str:
+        """
+        Build the prompt of an instance within the token budget.
+
+        Args:
+            data (Dict[str, Any]): The instance.
+
+        Returns:
+            str: The prompt.
+        """
+        prompt = self.render(data)
+        tokens = self.count(prompt)
+        original_tokens = tokens
+        if tokens > self.max_prompt_tokens:
+            # The instructions and questions are always sent, so only the rest of the budget goes to the document
+            empty = dict(data, pre_text="", table="", post_text="")
+            budget = self.max_prompt_tokens - self.count(self.render(empty))
+            # Token counts are not quite additive across the joins, so tighten until the prompt fits
+            while True:
+                prompt = self.render(self.fit(data, budget))
+                tokens = self.count(prompt)
+                if tokens <= self.max_prompt_tokens or budget <= 0:
+                    break
+                budget -= tokens - self.max_prompt_tokens
+            if tokens > self.max_prompt_tokens:
+                # Not even the questions fit, which only a misconfigured budget can cause; send them anyway
+                prompt = self.render(empty)
+                tokens = self.count(prompt)
+            self.trimmed += 1
+            self.removed_tokens += original_tokens - tokens
+        self.prompts += 1
+        self.prompt_tokens += tokens
+        self.largest_prompt = max(self.largest_prompt, tokens)
+        return prompt
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report the token statistics of the prompts built so far.
+
+        Returns:
+            Dict[str, Any]: The number of prompts, how many were trimmed, the prompt tokens in total, on
+            average and at most, and the tokens removed by trimming.
+        """
+        return {
+            "prompts": self.prompts,
+            "trimmed": self.trimmed,
+            "prompt_tokens": self.prompt_tokens,
+            "mean_prompt_tokens": round(self.prompt_tokens / self.prompts, 1) if self.prompts else 0.0,
+            "max_prompt_tokens": self.largest_prompt,
+            "removed_tokens": self.removed_tokens,
+        }
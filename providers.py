@@ -0,0 +1,391 @@
+import os  # Module to access environment variables
+import threading  # Module for creating the connection pool once across worker threads
+from abc import ABC, abstractmethod  # Abstract base classes for the provider interface
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence  # Type hints for variables and functions
+
+from cache import ResponseCache
+from enrichment import RateLimitError, TransientError, parse_retry_after
+from metrics import DEFAULT_METRICS, Metrics
+
+if TYPE_CHECKING:
+    # The transport loads httpcore, which takes longer to import than the rest of the scripts together, so it
+    # is only imported once a provider sends its first request
+    from transport import JsonBody, Transport
+
+
+class ChatProvider(ABC):
+    """
+    A synchronous chat model behind a provider API, called with a user message and returning the response text.
+
+    Responses are looked up in and stored to the response cache, keyed by provider, parameters and message.
+    Rate limit and overload rejections are raised as RateLimitError, and network errors, timeouts, server
+    errors and malformed responses as TransientError, so the enrichment engine can back off and retry.
+
+    Args:
+        params (Dict[str, Any]): The request parameters, such as model and temperature.
+        cache (Optional[ResponseCache]): The response cache, or None to always call the API.
+        metrics (Metrics): The registry receiving cache hits, request latency and errors, and token usage.
+    """
+
+    # The provider name, used in cache keys and result store partitions
+    name = "provider"
+    # The statuses the API uses to reject requests for rate limits or overload
+    rate_limit_statuses = (429,)
+    # Whether one request can return several samples, through the `n` parameter
+    supports_n = False
+
+    def __init__(self,
+                 params: Dict[str, Any],
+                 cache: Optional[ResponseCache] = None,
+                 metrics: Metrics = DEFAULT_METRICS):
+        self.params = params
+        self.cache = cache
+        self.metrics = metrics
+        # The connection pool given by the caller, or the arguments of the one created by the first request
+        self._transport: Optional["Transport"] = None
+        self._transport_args: Sequence[Any] = ()
+        self._transport_options: Dict[str, Any] = dict()
+        self._body: Optional["JsonBody"] = None
+        self._transport_lock = threading.Lock()
+
+    @property
+    def model(self) -> str:
+        return self.params["model"]
+
+    @property
+    def transport(self) -> "Transport":
+        # Creating a provider neither imports httpcore nor opens a pool, so runs that never send a request,
+        # such as dry runs and fully cached ones, start fast
+        if self._transport is None:
+            # The first requests arrive together from the engine's worker threads, which must share one pool
+            with self._transport_lock:
+                if self._transport is None:
+                    from transport import Transport
+                    self._transport = Transport(*self._transport_args, **self._transport_options)
+        return self._transport
+
+    def transport_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Report the connection reuse and request timings of the connection pool.
+
+        Returns:
+            Optional[Dict[str, Any]]: The stats of the pool, or None if no request opened one.
+        """
+        return self._transport.stats() if self._transport is not None else None
+
+    def close(self):
+        """
+        Close the connection pool, if it was opened.
+        """
+        if self._transport is not None:
+            self._transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def body(self) -> "JsonBody":
+        # The parameters are serialized once; each request only adds its message
+        if self._body is None:
+            from transport import JsonBody
+            self._body = JsonBody(self.params)
+        return self._body
+
+    def __call__(self, message: str) -> str:
+        """
+        Get the response to a user message, from the cache if possible.
+
+        Args:
+            message (str): The user message.
+
+        Returns:
+            str: The response text.
+        """
+        return self.sample(message, [0])[0]
+
+    def sample(self, message: str, indices: Sequence[int]) -> List[str]:
+        """
+        Get several samples of the response to a user message, each cached on its own.
+
+        Sample 0 is the response returned by a plain call, so a self-consistency run reuses the responses of
+        single-sample runs. The samples missing from the cache are requested together through the `n`
+        parameter where the API supports it, and one after another otherwise; callers wanting them in
+        parallel ask for one sample per call.
+
+        Args:
+            message (str): The user message.
+            indices (Sequence[int]): The indices of the samples, which tell the cached samples apart.
+
+        Returns:
+            List[str]: The response text of each sample, in the order of the indices.
+        """
+        responses: Dict[int, str] = dict()
+        cache_keys: Dict[int, str] = dict()
+        for index in indices:
+            if self.cache is None:
+                continue
+            # Reuse a cached response for the same model, parameters, prompt and sample
+            params = self.params if index == 0 else dict(self.params, sample=index)
+            cache_keys[index] = self.cache.make_key(self.name, params, message)
+            cached_response = self.cache.get(cache_keys[index])
+            if cached_response is not None:
+                self.metrics.increment("provider_cache_hits_total", provider=self.name, model=self.model)
+                responses[index] = cached_response
+            else:
+                self.metrics.increment("provider_cache_misses_total", provider=self.name, model=self.model)
+        missing = [index for index in indices if index not in responses]
+        if missing:
+            # Time the API call, counting its failures by exception type
+            with self.metrics.span("provider_request", provider=self.name, model=self.model):
+                if self.supports_n and len(missing) > 1:
+                    texts = self.complete_n(message, len(missing))
+                else:
+                    texts = [self.complete(message) for _ in missing]
+            for index, text in zip(missing, texts):
+                responses[index] = text
+                if self.cache is not None:
+                    params = self.params if index == 0 else dict(self.params, sample=index)
+                    self.cache.put(cache_keys[index], self.name, params, text)
+        return [responses[index] for index in indices]
+
+    def record_usage(self, input_tokens: int, output_tokens: int):
+        """
+        Count the tokens the API reports it billed for a request.
+
+        Args:
+            input_tokens (int): The prompt tokens.
+            output_tokens (int): The completion tokens.
+        """
+        self.metrics.increment("provider_input_tokens_total", input_tokens, provider=self.name, model=self.model)
+        self.metrics.increment("provider_output_tokens_total", output_tokens, provider=self.name, model=self.model)
+
+    @abstractmethod
+    def complete(self, message: str) -> str:
+        """
+        Send a user message to the API.
+
+        Args:
+            message (str): The user message.
+
+        Returns:
+            str: The response text.
+
+        Raises:
+            RateLimitError: If the request was rejected because of rate limits or overload.
+            TransientError: If the request failed in a way that may succeed when retried.
+            HTTPStatusError: If the request was rejected as invalid.
+        """
+
+    @abstractmethod
+    def complete_n(self, message: str, n: int) -> List[str]:
+        """
+        Send a user message to the API, asking for several samples of the response. Where supports_n is set,
+        the samples come from a single request.
+
+        Args:
+            message (str): The user message.
+            n (int): The number of samples.
+
+        Returns:
+            List[str]: The response text of each sample.
+        """
+
+    def post(self, path: str, body: bytes) -> Dict[str, Any]:
+        """
+        Send a request through the provider's transport and classify its failures.
+
+        Args:
+            path (str): The API path.
+            body (bytes): The serialized JSON body.
+
+        Returns:
+            Dict[str, Any]: The parsed response.
+
+        Raises:
+            RateLimitError: If the response has one of the rate limit statuses.
+            TransientError: If no response was received, the response is a server error or a request timeout,
+                or the response is not JSON.
+            HTTPStatusError: If the response is any other error.
+        """
+        from transport import NETWORK_ERRORS
+        try:
+            response = self.transport.post(path, body)
+        except NETWORK_ERRORS as e:
+            raise TransientError(f"{type(e).__name__}: {e}") from e
+        retry_after = parse_retry_after(response.headers.get("retry-after"))
+        if response.status_code in self.rate_limit_statuses:
+            raise RateLimitError(response.text, retry_after)
+        if response.status_code == 408 or response.status_code >= 500:
+            raise TransientError(f"HTTP {response.status_code}: {response.text[:1000]}", retry_after)
+        response.raise_for_status()
+        try:
+            return response.json()
+        except ValueError as e:
+            raise TransientError(f"Malformed response: {response.text[:1000]}") from e
+
+
+class AnthropicProvider(ChatProvider):
+    """
+    The Anthropic Messages API.
+
+    Args:
+        api_key (str): The Anthropic API key.
+        params (Dict[str, Any]): The message parameters, such as model, max_tokens and temperature.
+        base_url (str): The API base URL, which can be pointed at a local stub server.
+        cache (Optional[ResponseCache]): The response cache.
+        transport (Optional[Transport]): A connection pool to share with other providers of the same API.
+        metrics (Metrics): The registry receiving the request latency, errors, retries and token usage.
+        **transport_options: Options of the connection pool created when none is given, see Transport.
+    """
+
+    name = "anthropic"
+    rate_limit_statuses = (429, 529)
+
+    def __init__(self,
+                 api_key: str,
+                 params: Dict[str, Any],
+                 base_url: str = "https://api.anthropic.com",
+                 cache: Optional[ResponseCache] = None,
+                 transport: Optional["Transport"] = None,
+                 metrics: Metrics = DEFAULT_METRICS,
+                 **transport_options):
+        super().__init__(params, cache, metrics)
+        self._transport = transport
+        self._transport_args = (base_url, {"x-api-key": api_key, "anthropic-version": "2023-06-01"})
+        self._transport_options = transport_options
+
+    def complete(self, message: str) -> str:
+        # Send the message to the Anthropic API to get a response
+        payload = self.post("/v1/messages", self.body.build([{
+            "role": "user",
+            "content": [{
+                "type": "text",
+                "text": message  # Pass the user's message to the model
+            }]
+        }]))
+        usage = payload.get("usage", dict())
+        self.record_usage(usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+        content = payload.get("content")
+        if not isinstance(content, list):
+            raise TransientError(f"Malformed response: {payload}")
+        if not content:
+            # An empty content is retried by the enrichment engine, with backoff
+            self.metrics.increment("provider_empty_retries_total", provider=self.name, model=self.model)
+            raise TransientError("The response content is empty")
+        return content[0]["text"]
+
+    def complete_n(self, message: str, n: int) -> List[str]:
+        # The Messages API returns a single sample per request, so each sample is requested and billed on its own
+        return [self.complete(message) for _ in range(n)]
+
+
+class OpenAIProvider(ChatProvider):
+    """
+    The OpenAI chat completions API.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        params (Dict[str, Any]): The chat completion parameters, such as model and temperature.
+        base_url (str): The API base URL, which can be pointed at a local stub server.
+        organization (Optional[str]): The OpenAI organization to bill.
+        cache (Optional[ResponseCache]): The response cache.
+        message_limit (Optional[int]): The number of characters each message is truncated to, or None to send
+            messages whole. Prompts are normally fitted to the context window by prompts.PromptBuilder instead.
+        transport (Optional[Transport]): A connection pool to share with other providers of the same API.
+        metrics (Metrics): The registry receiving the request latency, errors, retries and token usage.
+        **transport_options: Options of the connection pool created when none is given, see Transport.
+    """
+
+    name = "openai"
+    rate_limit_statuses = (429, 503)
+    supports_n = True
+
+    def __init__(self,
+                 api_key: str,
+                 params: Dict[str, Any],
+                 base_url: str = "https://api.openai.com",
+                 organization: Optional[str] = None,
+                 cache: Optional[ResponseCache] = None,
+                 message_limit: Optional[int] = None,
+                 transport: Optional["Transport"] = None,
+                 metrics: Metrics = DEFAULT_METRICS,
+                 **transport_options):
+        super().__init__(params, cache, metrics)
+        self.message_limit = message_limit
+        headers = {"Authorization": f"Bearer {api_key}"}
+        if organization:
+            headers["OpenAI-Organization"] = organization
+        self._transport = transport
+        self._transport_args = (base_url, headers)
+        self._transport_options = transport_options
+
+    def sample(self, message: str, indices: Sequence[int]) -> List[str]:
+        # Truncate before the cache lookup, so the cache key matches the message actually sent
+        return super().sample(message[:self.message_limit], indices)
+
+    def complete(self, message: str) -> str:
+        return self.complete_n(message, 1)[0]
+
+    def complete_n(self, message: str, n: int) -> List[str]:
+        # The prompt is sent and billed once, however many samples are drawn
+        payload = self.post("/v1/chat/completions", self.body.build([{
+            "role": "user",
+            "content": message
+        }], {"n": n} if n > 1 else None))
+        usage = payload.get("usage", dict())
+        self.record_usage(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+        try:
+            choices = sorted(payload["choices"], key=lambda choice: choice.get("index", 0))
+            texts = [choice["message"]["content"].strip() for choice in choices]
+        except (KeyError, IndexError, TypeError, AttributeError) as e:
+            # An error payload or a missing message is retried by the enrichment engine, with backoff
+            raise TransientError(f"Malformed response: {payload}") from e
+        if len(texts) < n:
+            raise TransientError(f"Malformed response: {n} samples requested, {len(texts)} received")
+        return texts[:n]
+
+
+def create_provider(name: str,
+                    params: Dict[str, Any],
+                    cache: Optional[ResponseCache] = None,
+                    transport: Optional["Transport"] = None,
+                    metrics: Metrics = DEFAULT_METRICS,
+                    **transport_options) -> ChatProvider:
+    """
+    Create a provider from the credentials and base URL in the environment.
+
+    Args:
+        name (str): The provider name, "anthropic" or "openai".
+        params (Dict[str, Any]): The request parameters, such as model and temperature.
+        cache (Optional[ResponseCache]): The response cache.
+        transport (Optional[Transport]): A connection pool to share with other providers of the same API.
+        metrics (Metrics): The registry receiving the request latency, errors, retries and token usage.
+        **transport_options: Options of the connection pool created when none is given, see Transport.
+
+    Returns:
+        ChatProvider: The provider.
+
+    Raises:
+        ValueError: If the provider is unknown.
+    """
+    if name == "anthropic":
+        return AnthropicProvider(os.environ["anthropic_api_key"],
+                                 params,
+                                 base_url=os.environ.get("anthropic_base_url", "https://api.anthropic.com"),
+                                 cache=cache,
+                                 transport=transport,
+                                 metrics=metrics,
+                                 **transport_options)
+    if name == "openai":
+        return OpenAIProvider(os.environ["openai_api_key"],
+                              params,
+                              base_url=os.environ.get("openai_base_url", "https://api.openai.com"),
+                              organization=os.environ.get("openai_organization"),
+                              cache=cache,
+                              transport=transport,
+                              metrics=metrics,
+                              **transport_options)
+    raise ValueError(f"Unexpected provider {name}")
@@ -0,0 +1,267 @@
+import argparse  # Module for parsing command-line arguments
+import os  # Module for file system operations
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple  # Type hints for variables and functions
+from urllib.parse import quote  # Escapes names for use as directory names
+
+import numpy as np  # NumPy, a library for numerical computing
+import pyarrow as pa  # Apache Arrow, the in-memory columnar format
+import pyarrow.compute as pc  # Vectorized compute functions over Arrow arrays
+import pyarrow.dataset as ds  # Multi-file datasets with partition pruning and predicate pushdown
+import pyarrow.parquet as pq  # Parquet reading and writing
+
+from helpers import create_instance_key, from_json, is_yes_or_no_answer
+from scoring import SCORER_VERSION, extract_pair_values
+
+# One row per question-answer pair. The document, question-answer and response columns are stored
+# separately, so scoring can read the extracted values without touching the long document text. The scorer
+# version identifies the answer extraction rules the values were extracted with.
+SCHEMA = pa.schema([
+    ("instance_key", pa.string()),
+    ("qa_index", pa.int8()),
+    ("question_count", pa.int8()),
+    ("pre_text", pa.string()),
+    ("table", pa.string()),
+    ("post_text", pa.string()),
+    ("question", pa.string()),
+    ("answer", pa.string()),
+    ("response", pa.string()),
+    ("target_value", pa.float64()),
+    ("predicted_value", pa.float64()),
+    ("scorer_version", pa.string()),
+])
+
+# Provider, model and run are directory partitions, so filters on them skip whole directories. Their values are
+# percent-encoded in the directory names, so a model such as "org/model" stays a single directory.
+PARTITION_SCHEMA = pa.schema([("provider", pa.string()), ("model", pa.string()), ("run", pa.string())])
+PARTITIONING = ds.HivePartitioning(PARTITION_SCHEMA, segment_encoding="uri")
+
+# The schema of the dataset, given explicitly so runs converted before a column was added read it as null
+STORE_SCHEMA = pa.unify_schemas([SCHEMA, PARTITION_SCHEMA])
+
+
+def partition_dir(store_dir: str, provider: str, model: str, run: str) -> str:
+    """
+    Build the directory holding the results of one run of one model.
+
+    Args:
+        store_dir (str): The root directory of the store.
+        provider (str): The provider name.
+        model (str): The model name.
+        run (str): The run name.
+
+    Returns:
+        str: The partition directory.
+    """
+    return os.path.join(store_dir, *(f"{name}={quote(value, safe='')}"
+                                     for name, value in [("provider", provider), ("model", model), ("run", run)]))
+
+
+def rows_of(lines: Iterable[str]) -> Iterable[Dict]:
+    """
+    Flatten enriched records into one row per question-answer pair.
+
+    Args:
+        lines (Iterable[str]): The lines of an enriched JSONL file.
+
+    Yields:
+        Dict: A row matching SCHEMA.
+    """
+    for line in lines:
+        data = from_json(line)
+        key = create_instance_key(data)
+        qa_pairs = data["qa_pairs"]
+        for qa_index, (qa_pair, (target_value, predicted_value)) in enumerate(zip(qa_pairs,
+                                                                                  extract_pair_values(data))):
+            yield {
+                "instance_key": key,
+                "qa_index": qa_index,
+                "question_count": len(qa_pairs),
+                "pre_text": data["pre_text"],
+                "table": data["table"],
+                "post_text": data["post_text"],
+                "question": qa_pair["question"],
+                "answer": qa_pair["answer"],
+                "response": data["response"],
+                "target_value": target_value,
+                "predicted_value": predicted_value,
+                "scorer_version": SCORER_VERSION,
+            }
+
+
+def convert_jsonl(file_path: str,
+                  store_dir: str,
+                  provider: str,
+                  model: str,
+                  run: str = "default",
+                  batch_size: int = 10000) -> int:
+    """
+    Convert an enriched JSONL file into the columnar store, replacing any earlier copy of the same run.
+
+    Args:
+        file_path (str): The path of the enriched JSONL file.
+        store_dir (str): The root directory of the store.
+        provider (str): The provider name.
+        model (str): The model name.
+        run (str): The run name.
+        batch_size (int): The number of rows per Parquet row group.
+
+    Returns:
+        int: The number of rows written.
+    """
+    directory = partition_dir(store_dir, provider, model, run)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "part-0.parquet")
+    # Write to a hidden temporary file, which datasets skip, so readers never see a partial run
+    temporary_path = os.path.join(directory, ".part-0.parquet.tmp")
+    count = 0
+    with open(file_path, encoding="utf-8") as f_in, \
+            pq.ParquetWriter(temporary_path, SCHEMA, compression="zstd") as writer:
+        batch: List[Dict] = list()
+        for row in rows_of(f_in):
+            batch.append(row)
+            if len(batch) == batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=SCHEMA))
+                count += len(batch)
+                batch = list()
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=SCHEMA))
+            count += len(batch)
+    os.replace(temporary_path, path)
+    return count
+
+
+def open_store(store_dir: str) -> ds.Dataset:
+    """
+    Open the columnar store as a dataset.
+
+    Args:
+        store_dir (str): The root directory of the store.
+
+    Returns:
+        ds.Dataset: The dataset, with provider, model and run as partition columns.
+    """
+    return ds.dataset(store_dir, schema=STORE_SCHEMA, format="parquet", partitioning=PARTITIONING)
+
+
+def build_filter(models: Optional[List[str]] = None,
+                 question_count: Optional[int] = None,
+                 scorer_version: Optional[str] = None) -> Optional[ds.Expression]:
+    """
+    Build a filter expression that the dataset pushes down to partitions and row groups.
+
+    Args:
+        models (Optional[List[str]]): Only read these models.
+        question_count (Optional[int]): Only read instances with this number of questions.
+        scorer_version (Optional[str]): Only read values extracted with this scorer version.
+
+    Returns:
+        Optional[ds.Expression]: The filter, or None to read everything.
+    """
+    conditions = list()
+    if models:
+        conditions.append(ds.field("model").isin(models))
+    if question_count is not None:
+        conditions.append(ds.field("question_count") == question_count)
+    if scorer_version is not None:
+        conditions.append(ds.field("scorer_version") == scorer_version)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def group_runs(table: pa.Table) -> Iterator[Tuple[Tuple[str, str, str], np.ndarray]]:
+    """
+    Split the rows of a table read from the store by run.
+
+    Args:
+        table (pa.Table): The rows, with the provider, model and run columns.
+
+    Yields:
+        Tuple[Tuple[str, str, str], np.ndarray]: The (provider, model, run) and the boolean mask of its rows.
+    """
+    if table.num_rows == 0:
+        return
+    # Group rows by run through dictionary indices, rather than comparing the names row by row
+    groups = [pc.dictionary_encode(table.column(name).combine_chunks()) for name in ("provider", "model", "run")]
+    codes = np.stack([group.indices.to_numpy(zero_copy_only=False) for group in groups], axis=1)
+    unique_codes, inverse = np.unique(codes, axis=0, return_inverse=True)
+    for index, code in enumerate(unique_codes):
+        yield tuple(group.dictionary[int(c)].as_py() for group, c in zip(groups, code)), inverse.ravel() == index
+
+
+def load_values(store_dir: str,
+                models: Optional[List[str]] = None,
+                question_count: Optional[int] = None,
+                scorer_version: Optional[str] = None) -> Dict[Tuple[str, str, str], Tuple[np.ndarray, np.ndarray]]:
+    """
+    Read the target and predicted values of every run in the store, reading only the columns scoring needs.
+
+    Args:
+        store_dir (str): The root directory of the store.
+        models (Optional[List[str]]): Only read these models.
+        question_count (Optional[int]): Only read instances with this number of questions.
+        scorer_version (Optional[str]): Only read values extracted with this scorer version.
+
+    Returns:
+        Dict[Tuple[str, str, str], Tuple[np.ndarray, np.ndarray]]: The float64 target and predicted values
+        of each (provider, model, run).
+    """
+    table = open_store(store_dir).to_table(
+        columns=["provider", "model", "run", "target_value", "predicted_value"],
+        filter=build_filter(models, question_count, scorer_version))
+    targets = table.column("target_value").to_numpy()
+    predictions = table.column("predicted_value").to_numpy()
+    return {name: (targets[mask], predictions[mask]) for name, mask in group_runs(table)}
+
+
+def load_items(store_dir: str,
+               models: Optional[List[str]] = None,
+               question_count: Optional[int] = None,
+               scorer_version: Optional[str] = None) -> Dict[Tuple[str, str, str], Dict[str, np.ndarray]]:
+    """
+    Read the items of every run in the store, with what the slices of an analysis report need.
+
+    Args:
+        store_dir (str): The root directory of the store.
+        models (Optional[List[str]]): Only read these models.
+        question_count (Optional[int]): Only read instances with this number of questions.
+        scorer_version (Optional[str]): Only read values extracted with this scorer version.
+
+    Returns:
+        Dict[Tuple[str, str, str], Dict[str, np.ndarray]]: The items of each (provider, model, run), in the
+        form of analysis.load_items.
+    """
+    table = open_store(store_dir).to_table(
+        columns=["provider", "model", "run", "instance_key", "qa_index", "question_count", "answer",
+                 "target_value", "predicted_value"],
+        filter=build_filter(models, question_count, scorer_version))
+    ids = pc.binary_join_element_wise(table.column("instance_key"),
+                                      pc.cast(table.column("qa_index"), pa.string()), ":")
+    ids = np.array(ids.to_pylist(), dtype=str)
+    # Yes or no answers are rare and short, so they are told apart on the distinct answers only
+    answers = pc.dictionary_encode(table.column("answer").combine_chunks(), null_encoding="encode")
+    yes_no = np.array([is_yes_or_no_answer(answer) for answer in answers.dictionary.to_pylist()], dtype=bool)
+    yes_no = yes_no[answers.indices.to_numpy(zero_copy_only=False)] if len(yes_no) else np.zeros(0, dtype=bool)
+    question_counts = table.column("question_count").to_numpy()
+    targets = table.column("target_value").to_numpy()
+    predictions = table.column("predicted_value").to_numpy()
+    return {name: {"id": ids[mask],
+                   "question_count": question_counts[mask],
+                   "yes_no": yes_no[mask],
+                   "target": targets[mask],
+                   "predicted": predictions[mask]}
+            for name, mask in group_runs(table)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert an enriched JSONL file into the columnar results store.")
+    parser.add_argument("file", help="Enriched JSONL file, such as data/finqa_data_enriched_anthropic.json")
+    parser.add_argument("--provider", required=True, help="Provider name, such as anthropic")
+    parser.add_argument("--model", required=True, help="Model name, such as claude-3")
+    parser.add_argument("--run", default="default", help="Run name, to keep several runs of a model apart")
+    parser.add_argument("--store", default="data/results", help="Root directory of the store")
+    args = parser.parse_args()
+
+    rows = convert_jsonl(args.file, args.store, args.provider, args.model, args.run)
+    print(f"Wrote {rows} question-answer pairs to {partition_dir(args.store, args.provider, args.model, args.run)}")
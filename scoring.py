@@ -0,0 +1,208 @@
+from typing import Any, Dict, Iterable, List, Tuple  # Type hints for variables and functions
+
+import numpy as np  # NumPy, a library for numerical computing
+
+from answers import extract_answers, parse_answer
+from helpers import essentially_equals, from_json
+
+# The default tolerances of essentially_equals: an absolute difference below 0.5, or a relative one below 1%
+ABSOLUTE_TOLERANCE = 0.5
+RELATIVE_TOLERANCE = 0.01
+
+# Identifies the answer extraction and scoring rules in cached verdicts; bump it whenever either changes
+SCORER_VERSION = "2"
+
+# The reason each item was scored correct, in the order the rules are tried. Index 0 means incorrect.
+REASONS = ("incorrect", "exact", "absolute", "target_percent", "source_percent")
+
+
+def extract_pair_values(data: Dict[str, Any]) -> List[Tuple[float, float]]:
+    """
+    Extract the target and predicted value of each question-answer pair of an enriched record.
+
+    Args:
+        data (Dict[str, Any]): An enriched record with "qa_pairs" and "response".
+
+    Returns:
+        List[Tuple[float, float]]: The target and predicted value of each pair.
+    """
+    qa_pairs = data["qa_pairs"]
+    source_values = extract_answers(data["response"], len(qa_pairs))
+    values = list()
+    for qa_pair, source_value in zip(qa_pairs, source_values):
+        # If target answer is empty, use source answer
+        if len(qa_pair["answer"].strip()) == 0:
+            values.append((source_value, source_value))
+        else:
+            values.append((parse_answer(qa_pair["answer"]), source_value))
+    return values
+
+
+def extract_values(lines: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Extract the target and predicted value of every question-answer pair in a JSONL file.
+
+    Args:
+        lines (Iterable[str]): The lines of an enriched JSONL file.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The float64 target and predicted values, one entry per pair.
+    """
+    targets, sources = list(), list()
+    for line in lines:
+        for target_value, source_value in extract_pair_values(from_json(line)):
+            targets.append(target_value)
+            sources.append(source_value)
+    return np.array(targets, dtype=np.float64), np.array(sources, dtype=np.float64)
+
+
+def load_values(file_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Extract the target and predicted values of an enriched JSONL file.
+
+    Args:
+        file_path (str): The path of the enriched JSONL file.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The float64 target and predicted values, one entry per pair.
+    """
+    with open(file_path, encoding="utf-8") as f_in:
+        return extract_values(f_in)
+
+
+def match_masks(targets: np.ndarray,
+                sources: np.ndarray,
+                absolute_tolerances: np.ndarray,
+                relative_tolerances: np.ndarray) -> np.ndarray:
+    """
+    Evaluate the four tolerance rules for every item under every pair of tolerances.
+
+    Each rule follows essentially_equals: a NaN target matches any non-NaN value, a NaN value never
+    matches, and otherwise the values match if their absolute difference is below the absolute tolerance
+    or their difference relative to the larger value is below the relative tolerance. Where
+    essentially_equals would divide by zero and raise, the relative test is simply false.
+
+    Args:
+        targets (np.ndarray): The target values, shape (N,).
+        sources (np.ndarray): The predicted values, shape (N,).
+        absolute_tolerances (np.ndarray): The absolute tolerances, shape (T,).
+        relative_tolerances (np.ndarray): The relative tolerances, shape (T,).
+
+    Returns:
+        np.ndarray: A boolean array of shape (4, T, N), one slice per rule in the order of REASONS[1:].
+    """
+    absolute_targets, absolute_sources = np.abs(targets), np.abs(sources)
+    # The raw values, their magnitudes, the target read as a fraction and the prediction read as a fraction
+    rules = ((targets, sources),
+             (absolute_targets, absolute_sources),
+             (100 * absolute_targets, absolute_sources),
+             (absolute_targets, 100 * absolute_sources))
+    absolute_tolerances = absolute_tolerances[:, None]
+    relative_tolerances = relative_tolerances[:, None]
+    masks = np.empty((len(rules), len(absolute_tolerances), len(targets)), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for index, (x, y) in enumerate(rules):
+            x_nan, y_nan = np.isnan(x), np.isnan(y)
+            delta = np.abs(x - y)
+            relative = np.abs(delta / np.maximum(x, y))
+            close = (delta < absolute_tolerances) | (relative < relative_tolerances)
+            masks[index] = np.where(x_nan, ~y_nan, ~y_nan & close)
+    return masks
+
+
+def score_values(targets: np.ndarray,
+                 sources: np.ndarray,
+                 absolute_tolerance: float = ABSOLUTE_TOLERANCE,
+                 relative_tolerance: float = RELATIVE_TOLERANCE) -> np.ndarray:
+    """
+    Score every item, recording the first rule it matched.
+
+    Args:
+        targets (np.ndarray): The target values, shape (N,).
+        sources (np.ndarray): The predicted values, shape (N,).
+        absolute_tolerance (float): The absolute tolerance.
+        relative_tolerance (float): The relative tolerance.
+
+    Returns:
+        np.ndarray: The index into REASONS of each item, shape (N,). Zero means incorrect.
+    """
+    masks = match_masks(targets, sources, np.array([absolute_tolerance]), np.array([relative_tolerance]))[:, 0]
+    return first_reason(masks)
+
+
+def first_reason(masks: np.ndarray) -> np.ndarray:
+    """
+    Reduce rule masks to the index of the first matching rule.
+
+    Args:
+        masks (np.ndarray): A boolean array whose first axis holds the rules.
+
+    Returns:
+        np.ndarray: The index into REASONS of each item, with the rule axis removed. Zero means incorrect.
+    """
+    return np.where(masks.any(axis=0), masks.argmax(axis=0) + 1, 0).astype(np.int8)
+
+
+def sweep_tolerances(targets: np.ndarray,
+                     sources: np.ndarray,
+                     absolute_tolerances: Iterable[float],
+                     relative_tolerances: Iterable[float]) -> np.ndarray:
+    """
+    Calculate the accuracy under every combination of absolute and relative tolerance in a single pass.
+
+    Args:
+        targets (np.ndarray): The target values, shape (N,).
+        sources (np.ndarray): The predicted values, shape (N,).
+        absolute_tolerances (Iterable[float]): The absolute tolerances to try, A of them.
+        relative_tolerances (Iterable[float]): The relative tolerances to try, R of them.
+
+    Returns:
+        np.ndarray: The accuracy of each combination, shape (A, R).
+    """
+    absolute_grid, relative_grid = np.meshgrid(np.asarray(absolute_tolerances, dtype=np.float64),
+                                               np.asarray(relative_tolerances, dtype=np.float64),
+                                               indexing="ij")
+    masks = match_masks(targets, sources, absolute_grid.ravel(), relative_grid.ravel())
+    accuracy = masks.any(axis=0).mean(axis=1) if len(targets) else np.zeros(absolute_grid.size)
+    return accuracy.reshape(absolute_grid.shape)
+
+
+def score_scalar(target: float, source: float) -> int:
+    """
+    Score a single item with the chain of essentially_equals checks, as a reference for score_values.
+
+    Args:
+        target (float): The target value.
+        source (float): The predicted value.
+
+    Returns:
+        int: The index into REASONS of the first rule matched. Zero means incorrect.
+    """
+    checks = ((target, source),
+              (abs(target), abs(source)),
+              (100 * abs(target), abs(source)),
+              (abs(target), 100 * abs(source)))
+    for index, (x, y) in enumerate(checks):
+        try:
+            if essentially_equals(x, y):
+                return index + 1
+        except ZeroDivisionError:
+            # essentially_equals divides by the larger value; a zero there can only fail the relative test
+            pass
+    return 0
+
+
+def check_parity(targets: np.ndarray, sources: np.ndarray) -> List[int]:
+    """
+    Compare score_values against the scalar chain of essentially_equals checks.
+
+    Args:
+        targets (np.ndarray): The target values, shape (N,).
+        sources (np.ndarray): The predicted values, shape (N,).
+
+    Returns:
+        List[int]: The indices of the items where the two disagree.
+    """
+    reasons = score_values(targets, sources)
+    return [index for index in range(len(targets))
+            if score_scalar(float(targets[index]), float(sources[index])) != reasons[index]]
@@ -0,0 +1,363 @@
+import argparse  # Module for parsing command-line arguments
+import itertools  # Module providing counters for batch and file IDs
+import json  # Module for JSON serialization and deserialization
+import random  # Module for simulating latency jitter and overload
+import ssl  # Module for serving over TLS
+import threading  # Module for running the server in the background
+import time  # Module for timing and sleeping
+from collections import deque  # Double-ended queue used as a sliding request window
+from email.parser import BytesParser  # Parser for multipart file uploads
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Standard library HTTP server
+from typing import Optional  # Type hints
+
+
+class StubState:
+    """
+    Shared configuration and counters for the stub provider server.
+
+    Args:
+        latency (float): The base latency of each successful response, in seconds.
+        jitter (float): The maximum extra random latency, in seconds.
+        requests_per_minute (Optional[int]): Requests above this rate receive a 429. None disables the limit.
+        overload_rate (float): The probability that a request receives an overload error regardless of rate.
+        response_text (str): The text returned for every successful completion.
+        batch_delay (float): The number of seconds a batch job takes to end. Within a job, overload_rate is
+            the probability that an individual request fails.
+        error_rate (float): The probability that a request receives a server error, or a malformed response
+            without an answer, to exercise the client's retries and circuit breaker.
+    """
+
+    def __init__(self,
+                 latency: float = 0.2,
+                 jitter: float = 0.1,
+                 requests_per_minute: Optional[int] = None,
+                 overload_rate: float = 0.0,
+                 response_text: str = "42",
+                 batch_delay: float = 2.0,
+                 error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests_per_minute = requests_per_minute
+        self.overload_rate = overload_rate
+        self.response_text = response_text
+        self.batch_delay = batch_delay
+        self.error_rate = error_rate
+        self.batches = dict()
+        self.files = dict()
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.window = deque()
+        self.counts = {"ok": 0, "rate_limited": 0, "overloaded": 0, "errors": 0}
+
+    def admit(self) -> Optional[float]:
+        """
+        Decide whether a request is within the rate limit.
+
+        Returns:
+            Optional[float]: None if the request is admitted, otherwise the seconds until a slot frees up.
+        """
+        if self.requests_per_minute is None:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            # Forget requests that have left the one-minute window
+            while self.window and now - self.window[0] >= 60.0:
+                self.window.popleft()
+            if len(self.window) >= self.requests_per_minute:
+                return 60.0 - (now - self.window[0])
+            self.window.append(now)
+            return None
+
+    def count(self, outcome: str):
+        with self.lock:
+            self.counts[outcome] += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers OpenAI chat completion and Anthropic messages requests with canned responses, and fakes the
+    OpenAI and Anthropic batch APIs.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which Nagle's algorithm would hold back on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep the console quiet; the counters are the interesting output
+        pass
+
+    def send_json(self, status: int, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        state: StubState = self.server.state
+        if self.path == "/v1/messages/batches":
+            self.create_anthropic_batch(state)
+        elif self.path == "/v1/files":
+            self.upload_file(state)
+        elif self.path == "/v1/batches":
+            self.create_openai_batch(state)
+        elif self.path in ("/v1/chat/completions", "/v1/messages"):
+            self.complete(state, self.read_json())
+        else:
+            self.send_json(404, {"error": {"type": "not_found", "message": self.path}})
+
+    def do_GET(self):
+        state: StubState = self.server.state
+        parts = self.path.strip("/").split("/")
+        if parts[:3] == ["v1", "messages", "batches"] and len(parts) in (4, 5):
+            self.get_anthropic_batch(state, parts[3], results=len(parts) == 5)
+        elif parts[:2] == ["v1", "batches"] and len(parts) == 3:
+            self.get_openai_batch(state, parts[2])
+        elif parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content":
+            self.get_file(state, parts[2])
+        else:
+            self.send_json(404, {"error": {"type": "not_found", "message": self.path}})
+
+    def complete(self, state: StubState, request):
+        # Reject requests above the configured rate, telling the client when to come back
+        wait = state.admit()
+        if wait is not None:
+            state.count("rate_limited")
+            self.send_json(429, {"error": {"type": "rate_limit_error", "message": "Rate limited"}},
+                           {"Retry-After": f"{wait:.3f}"})
+            return
+        # Simulate a provider that is overloaded independently of our request rate
+        if random.random() < state.overload_rate:
+            state.count("overloaded")
+            status = 529 if self.path == "/v1/messages" else 503
+            self.send_json(status, {"error": {"type": "overloaded_error", "message": "Overloaded"}})
+            return
+        # Simulate server faults, half of them as a success status with an error payload
+        if random.random() < state.error_rate:
+            state.count("errors")
+            status = random.choice((500, 200))
+            self.send_json(status, {"error": {"type": "api_error", "message": "Internal server error"}})
+            return
+
+        time.sleep(state.latency + random.uniform(0, state.jitter))
+        state.count("ok")
+        # Report a rough usage, four characters per token, so clients can account for spend
+        input_tokens = len(json.dumps(request.get("messages", []))) // 4
+        if self.path == "/v1/messages":
+            self.send_json(200, anthropic_message(state.response_text, input_tokens))
+        else:
+            self.send_json(200, openai_completion(state.response_text, input_tokens, request.get("n", 1)))
+
+    def base_url(self) -> str:
+        scheme = "https" if isinstance(self.connection, ssl.SSLSocket) else "http"
+        return f"{scheme}://{self.headers.get('Host')}"
+
+    def new_batch(self, state: StubState, custom_ids):
+        # Decide up front which requests of the job fail
+        batch_id = f"batch_{next(state.ids)}"
+        state.batches[batch_id] = {
+            "ends_at": time.monotonic() + state.batch_delay,
+            "failed": {custom_id for custom_id in custom_ids if random.random() < state.overload_rate},
+            "custom_ids": list(custom_ids)
+        }
+        return batch_id
+
+    def create_anthropic_batch(self, state: StubState):
+        entries = self.read_json()["requests"]
+        batch_id = self.new_batch(state, [entry["custom_id"] for entry in entries])
+        self.send_json(200, {"id": batch_id, "type": "message_batch", "processing_status": "in_progress",
+                             "results_url": None})
+
+    def get_anthropic_batch(self, state: StubState, batch_id: str, results: bool):
+        batch = state.batches.get(batch_id)
+        if batch is None:
+            self.send_json(404, {"error": {"type": "not_found_error", "message": batch_id}})
+            return
+        ended = time.monotonic() >= batch["ends_at"]
+        if not results:
+            self.send_json(200, {
+                "id": batch_id,
+                "type": "message_batch",
+                "processing_status": "ended" if ended else "in_progress",
+                "results_url": f"{self.base_url()}/v1/messages/batches/{batch_id}/results" if ended else None
+            })
+            return
+        lines = list()
+        for custom_id in batch["custom_ids"]:
+            if custom_id in batch["failed"]:
+                result = {"type": "errored", "error": {"type": "overloaded_error", "message": "Overloaded"}}
+            else:
+                result = {"type": "succeeded", "message": anthropic_message(state.response_text)}
+            lines.append(json.dumps({"custom_id": custom_id, "result": result}))
+        self.send_jsonl(lines)
+
+    def upload_file(self, state: StubState):
+        length = int(self.headers.get("Content-Length", 0))
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+        message = BytesParser().parsebytes(header + self.rfile.read(length))
+        file_id = f"file-{next(state.ids)}"
+        for part in message.get_payload():
+            if part.get_param("name", header="content-disposition") == "file":
+                state.files[file_id] = part.get_payload(decode=True)
+        self.send_json(200, {"id": file_id, "object": "file", "purpose": "batch"})
+
+    def create_openai_batch(self, state: StubState):
+        request = self.read_json()
+        entries = [json.loads(line) for line in state.files[request["input_file_id"]].splitlines() if line]
+        batch_id = self.new_batch(state, [entry["custom_id"] for entry in entries])
+        self.send_json(200, {"id": batch_id, "object": "batch", "status": "validating",
+                             "output_file_id": None})
+
+    def get_openai_batch(self, state: StubState, batch_id: str):
+        batch = state.batches.get(batch_id)
+        if batch is None:
+            self.send_json(404, {"error": {"type": "invalid_request_error", "message": batch_id}})
+            return
+        if time.monotonic() < batch["ends_at"]:
+            self.send_json(200, {"id": batch_id, "object": "batch", "status": "in_progress",
+                                 "output_file_id": None})
+            return
+        # Write the results file the first time the ended job is looked at
+        if "output_file_id" not in batch:
+            lines = list()
+            for custom_id in batch["custom_ids"]:
+                if custom_id in batch["failed"]:
+                    response = {"status_code": 503,
+                                "body": {"error": {"type": "overloaded_error", "message": "Overloaded"}}}
+                else:
+                    response = {"status_code": 200, "body": openai_completion(state.response_text)}
+                lines.append(json.dumps({"id": f"batch_req_{custom_id}", "custom_id": custom_id,
+                                         "response": response, "error": None}))
+            batch["output_file_id"] = f"file-{next(state.ids)}"
+            state.files[batch["output_file_id"]] = "\n".join(lines).encode("utf-8") + b"\n"
+        self.send_json(200, {"id": batch_id, "object": "batch", "status": "completed",
+                             "output_file_id": batch["output_file_id"]})
+
+    def get_file(self, state: StubState, file_id: str):
+        if file_id not in state.files:
+            self.send_json(404, {"error": {"type": "invalid_request_error", "message": file_id}})
+            return
+        self.send_jsonl(state.files[file_id].decode("utf-8").splitlines())
+
+    def send_jsonl(self, lines):
+        body = "".join(line + "\n" for line in lines).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/binary")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def anthropic_message(text: str, input_tokens: int = 0):
+    return {
+        "id": "msg_stub",
+        "type": "message",
+        "role": "assistant",
+        "model": "stub",
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": max(1, len(text) // 4)}
+    }
+
+
+def openai_completion(text: str, prompt_tokens: int = 0, n: int = 1):
+    # Each of the n choices is billed for its completion, and the prompt once
+    completion_tokens = max(1, len(text) // 4) * n
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "model": "stub",
+        "choices": [{"index": index,
+                     "message": {"role": "assistant", "content": text},
+                     "finish_reason": "stop"} for index in range(n)],
+        "usage": {"prompt_tokens": prompt_tokens,
+                  "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens}
+    }
+
+
+def create_server(state: StubState,
+                  host: str = "127.0.0.1",
+                  port: int = 0,
+                  certfile: Optional[str] = None,
+                  keyfile: Optional[str] = None) -> ThreadingHTTPServer:
+    """
+    Create the stub server, serving over TLS if a certificate is given.
+
+    Args:
+        state (StubState): The configuration and counters shared by the handlers.
+        host (str): The interface to bind to.
+        port (int): The port to bind to. Zero picks a free port.
+        certfile (Optional[str]): The PEM certificate to serve HTTPS with, or None for plain HTTP.
+        keyfile (Optional[str]): The PEM private key of the certificate, if it is not in certfile.
+
+    Returns:
+        ThreadingHTTPServer: The server, not yet serving.
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = state
+    if certfile:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(certfile, keyfile)
+        # Only HTTP/1.1 is spoken, so clients offering HTTP/2 fall back to it through ALPN
+        context.set_alpn_protocols(["http/1.1"])
+        # Handshakes run on the handler threads rather than blocking the accept loop
+        server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    return server
+
+
+def serve_in_thread(state: StubState,
+                    host: str = "127.0.0.1",
+                    port: int = 0,
+                    certfile: Optional[str] = None,
+                    keyfile: Optional[str] = None) -> ThreadingHTTPServer:
+    """
+    Start the stub server on a background thread.
+
+    Args:
+        state (StubState): The configuration and counters shared by the handlers.
+        host (str): The interface to bind to.
+        port (int): The port to bind to. Zero picks a free port.
+        certfile (Optional[str]): The PEM certificate to serve HTTPS with, or None for plain HTTP.
+        keyfile (Optional[str]): The PEM private key of the certificate, if it is not in certfile.
+
+    Returns:
+        ThreadingHTTPServer: The running server. Its base URL is http(s)://host:server.server_port.
+    """
+    server = create_server(state, host, port, certfile, keyfile)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI and Anthropic chat APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--rpm", type=int, default=None)
+    parser.add_argument("--overload-rate", type=float, default=0.0)
+    parser.add_argument("--batch-delay", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--certfile", default=None, help="PEM certificate, to serve HTTPS instead of HTTP")
+    parser.add_argument("--keyfile", default=None, help="PEM private key, if not included in the certificate")
+    args = parser.parse_args()
+
+    server = create_server(StubState(args.latency, args.jitter, args.rpm, args.overload_rate,
+                                     batch_delay=args.batch_delay, error_rate=args.error_rate),
+                           args.host, args.port, args.certfile, args.keyfile)
+    print(f"Serving on {'https' if args.certfile else 'http'}://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.state.counts)
@@ -0,0 +1,179 @@
+import csv  # Module for writing CSV rows
+import io  # Module for in-memory text buffers
+import re  # Module for regular expressions
+from functools import lru_cache  # Memoizes parsed tables
+from typing import Iterable, List, Optional, Sequence, Set  # Type hints for variables and functions
+
+import numpy as np  # NumPy, a library for numerical computing
+
+from answers import TOKEN_PATTERN, parse_answer
+
+# The ways a table can be rendered into a prompt. "flat" is the original rendering, with every cell and row
+# run together on one line.
+TABLE_FORMATS = ("flat", "markdown", "csv")
+
+# Words too common in questions and row labels to tell rows apart
+STOP_WORDS = {"the", "and", "for", "from", "with", "what", "was", "were", "is", "are", "of", "in", "to", "by",
+              "as", "at", "on", "how", "much", "did", "does", "percent", "percentage", "change", "total",
+              "average", "between", "during", "year", "years", "ratio", "portion", "than", "that", "this"}
+
+
+class Table:
+    """
+    A table with its cells as text and its numeric cells parsed into an array.
+
+    Args:
+        cells (List[List[str]]): The rows of cells. Short rows are padded with empty cells.
+    """
+
+    __slots__ = ("cells", "values")
+
+    def __init__(self, cells: List[List[str]]):
+        width = max((len(row) for row in cells), default=0)
+        self.cells = [[re.sub(r"\s+", " ", cell).strip() for cell in row] + [""] * (width - len(row))
+                      for row in cells]
+        # The value of every numeric cell, NaN for text and empty cells
+        self.values = np.full((len(self.cells), width), np.nan)
+        for i, row in enumerate(self.cells):
+            for j, cell in enumerate(row):
+                if cell and any(character.isdigit() for character in cell):
+                    self.values[i, j] = parse_answer(cell)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def select(self, rows: Sequence[int], columns: Sequence[int]) -> "Table":
+        """
+        Build a table from a subset of the rows and columns.
+
+        Args:
+            rows (Sequence[int]): The indices of the rows to keep, in order.
+            columns (Sequence[int]): The indices of the columns to keep, in order.
+
+        Returns:
+            Table: The smaller table.
+        """
+        table = Table.__new__(Table)
+        table.cells = [[self.cells[i][j] for j in columns] for i in rows]
+        table.values = self.values[np.ix_(list(rows), list(columns))]
+        return table
+
+    def prune(self, questions: Iterable[str]) -> "Table":
+        """
+        Drop the rows and columns that do not mention anything the questions ask about.
+
+        The header row and the label column are always kept. A row is kept if its label shares a word with
+        a question or if it holds a number quoted in a question; a column is kept likewise by its header.
+        Rows or columns are only pruned when at least one of them matches, so a question that matches
+        nothing keeps the whole table.
+
+        Args:
+            questions (Iterable[str]): The questions asked about the table.
+
+        Returns:
+            Table: The pruned table.
+        """
+        rows, columns = self.shape
+        if rows < 2 or columns < 2:
+            return self
+        words, numbers = question_terms(questions)
+
+        def matches(cell: str, value: float) -> bool:
+            return bool(cell_words(cell) & words) or (not np.isnan(value) and value in numbers)
+
+        kept_rows = [i for i in range(1, rows)
+                     if matches(self.cells[i][0], self.values[i, 0])
+                     or any(not np.isnan(value) and value in numbers for value in self.values[i, 1:])]
+        kept_columns = [j for j in range(1, columns) if matches(self.cells[0][j], self.values[0, j])]
+        return self.select([0] + (kept_rows or list(range(1, rows))),
+                           [0] + (kept_columns or list(range(1, columns))))
+
+    def render(self, table_format: str) -> str:
+        """
+        Render the table as text for a prompt.
+
+        Args:
+            table_format (str): "flat" for all non-empty cells on one line, "markdown" for a minimal pipe-delimited
+                grid with one row per line, or "csv" for comma-separated rows, quoting cells that contain commas.
+
+        Returns:
+            str: The rendered table.
+
+        Raises:
+            ValueError: If the format is unknown.
+        """
+        if table_format == "flat":
+            return " ".join(cell for row in self.cells for cell in row if cell)
+        if table_format == "markdown":
+            # Pipes between cells only; the first line is the header, so no separator row is spent on it
+            return "\n".join("|".join(row) for row in self.cells)
+        if table_format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator="\n").writerows(self.cells)
+            return buffer.getvalue().rstrip("\n")
+        raise ValueError(f"Unexpected table format {table_format}")
+
+
+def cell_words(text: str) -> Set[str]:
+    """
+    Extract the distinctive words of a cell or question.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        Set[str]: The lowercased words of three letters or more, without stop words.
+    """
+    return {word for word in re.findall(r"[a-z]{3,}", text.lower()) if word not in STOP_WORDS}
+
+
+def question_terms(questions: Iterable[str]):
+    """
+    Extract the words and numbers the questions ask about.
+
+    Args:
+        questions (Iterable[str]): The questions.
+
+    Returns:
+        Tuple[Set[str], Set[float]]: The distinctive words and the numbers, such as years, in the questions.
+    """
+    words, numbers = set(), set()
+    for question in questions:
+        words |= cell_words(question)
+        for match in TOKEN_PATTERN.finditer(question):
+            if match.lastgroup == "number":
+                numbers.add(float(match.group("value").replace(",", "")))
+    return words, numbers
+
+
+@lru_cache(maxsize=4096)
+def parse_table(text: str) -> Table:
+    """
+    Parse a table in the tab-delimited format written by the parser, once per distinct table.
+
+    Args:
+        text (str): The table, with rows separated by newlines and cells by tabs.
+
+    Returns:
+        Table: The parsed table. Callers must not modify it, since it is shared.
+    """
+    return Table([line.split("\t") for line in text.split("\n")] if text else [])
+
+
+def render_table(text: str, table_format: str = "flat", questions: Optional[Iterable[str]] = None) -> str:
+    """
+    Render a table for a prompt, optionally pruned to the rows and columns the questions mention.
+
+    Args:
+        text (str): The table, in the tab-delimited format written by the parser.
+        table_format (str): One of TABLE_FORMATS.
+        questions (Optional[Iterable[str]]): The questions to prune the table to, or None to keep all of it.
+
+    Returns:
+        str: The rendered table.
+    """
+    table = parse_table(text)
+    if questions is not None:
+        table = table.prune(questions)
+    return table.render(table_format)
@@ -0,0 +1,5 @@
+import os  # Module for file system operations
+import sys  # Module for the import path
+
+# The modules sit at the root of the repository, next to the scripts that import them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,107 @@
+import numpy as np  # NumPy, a library for numerical computing
+import pytest  # The test runner, for parametrized cases
+
+import analysis
+from analysis import ItemTable, analyze, bootstrap_means, format_report, load_items
+from helpers import to_json
+
+SEED = 1234
+
+
+def make_items(correct, question_counts=None, yes_no=None, ids=None):
+    # Correct items predict their target exactly, the others are off by far more than the tolerance
+    correct = np.asarray(correct, dtype=bool)
+    count = len(correct)
+    return {
+        "id": np.array(ids if ids is not None else [f"item{index}" for index in range(count)], dtype=str),
+        "question_count": np.array(question_counts if question_counts is not None else [1] * count, dtype=np.int8),
+        "yes_no": np.array(yes_no if yes_no is not None else [False] * count, dtype=bool),
+        "target": np.full(count, 10.0),
+        "predicted": np.where(correct, 10.0, 50.0),
+    }
+
+
+def random_items(count: int = 300):
+    rng = np.random.default_rng(SEED)
+    return make_items(rng.random(count) < 0.6, question_counts=rng.integers(1, 3, count),
+                      yes_no=rng.random(count) < 0.1)
+
+
+def test_identical_runs_differ_by_an_interval_centred_on_zero():
+    items = random_items()
+    report = analyze(ItemTable.from_items({"a": items, "b": dict(items)}), resamples=500, seed=SEED)
+    comparison, = report["comparisons"]
+    # Paired resamples draw the same items for both runs, so every resampled difference is zero
+    assert (comparison["difference"], comparison["low"], comparison["high"]) == (0.0, 0.0, 0.0)
+    assert comparison["p_value"] == 1.0
+    models = report["slices"]["all"]["models"]
+    assert models["a"] == models["b"]
+
+
+def test_a_better_run_is_told_apart():
+    items = random_items()
+    better = dict(items, predicted=items["target"].copy())
+    comparison, = analyze(ItemTable.from_items({"better": better, "worse": items}), resamples=500,
+                          seed=SEED)["comparisons"]
+    assert 0 < comparison["low"] <= comparison["difference"] <= comparison["high"]
+    assert comparison["p_value"] == 0.0
+
+
+def test_slice_counts_add_up_to_the_total():
+    report = analyze(ItemTable.from_items({"a": random_items()}), resamples=200, seed=SEED)
+    items = {name: result["items"] for name, result in report["slices"].items()}
+    assert items["all"] == 300
+    assert items["1 question"] + items["2 questions"] == items["all"]
+    assert items["yes/no"] + items["numeric"] == items["all"]
+
+
+def test_the_same_seed_gives_the_same_report():
+    table = ItemTable.from_items({"a": random_items(), "b": random_items(200)})
+    assert analyze(table, resamples=300, seed=SEED) == analyze(table, resamples=300, seed=SEED)
+    assert format_report(analyze(table, resamples=300, seed=SEED)) \
+        == format_report(analyze(table, resamples=300, seed=SEED))
+
+
+def test_intervals_contain_the_accuracy():
+    report = analyze(ItemTable.from_items({"a": random_items()}), resamples=500, seed=SEED)
+    for result in report["slices"].values():
+        stats = result["models"]["a"]
+        assert stats["low"] <= stats["accuracy"] <= stats["high"]
+
+
+@pytest.mark.parametrize("chunk_cells", [analysis.CHUNK_CELLS, 1000])
+def test_bootstrap_means_center_on_the_mean(monkeypatch, chunk_cells):
+    # Small chunks split the resamples into several matrix products
+    monkeypatch.setattr(analysis, "CHUNK_CELLS", chunk_cells)
+    values = (np.random.default_rng(SEED).random((2, 250)) < [[0.3], [0.7]]).astype(float)
+    means = bootstrap_means(values, resamples=2000, seed=SEED)
+    assert means.shape == (2000, 2)
+    assert np.allclose(means.mean(axis=0), values.mean(axis=1), atol=0.01)
+
+
+def test_empty_values_resample_to_nan():
+    assert np.isnan(bootstrap_means(np.zeros((2, 0)), resamples=5)).all()
+
+
+def test_models_are_compared_on_their_common_items():
+    first = make_items([True, False, True, True], ids=["x:0", "y:0", "z:0", "x:0"])
+    second = make_items([False, True], ids=["z:0", "y:0"])
+    table = ItemTable.from_items({"first": first, "second": second})
+    # Items are ordered by ID; the duplicate of x:0 is scored once and x:0 is dropped with no partner
+    assert table.reasons.astype(bool).tolist() == [[False, True], [True, False]]
+    assert table.dropped == {"first": 1, "second": 0}
+
+
+def test_load_items_gives_an_item_per_question(tmp_path):
+    path = tmp_path / "enriched.json"
+    records = [{"pre_text": "page", "table": "", "post_text": "", "response": "12.5\tyes",
+                "qa_pairs": [{"question": "what?", "answer": "12.5"}, {"question": "did it?", "answer": "yes"}]},
+               {"pre_text": "other page", "table": "", "post_text": "", "response": "3",
+                "qa_pairs": [{"question": "what?", "answer": "4"}]}]
+    path.write_text("".join(to_json(record) + "\n" for record in records), encoding="utf-8")
+    items = load_items(str(path))
+    assert [item_id.rsplit(":", 1)[1] for item_id in items["id"]] == ["0", "1", "0"]
+    assert items["question_count"].tolist() == [2, 2, 1]
+    assert items["yes_no"].tolist() == [False, True, False]
+    table = ItemTable.from_items({"model": items})
+    assert sorted(table.reasons[0].astype(bool).tolist()) == [False, True, True]
@@ -0,0 +1,105 @@
+import math  # Module providing mathematical functions
+
+import pytest  # The test runner, for parametrized cases
+
+from answers import extract_answers, parse_answer
+from bench_answers import legacy_extract
+
+# Responses in the shapes the models give, where the regex chain used before answers.py was already right
+BASELINE_RESPONSES = [
+    ("12.5", 1),
+    ("45%", 1),
+    ("0.45", 1),
+    ("yes", 1),
+    ("No", 1),
+    ("2019", 1),
+    ("x = 14.2", 1),
+    ("The document does not provide this information.", 1),
+    ("The answer cannot be determined", 2),
+    ("12.5\t0.45", 2),
+    ("12.5\n45%", 2),
+    ("yes\tno", 2),
+    ("no\n100", 2),
+    ("2019\t2020", 2),
+    ("7.3 8.1", 2),
+    ("100", 2),
+]
+
+
+def assert_values(actual, expected):
+    assert len(actual) == len(expected)
+    for a, b in zip(actual, expected):
+        assert (math.isnan(a) and math.isnan(b)) or a == pytest.approx(b), (actual, expected)
+
+
+@pytest.mark.parametrize("text, value", [
+    ("-3.2", -3.2),
+    ("−3.2", -3.2),
+    ("(12)", -12.0),
+    ("($1,234.5)", -1234.5),
+    ("-$5", -5.0),
+    ("1,234.5", 1234.5),
+    ("$1,234,567", 1234567.0),
+    ("12,34", 12.0),
+    ("45%", 45.0),
+    ("-0.07%", -0.07),
+    ("(4.5%)", -4.5),
+    (".5", 0.5),
+    ("yes", 1.0),
+    ("No", 0.0),
+    ("no change", math.nan),
+    ("x = 3", 3.0),
+    ("12 * 2 = 24", 24.0),
+    ("the change was 5", 5.0),
+    ("none", math.nan),
+])
+def test_parse_answer(text, value):
+    assert_values([parse_answer(text)], [value])
+
+
+@pytest.mark.parametrize("response, count, values", [
+    # The hyphen of a range is not a minus sign, while a minus after a space or a separator is
+    ("Revenue grew from 2019-2020 by 5%", 2, [2019.0, 2020.0]),
+    ("2019-2020", 1, [2019.0]),
+    ("from 2019 to -5", 2, [2019.0, -5.0]),
+    ("-3\t-4", 2, [-3.0, -4.0]),
+    ("5\n-4", 2, [5.0, -4.0]),
+])
+def test_ranges_and_signs(response, count, values):
+    assert_values(extract_answers(response, count), values)
+
+
+@pytest.mark.parametrize("response, count", [
+    (None, 1),
+    (None, 2),
+    ("The document does not say", 2),
+    ("The table shows 2019 revenue of 5", 1),
+])
+def test_refusals(response, count):
+    assert_values(extract_answers(response, count), [math.nan] * count)
+
+
+@pytest.mark.parametrize("response, count, values", [
+    # Tab and newline separated answers, literal or escaped, each reduced to its first number
+    ("12.5\t45%", 2, [12.5, 45.0]),
+    ("1,234 million\n5 points", 2, [1234.0, 5.0]),
+    ("12.5\\t45%", 2, [12.5, 45.0]),
+    ("12.5\\n45%", 2, [12.5, 45.0]),
+    ("yes\n\n\nno", 2, [1.0, 0.0]),
+    ("yes\t12", 2, [1.0, 12.0]),
+    ("a = 3, b = 4\t7", 2, [4.0, 7.0]),
+    ("1\t2\t3", 2, [1.0, 2.0]),
+    # Too few separated answers, so the numbers, then the yes/no words, are taken in order
+    ("12.5 and 45%", 2, [12.5, 45.0]),
+    ("yes, no", 2, [1.0, 0.0]),
+    ("only 12.5", 2, [12.5, math.nan]),
+    ("x = 3 then 4", 2, [3.0, 4.0]),
+    ("nothing here", 2, [math.nan, math.nan]),
+])
+def test_split_and_in_order_fallback(response, count, values):
+    assert_values(extract_answers(response, count), values)
+
+
+@pytest.mark.parametrize("response, count", BASELINE_RESPONSES)
+def test_matches_baseline_extractor(response, count):
+    assert_values(extract_answers(response, count), legacy_extract(response, count))
@@ -0,0 +1,129 @@
+import json  # Module for writing a jobs file of an older key scheme
+import os  # Module for file system operations
+
+import pytest  # The test runner, for parametrized cases
+
+from batch import AnthropicBatchProvider, BatchEnrichment, BatchProvider, OpenAIBatchProvider
+from cache import ResponseCache
+from helpers import create_instance_key, from_json, to_json
+from instance_keys import instance_key
+from journal import EnrichmentJournal
+from providers import ChatProvider
+from stub_server import StubState, serve_in_thread
+
+PARAMS = {"model": "model-1", "max_tokens": 64, "temperature": 0.9}
+
+
+class RecordingBatchProvider(BatchProvider):
+    # Answers every request of a job with its custom ID, and records the jobs it was sent
+    name = "recording"
+
+    def __init__(self):
+        self.jobs = dict()
+
+    def build_request(self, custom_id, message):
+        return {"custom_id": custom_id, "message": message}
+
+    def submit(self, entries):
+        job_id = f"job-{len(self.jobs)}"
+        self.jobs[job_id] = entries
+        return job_id
+
+    def has_ended(self, job_id):
+        return True
+
+    def results(self, job_id):
+        for entry in self.jobs[job_id]:
+            yield entry["custom_id"], entry["custom_id"]
+
+
+def test_providers_must_implement_every_request_method():
+    with pytest.raises(TypeError):
+        BatchProvider()
+
+    class CompleteOnly(ChatProvider):
+        def complete(self, message):
+            return message
+
+    with pytest.raises(TypeError):
+        CompleteOnly(PARAMS)
+
+
+def write_shared_document(path: str):
+    # Two instances asking different questions about the same page
+    with open(path, "w", encoding="utf-8") as f_out:
+        for question in ["what was revenue?", "what was income?"]:
+            f_out.write(to_json({"pre_text": "page", "table": "", "post_text": "",
+                                 "qa_pairs": [{"question": question, "answer": "1"}]}) + "\n")
+
+
+def test_jobs_of_an_older_key_scheme_resume_the_first_instance(tmp_path):
+    input_path = str(tmp_path / "input.json")
+    write_shared_document(input_path)
+    with open(input_path, encoding="utf-8") as f_in:
+        first, second = [from_json(line) for line in f_in]
+    journal = EnrichmentJournal(str(tmp_path / "enriched.journal"), fsync=False)
+    batch = BatchEnrichment(RecordingBatchProvider(), journal, input_path, message_of=lambda data: "message",
+                            poll_interval=0)
+    # A job submitted under the document-only scheme, which harvest matches to the first instance
+    old_key = instance_key(first, version=1)
+    with open(batch.jobs_path, "w", encoding="utf-8") as f_out:
+        json.dump({"key_version": 1, "jobs": {"old-job": [old_key]}}, f_out)
+
+    jobs = batch.load_jobs()
+    assert jobs == {"old-job": [create_instance_key(first)]}
+    with journal:
+        batch.submit_pending(jobs)
+    # Only the instance that was not in flight is submitted again
+    assert [entry["custom_id"] for entry in batch.provider.jobs["job-0"]] == [create_instance_key(second)]
+
+
+@pytest.fixture
+def stub():
+    state = StubState(latency=0, jitter=0, response_text="12.5", batch_delay=0)
+    server = serve_in_thread(state)
+    yield state, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def write_documents(path: str, count: int):
+    with open(path, "w", encoding="utf-8") as f_out:
+        for index in range(count):
+            f_out.write(to_json({"pre_text": f"page {index}", "table": "", "post_text": "",
+                                 "qa_pairs": [{"question": "what was revenue?", "answer": "1"}]}) + "\n")
+
+
+def read_responses(journal: EnrichmentJournal, input_path: str):
+    output_path = journal.path + ".json"
+    assert journal.compact(input_path, output_path) == 0
+    with open(output_path, encoding="utf-8") as f_in:
+        return [from_json(line)["response"] for line in f_in]
+
+
+@pytest.mark.parametrize("create_provider", [
+    lambda base_url: AnthropicBatchProvider("key", PARAMS, base_url=base_url),
+    lambda base_url: OpenAIBatchProvider("key", PARAMS, base_url=base_url),
+], ids=["anthropic", "openai"])
+def test_submit_and_harvest_through_the_stub_server(tmp_path, stub, create_provider):
+    state, base_url = stub
+    input_path = str(tmp_path / "input.json")
+    write_documents(input_path, 5)
+    with ResponseCache(str(tmp_path / "cache.sqlite")) as response_cache:
+        journal = EnrichmentJournal(str(tmp_path / "enriched.journal"), fsync=False)
+        batch = BatchEnrichment(create_provider(base_url), journal, input_path, poll_interval=0.01,
+                                cache=response_cache)
+        with journal:
+            batch.run()
+        assert read_responses(journal, input_path) == ["12.5"] * 5
+        assert len(state.batches) == 1
+        # Every job has been harvested, so there is nothing left to resume
+        assert not os.path.isfile(batch.jobs_path)
+
+        # A new run over the same input reads every response from the cache instead of submitting a job
+        journal = EnrichmentJournal(str(tmp_path / "again.journal"), fsync=False)
+        with journal:
+            BatchEnrichment(create_provider(base_url), journal, input_path, poll_interval=0.01,
+                            cache=response_cache).run()
+        assert read_responses(journal, input_path) == ["12.5"] * 5
+        assert len(state.batches) == 1
@@ -0,0 +1,135 @@
+import itertools  # Module for a clock that ticks on every read
+
+import pytest  # The test runner, for fixtures and expected exceptions
+
+import cache
+from cache import ResponseCache
+from metrics import Metrics
+from providers import ChatProvider
+
+PARAMS = {"model": "model-1", "temperature": 0.9, "max_tokens": 64}
+
+
+class CountingProvider(ChatProvider):
+    # Answers with the number of the API call, so a cached response tells which call produced it
+    name = "counting"
+
+    def __init__(self, params, cache=None):
+        super().__init__(params, cache, Metrics())
+        self.calls = 0
+
+    def complete(self, message):
+        self.calls += 1
+        return f"{message} #{self.calls}"
+
+    def complete_n(self, message, n):
+        return [self.complete(message) for _ in range(n)]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Every entry is stored and used at a distinct time, so least recently used is well defined
+    ticks = itertools.count(1000.0)
+    monkeypatch.setattr(cache.time, "time", lambda: next(ticks))
+
+
+def test_identical_parameters_hit_and_any_difference_misses(tmp_path):
+    with ResponseCache(str(tmp_path / "cache.sqlite")) as response_cache:
+        key = ResponseCache.make_key("anthropic", PARAMS, "prompt")
+        assert response_cache.get(key) is None
+        response_cache.put(key, "anthropic", PARAMS, "12.5")
+        # The order the parameters were written in does not matter
+        assert response_cache.get(ResponseCache.make_key("anthropic", dict(reversed(PARAMS.items())),
+                                                         "prompt")) == "12.5"
+        assert key != ResponseCache.make_key("openai", PARAMS, "prompt")
+        assert key != ResponseCache.make_key("anthropic", dict(PARAMS, temperature=0.0), "prompt")
+        assert key != ResponseCache.make_key("anthropic", PARAMS, "prompt 2")
+        assert response_cache.stats() == {"hits": 1, "misses": 1, "entries": 1, "bytes": 4}
+
+
+def test_entries_persist_across_runs(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    with ResponseCache(path) as response_cache:
+        response_cache.put("key", "anthropic", PARAMS, "yes")
+    with ResponseCache(path) as response_cache:
+        assert response_cache.get("key") == "yes"
+
+
+def test_each_sample_is_cached_apart_and_sample_zero_is_the_plain_response(tmp_path):
+    with ResponseCache(str(tmp_path / "cache.sqlite")) as response_cache:
+        provider = CountingProvider(PARAMS, response_cache)
+        assert provider("message") == "message #1"
+        # Sample 0 is the plain response, samples 1 and 2 are requested and cached on their own
+        assert provider.sample("message", [0, 1, 2]) == ["message #1", "message #2", "message #3"]
+        assert provider.sample("message", [2, 1]) == ["message #3", "message #2"]
+        assert provider.calls == 3
+        assert response_cache.get(ResponseCache.make_key("counting", PARAMS, "message")) == "message #1"
+        assert response_cache.get(ResponseCache.make_key("counting", dict(PARAMS, sample=1), "message")) \
+            == "message #2"
+
+
+def test_refresh_replaces_entries_without_reading_them(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    with ResponseCache(path) as response_cache:
+        CountingProvider(PARAMS, response_cache)("message")
+    with ResponseCache(path, mode="refresh") as response_cache:
+        provider = CountingProvider(PARAMS, response_cache)
+        provider.calls = 10
+        assert provider("message") == "message #11"
+        assert response_cache.stats()["hits"] == 0
+    with ResponseCache(path) as response_cache:
+        assert CountingProvider(PARAMS, response_cache)("message") == "message #11"
+
+
+def test_off_bypasses_the_cache(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    with ResponseCache(str(path), mode="off") as response_cache:
+        provider = CountingProvider(PARAMS, response_cache)
+        assert provider("message") == "message #1"
+        assert provider("message") == "message #2"
+        assert response_cache.stats() == {"hits": 0, "misses": 0, "entries": 0, "bytes": 0}
+    assert not path.exists()
+
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ResponseCache(str(tmp_path / "cache.sqlite"), mode="read")
+
+
+def keys_of(response_cache: ResponseCache):
+    return sorted(row[0] for row in response_cache._connection.execute("SELECT key FROM responses"))
+
+
+def test_eviction_drops_the_least_recently_used_entries(tmp_path, clock):
+    with ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2) as response_cache:
+        for key in ["a", "b", "c"]:
+            response_cache.put(key, "anthropic", PARAMS, key)
+        # Reading "a" makes "b" the least recently used entry
+        assert response_cache.get("a") == "a"
+        response_cache.evict()
+        assert keys_of(response_cache) == ["a", "c"]
+
+
+def test_eviction_keeps_the_most_recent_entries_within_the_byte_budget(tmp_path, clock):
+    with ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=10) as response_cache:
+        for key in ["a", "b", "c"]:
+            response_cache.put(key, "anthropic", PARAMS, key * 4)
+        response_cache.get("a")
+        response_cache.evict()
+        assert keys_of(response_cache) == ["a", "c"]
+        assert response_cache.stats()["bytes"] == 8
+
+
+def test_eviction_drops_entries_past_their_age(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    with ResponseCache(str(tmp_path / "cache.sqlite"), max_age=60) as response_cache:
+        response_cache.put("old", "anthropic", PARAMS, "old")
+        now[0] += 30
+        response_cache.put("new", "anthropic", PARAMS, "new")
+        now[0] += 31
+        # Past its age an entry misses even before it is evicted
+        assert response_cache.get("old") is None
+        assert response_cache.get("new") == "new"
+        response_cache.evict()
+        assert keys_of(response_cache) == ["new"]
@@ -0,0 +1,56 @@
+import os  # Module for file system operations
+import subprocess  # Module for running the enrichment scripts
+import sys  # Module for the interpreter path
+
+import pytest  # The test runner, for parametrized cases
+
+from enrich import count_pending, parse_enrichment_args
+from helpers import to_json
+from instance_keys import key_function
+from journal import EnrichmentJournal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("script, provider", [("02_enrich_finqa_data_anthropic.py", "anthropic"),
+                                              ("03_enrich_finqa_data_openai.py", "openai")])
+def test_dry_run_leaves_the_journal_alone(tmp_path, script, provider):
+    os.makedirs(tmp_path / "data")
+    records = [{"pre_text": f"document {index}", "table": "", "post_text": "",
+                "qa_pairs": [{"question": f"what is {index}?", "answer": "1"}]} for index in range(10)]
+    with open(tmp_path / "data" / "finqa_data.json", "w", encoding="utf-8") as f_out:
+        f_out.writelines(to_json(record) + "\n" for record in records)
+    # A journal keyed with an older scheme and ending in a torn line, which a real run would migrate and repair
+    journal = EnrichmentJournal(str(tmp_path / "data" / f"finqa_data_enriched_{provider}.journal"), fsync=False)
+    with journal:
+        for record in records[:4]:
+            journal.append(dict(record, response="1"), key=key_function(2)(record))
+    with open(journal.path, "ab") as f_out:
+        f_out.write(b"torn")
+    with open(journal.path, "rb") as f_in:
+        content = f_in.read()
+
+    # No credentials are set, and none are needed
+    environment = {name: value for name, value in os.environ.items() if not name.endswith("_api_key")}
+    result = subprocess.run([sys.executable, os.path.join(ROOT, script), "--dry-run"], cwd=tmp_path,
+                            env=environment, capture_output=True, text=True, check=True)
+    assert "4 instances journalled, 6 left to enrich" in result.stdout
+    with open(journal.path, "rb") as f_in:
+        assert f_in.read() == content
+
+
+def test_pending_instances_are_counted_from_the_index(tmp_path):
+    path = str(tmp_path / "finqa_data.json")
+    records = [{"pre_text": f"document {index}", "table": "", "post_text": "",
+                "qa_pairs": [{"question": "what is it?", "answer": "1"}]} for index in range(5)]
+    with open(path, "w", encoding="utf-8") as f_out:
+        f_out.writelines(to_json(record) + "\n" for record in records)
+    assert count_pending(path, set()) == 5
+    assert count_pending(path, {key_function()(records[1]), key_function()(records[3]), "unknown"}) == 3
+
+
+@pytest.mark.parametrize("argv", [["--samples", "3", "--batch"], ["--pack", "2", "--samples", "3"],
+                                  ["--worker", "--batch"]])
+def test_conflicting_options_are_rejected(argv):
+    with pytest.raises(SystemExit):
+        parse_enrichment_args("Enrich.", "Batch API", 1, 1, 1, argv=argv)
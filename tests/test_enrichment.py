@@ -0,0 +1,106 @@
+import asyncio  # Module for running the provider pool
+import re  # Module for regular expressions
+import threading  # Module for running the engine under a deadline
+
+import pytest  # The test runner, for parametrized cases and expected exceptions
+
+from enrichment import EnrichmentEngine, ProviderPool, TransientError
+from metrics import Metrics
+from packing import Packer
+from prompts import PromptBuilder, Tokenizer
+
+# A question line of a packed prompt, such as "2.1 what was the change?"
+QUESTION_LINE = re.compile(r"^(\d+\.\d+) ", re.MULTILINE)
+
+
+def whitespace_tokenizer() -> Tokenizer:
+    # Counting words keeps the tests offline, unlike the tiktoken encodings
+    return Tokenizer(lambda text: list(range(len(text.split()))), lambda tokens: "")
+
+
+def make_records(count: int):
+    return [{"pre_text": f"document {index}", "table": "", "post_text": "",
+             "qa_pairs": [{"question": f"what is {index}?", "answer": str(index)}]} for index in range(count)]
+
+
+async def answer_packed(message: str) -> str:
+    # Answer every question of a pack with its own index, and a single question with 0
+    indices = QUESTION_LINE.findall(message)
+    return "\n".join(f"{index}: {index.split('.')[0]}" for index in indices) if indices else "0"
+
+
+def run_engine(engine: EnrichmentEngine, records, timeout: float = 10.0):
+    written = list()
+    thread = threading.Thread(target=engine.run, args=(records, written.append), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the engine did not finish"
+    return written
+
+
+def test_pack_larger_than_window_completes():
+    # A window of concurrency * 4 records would be smaller than one pack of 10
+    packer = Packer(PromptBuilder(whitespace_tokenizer(), 100000), max_instances=10, metrics=Metrics())
+    engine = EnrichmentEngine(answer_packed, concurrency=2, requests_per_minute=1e9, tokens_per_minute=1e12,
+                              metrics=Metrics(), packer=packer)
+    records = make_records(25)
+    written = run_engine(engine, records)
+    assert [record["pre_text"] for record in written] == [record["pre_text"] for record in make_records(25)]
+    # Every record of a pack was answered by its position in the pack
+    assert all(record["response"] for record in written)
+
+
+def open_circuit_pool() -> ProviderPool:
+    # One transient failure opens the circuit, for a reset timeout short enough to probe quickly
+    return ProviderPool(requests_per_minute=1e9, tokens_per_minute=1e12, base_backoff=0.01, metrics=Metrics(),
+                        max_transient_retries=0, failure_threshold=1, reset_timeout=0.05)
+
+
+async def fail_transiently(message: str) -> str:
+    raise TransientError("unavailable")
+
+
+async def answer(message: str) -> str:
+    return "answer"
+
+
+@pytest.mark.parametrize("error", [ValueError("unparseable"), RuntimeError("bad request")])
+def test_probe_failing_permanently_settles_the_circuit(error):
+    async def fail_permanently(message: str) -> str:
+        raise error
+
+    async def scenario():
+        pool = open_circuit_pool()
+        with pytest.raises(TransientError):
+            await pool.request(fail_transiently, "message")
+        assert pool.breaker.state == "open"
+        with pytest.raises(type(error)):
+            await pool.request(fail_permanently, "message")
+        assert not pool.breaker.probing
+        assert await asyncio.wait_for(pool.request(answer, "message"), 5) == "answer"
+        assert pool.breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_probe_settles_the_circuit():
+    async def hang(message: str) -> str:
+        await asyncio.sleep(60)
+
+    async def scenario():
+        pool = open_circuit_pool()
+        with pytest.raises(TransientError):
+            await pool.request(fail_transiently, "message")
+        probe = asyncio.ensure_future(pool.request(hang, "message"))
+        while not pool.breaker.probing:
+            await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        # The cancelled probe counts as failed, reopening the circuit until another request probes it
+        assert not pool.breaker.probing
+        assert pool.breaker.state == "open"
+        assert await asyncio.wait_for(pool.request(answer, "message"), 5) == "answer"
+        assert pool.breaker.state == "closed"
+
+    asyncio.run(scenario())
@@ -0,0 +1,66 @@
+import os  # Module for file system operations
+
+from helpers import from_json, to_json
+from journal import EnrichmentJournal
+
+
+def make_record(index: int):
+    return {"pre_text": f"document {index}", "table": "", "post_text": "",
+            "qa_pairs": [{"question": "what?", "answer": "1"}], "response": "1"}
+
+
+def write_journal(path: str, count: int) -> EnrichmentJournal:
+    journal = EnrichmentJournal(path, fsync=False)
+    with journal:
+        for index in range(count):
+            journal.append(make_record(index), key=f"key-{index}")
+    return journal
+
+
+def test_corrupt_line_is_skipped_without_losing_later_records(tmp_path):
+    journal = write_journal(str(tmp_path / "run.journal"), 5)
+    with open(journal.path, "rb") as f_in:
+        lines = f_in.readlines()
+    # Flip one byte of the record on the second line
+    lines[1] = lines[1].replace(b"document 1", b"document X")
+    with open(journal.path, "wb") as f_out:
+        f_out.writelines(lines)
+    size = os.path.getsize(journal.path)
+
+    assert journal.scan() == {"key-0", "key-2", "key-3", "key-4"}
+    assert journal.corrupt_lines == 1
+    assert os.path.getsize(journal.path) == size
+
+
+def test_torn_last_line_is_only_cut_by_the_writer(tmp_path):
+    journal = write_journal(str(tmp_path / "run.journal"), 3)
+    with open(journal.path, "ab") as f_out:
+        f_out.write(b"key-3\t0000")
+    size = os.path.getsize(journal.path)
+
+    # Readers leave the line alone, since its writer may still be finishing it
+    assert journal.scan() == {"key-0", "key-1", "key-2"}
+    assert os.path.getsize(journal.path) == size
+
+    with journal:
+        journal.append(make_record(3), key="key-3")
+    assert journal.scan() == {"key-0", "key-1", "key-2", "key-3"}
+    assert journal.corrupt_lines == 0
+
+
+def test_instances_sharing_a_document_keep_their_own_records(tmp_path):
+    # Two instances ask different questions about the same page
+    instances = [dict(make_record(0), qa_pairs=[{"question": question, "answer": "1"}]) for question in "ab"]
+    input_path = str(tmp_path / "input.json")
+    with open(input_path, "w", encoding="utf-8") as f_out:
+        for instance in instances:
+            f_out.write(to_json(dict(instance, response=None)) + "\n")
+    journal = EnrichmentJournal(str(tmp_path / "run.journal"), fsync=False)
+    with journal:
+        for instance in instances:
+            journal.append(dict(instance, response=instance["qa_pairs"][0]["question"]))
+
+    output_path = str(tmp_path / "output.json")
+    assert journal.compact(input_path, output_path) == 0
+    with open(output_path, encoding="utf-8") as f_in:
+        assert [from_json(line)["response"] for line in f_in] == ["a", "b"]
@@ -0,0 +1,20 @@
+import multiprocessing  # Module for building an index from several processes at once
+
+from helpers import to_json
+from jsonl_index import JsonlIndex
+
+
+def build_index(path: str) -> int:
+    with JsonlIndex(path) as index:
+        return len(index)
+
+
+def test_concurrent_builds_agree(tmp_path):
+    path = str(tmp_path / "input.json")
+    with open(path, "w", encoding="utf-8") as f_out:
+        for index in range(2000):
+            f_out.write(to_json({"pre_text": f"document {index}", "table": "", "post_text": "",
+                                 "qa_pairs": [{"question": "what?", "answer": "1"}]}) + "\n")
+    with multiprocessing.Pool(4) as pool:
+        assert pool.map(build_index, [path] * 8) == [2000] * 8
+    assert not [name for name in tmp_path.iterdir() if name.suffix == ".tmp"]
@@ -0,0 +1,29 @@
+import pytest  # The test runner, for parametrized cases
+
+from metrics import Metrics, price_of
+
+
+@pytest.mark.parametrize("model, price", [
+    ("gpt-4", (30.0, 60.0)),
+    ("gpt-4-0613", (30.0, 60.0)),
+    ("gpt-4-32k-0613", (60.0, 120.0)),
+    ("gpt-4-0125-preview", (10.0, 30.0)),
+    ("gpt-4o", (2.5, 10.0)),
+    ("gpt-4o-2024-08-06", (2.5, 10.0)),
+    ("gpt-4o-mini-2024-07-18", (0.15, 0.6)),
+    ("claude-3-opus-20240229", (15.0, 75.0)),
+    # Unknown models are not billed at the price of a family they merely start with
+    ("gpt-4-vision-preview", None),
+    ("gpt-4.5-preview", None),
+])
+def test_price_of_matches_model_families(model, price):
+    assert price_of(model) == price
+
+
+def test_spend_reports_unpriced_models():
+    metrics = Metrics()
+    metrics.increment("provider_input_tokens_total", 1_000_000, provider="openai", model="gpt-4o-mini")
+    metrics.increment("provider_output_tokens_total", 1_000_000, provider="openai", model="gpt-4o-mini")
+    metrics.increment("provider_input_tokens_total", 1_000_000, provider="stub", model="stub")
+    assert metrics.spend() == pytest.approx(0.75)
+    assert metrics.unpriced_models() == ["stub"]
@@ -0,0 +1,85 @@
+import asyncio  # Module for running the pack requests
+
+import pytest  # The test runner, for parametrized cases
+
+from enrichment import ProviderPool
+from metrics import Metrics
+from packing import MISSING_ANSWER, Packer, create_packed_message, demultiplex
+from prompts import ANSWER_TOKENS_PER_QUESTION, PromptBuilder, Tokenizer, answer_max_tokens
+
+
+def whitespace_tokenizer() -> Tokenizer:
+    # Counting words keeps the tests offline, unlike the tiktoken encodings
+    return Tokenizer(lambda text: text.split(), lambda tokens: " ".join(tokens))
+
+
+def make_record(index: int, questions: int = 1):
+    return {"pre_text": f"document {index}", "table": "", "post_text": "",
+            "qa_pairs": [{"question": f"question {index}.{q}?", "answer": "1"} for q in range(questions)]}
+
+
+@pytest.mark.parametrize("response, responses", [
+    # In order, out of order, and decorated in the ways models write indices
+    ("1.1: 12.5\n1.2: yes\n2.1: -3", ["12.5\tyes", "-3"]),
+    ("2.1: -3\n1.2: yes\n1.1: 12.5", ["12.5\tyes", "-3"]),
+    ("**1.1:** 12.5\n- [1.2] yes\nDocument 2, question 1 = -3", ["12.5\tyes", "-3"]),
+    # The first answer to a question wins, and indices outside the pack are ignored
+    ("1.1: 12.5\n1.1: 99\n1.2: yes\n2.1: -3\n2.2: 7\n3.1: 8", ["12.5\tyes", "-3"]),
+    # A question left out is marked missing without shifting the others
+    ("1.2: yes\n2.1: -3", [f"{MISSING_ANSWER}\tyes", "-3"]),
+    # An instance with no answer at all is left for a request of its own
+    ("1.1: 12.5\n1.2: yes", ["12.5\tyes", None]),
+    # Lines without indices are read in order when there is exactly one per question
+    ("12.5\nyes\n-3", ["12.5\tyes", "-3"]),
+    ("12.5\nyes", [None, None]),
+    (None, [None, None]),
+])
+def test_demultiplex(response, responses):
+    assert demultiplex(response, [2, 1]) == responses
+
+
+def test_packed_message_numbers_every_question():
+    message = create_packed_message([make_record(0, 2), make_record(1)])
+    assert "DOCUMENT 1: " in message and "DOCUMENT 2: " in message
+    assert "\n1.1 question 0.0?\n1.2 question 0.1?" in message
+    assert "\n2.1 question 1.0?" in message
+
+
+def test_pack_respects_instance_question_and_token_limits():
+    packer = Packer(PromptBuilder(whitespace_tokenizer(), 100000), max_instances=3, max_questions=4,
+                    metrics=Metrics())
+    records = [make_record(0, 2), make_record(1), make_record(2, 2), make_record(3), make_record(4),
+               dict(make_record(5), response="cached"), make_record(6)]
+    sizes = [[record["pre_text"] for record in pack] for pack in packer.pack(records)]
+    assert sizes == [["document 0", "document 1"], ["document 2", "document 3", "document 4"], ["document 5"],
+                     ["document 6"]]
+
+    # Each record takes four tokens, so a budget of ten holds two
+    packer = Packer(PromptBuilder(whitespace_tokenizer(), 10 + 256), max_instances=8, metrics=Metrics())
+    assert [len(pack) for pack in packer.pack(make_record(index) for index in range(5))] == [2, 2, 1]
+
+
+@pytest.mark.parametrize("max_instances, max_questions, questions", [(8, None, 16), (3, None, 6), (4, 5, 5)])
+def test_max_tokens_leaves_room_for_every_answer_of_a_full_pack(max_instances, max_questions, questions):
+    packer = Packer(PromptBuilder(whitespace_tokenizer(), 100000), max_instances, max_questions,
+                    metrics=Metrics())
+    assert packer.max_tokens == ANSWER_TOKENS_PER_QUESTION * questions == answer_max_tokens(questions)
+
+
+def test_unanswered_instances_are_requested_alone():
+    messages = list()
+
+    async def answer_first(message: str) -> str:
+        messages.append(message)
+        return "1.1: 12.5\n1.2: 4\n3.1: no" if message.startswith("Here are") else "alone"
+
+    packer = Packer(PromptBuilder(whitespace_tokenizer(), 100000), metrics=Metrics())
+    pool = ProviderPool(requests_per_minute=1e9, tokens_per_minute=1e12, metrics=Metrics())
+    records = [make_record(0, 2), make_record(1), make_record(2)]
+    responses = asyncio.run(packer.request(pool, answer_first, records))
+
+    assert responses == ["12.5\t4", "alone", "no"]
+    # The pack, then the usual prompt of the instance it skipped
+    assert len(messages) == 2
+    assert messages[1] == packer.prompt_builder.build(records[1])
+    assert packer.metrics.value("packing_fallbacks_total") == 1
@@ -0,0 +1,94 @@
+import json  # Module for writing the fixture files
+import os  # Module for file system operations
+import signal  # Module for killing a worker outright
+import threading  # Module for running the parser under a deadline
+from concurrent.futures.process import BrokenProcessPool  # Raised for the work of a killed worker
+
+import pytest  # The test runner, for expected exceptions
+
+import parsing
+from helpers import from_json_file, to_json
+from parsing import parse_files, process_instance
+
+
+def make_instance(file_index: int, index: int):
+    instance = {
+        "pre_text": [f"file {file_index} instance {index}", "revenue grew — “strongly”"],
+        "post_text": ["net of tax"],
+        "table_ori": [["", "2019", "2018"], ["revenue", f"${index},000", "(12)"]],
+        "qa": {"question": f"what was revenue in 2019 for {index}?", "answer": f"{index}000"},
+    }
+    # Two-question instances hold numbered pairs, listed out of order
+    if index % 2:
+        del instance["qa"]
+        instance["qa_1"] = {"question": "and in 2018?", "answer": "-12"}
+        instance["qa_0"] = {"question": "what was revenue?", "answer": "yes"}
+    return instance
+
+
+def write_fixture(directory, files: int = 3, instances: int = 7):
+    data_files = list()
+    for file_index in range(files):
+        path = str(directory / f"original-{file_index}.json")
+        with open(path, "w", encoding="utf-8") as f_out:
+            json.dump([make_instance(file_index, index) for index in range(instances)], f_out, indent=1)
+        data_files.append(path)
+    return data_files
+
+
+def parse_single_process(data_files, output_path: str):
+    # The parse before sharding: load each file whole and write every instance in order
+    with open(output_path, "w", encoding="utf-8") as f_out:
+        for data_file in data_files:
+            for instance in from_json_file(data_file):
+                f_out.write(to_json(process_instance(instance)) + "\n")
+
+
+def test_sharded_output_matches_single_process_parse(tmp_path):
+    data_files = write_fixture(tmp_path)
+    parse_single_process(data_files, str(tmp_path / "single.json"))
+    shards = parse_files(data_files, str(tmp_path / "sharded.json"), str(tmp_path / "shards"), shard_size=3,
+                         workers=2)
+
+    with open(tmp_path / "single.json", "rb") as f_in, open(tmp_path / "sharded.json", "rb") as f_sharded:
+        assert f_sharded.read() == f_in.read()
+    assert [(os.path.basename(shard["source"]), shard["index"], shard["count"]) for shard in shards] == [
+        (f"original-{file_index}.json", index, count) for file_index in range(3) for index, count in
+        enumerate([3, 3, 1])]
+    with open(tmp_path / "shards" / "manifest.json", encoding="utf-8") as f_in:
+        assert json.load(f_in)["complete"]
+
+
+def test_killed_worker_fails_the_parse_instead_of_hanging(tmp_path, monkeypatch):
+    data_files = write_fixture(tmp_path, files=2)
+    process = parsing.process_instance
+
+    def process_or_die(instance):
+        # The forked worker parsing the second file is killed without a chance to report anything
+        if instance["pre_text"][0] == "file 1 instance 3":
+            os.kill(os.getpid(), signal.SIGKILL)
+        return process(instance)
+
+    monkeypatch.setattr(parsing, "process_instance", process_or_die)
+    errors = list()
+
+    def parse():
+        try:
+            parse_files(data_files, str(tmp_path / "sharded.json"), str(tmp_path / "shards"), shard_size=2,
+                        workers=2)
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=parse, daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "the parse did not finish"
+    assert len(errors) == 1 and isinstance(errors[0], BrokenProcessPool)
+    assert not os.path.exists(tmp_path / "sharded.json")
+
+
+def test_malformed_file_raises(tmp_path):
+    path = tmp_path / "broken.json"
+    path.write_text('[{"pre_text": []', encoding="utf-8")
+    with pytest.raises(Exception):
+        parse_files([str(path)], str(tmp_path / "out.json"), str(tmp_path / "shards"), workers=1)
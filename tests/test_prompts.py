@@ -0,0 +1,131 @@
+import pytest  # The test runner, for fixtures and parametrized cases
+
+from prompts import ANSWER_TOKENS_PER_QUESTION, DEFAULT_CONTEXT_WINDOW, PromptBuilder, Tokenizer, \
+    answer_max_tokens, context_window, get_tokenizer
+
+QUESTIONS = ["what was the change in net revenue from 2018 to 2019?", "what percentage of revenue is income?"]
+
+
+def whitespace_tokenizer() -> Tokenizer:
+    # Counting words keeps the tests offline, unlike the tiktoken encodings
+    return Tokenizer(lambda text: text.split(), lambda tokens: " ".join(tokens))
+
+
+def character_tokenizer() -> Tokenizer:
+    # Every character is a token, so the joins between the parts of a prompt are counted too
+    return Tokenizer(list, "".join)
+
+
+def make_record(words: int, questions: int = 2):
+    return {"pre_text": " ".join(f"before{index}" for index in range(words)),
+            "table": "\n".join(f"row{index} | {index * 1.5} | {index * 2.5}" for index in range(words // 4)),
+            "post_text": " ".join(f"after{index}" for index in range(words)),
+            "qa_pairs": [{"question": question, "answer": "1"} for question in QUESTIONS[:questions]]}
+
+
+@pytest.mark.parametrize("model, window", [
+    ("gpt-4", 8192),
+    ("gpt-4-0613", 8192),
+    ("gpt-4-32k-0613", 32768),
+    ("gpt-4-turbo-2024-04-09", 128000),
+    ("gpt-4-1106-preview", 128000),
+    ("gpt-4o-mini", 128000),
+    ("gpt-3.5-turbo-0125", 16385),
+    ("claude-3-opus-20240229", 200000),
+    ("claude-2.1", 100000),
+    ("llama-3-70b", DEFAULT_CONTEXT_WINDOW),
+])
+def test_context_window_matches_the_longest_prefix(model, window):
+    assert context_window(model) == window
+
+
+@pytest.mark.parametrize("tokenizer", [whitespace_tokenizer(), character_tokenizer()], ids=["words", "characters"])
+@pytest.mark.parametrize("share", [0.0, 0.01, 0.1, 0.5, 0.9])
+@pytest.mark.parametrize("questions", [1, 2])
+def test_trimmed_prompts_fit_the_budget_and_keep_every_question(tokenizer, share, questions):
+    record = make_record(200, questions)
+    builder = PromptBuilder(tokenizer, 1)
+    # A budget between the prompt without a document and the whole prompt
+    least = builder.count(builder.render(dict(record, pre_text="", table="", post_text="")))
+    budget = least + int(share * (builder.count(builder.render(record)) - least))
+    builder.max_prompt_tokens = budget
+    prompt = builder.build(record)
+    assert tokenizer.count(prompt) <= budget
+    for qa_pair in record["qa_pairs"]:
+        assert qa_pair["question"] in prompt
+    assert builder.stats()["trimmed"] == 1
+
+
+def test_fit_keeps_the_table_then_the_text_next_to_it():
+    builder = PromptBuilder(whitespace_tokenizer(), 1000)
+    record = make_record(40)
+    table_tokens = builder.count(record["table"])
+    fitted = builder.fit(record, table_tokens + 10)
+    assert fitted["table"] == record["table"]
+    # The pre-text keeps its end, next to the table, and the post-text its start
+    assert fitted["pre_text"] == " ".join(f"before{index}" for index in range(35, 40))
+    assert fitted["post_text"] == " ".join(f"after{index}" for index in range(5))
+    assert fitted["qa_pairs"] == record["qa_pairs"]
+
+
+def test_fit_hands_the_unused_share_to_the_other_side():
+    builder = PromptBuilder(whitespace_tokenizer(), 1000)
+    record = dict(make_record(40), table="", post_text="short post")
+    fitted = builder.fit(record, 20)
+    assert fitted["post_text"] == "short post"
+    assert builder.count(fitted["pre_text"]) == 18
+
+
+def test_fit_cuts_a_table_too_long_for_the_budget_to_whole_rows():
+    builder = PromptBuilder(whitespace_tokenizer(), 1000)
+    record = make_record(40)
+    fitted = builder.fit(record, 12)
+    assert (fitted["pre_text"], fitted["post_text"]) == ("", "")
+    # Each row takes five tokens and its line break one
+    assert fitted["table"] == "row0 | 0.0 | 0.0\nrow1 | 1.5 | 2.5"
+
+
+def test_prompts_within_the_budget_are_left_alone():
+    builder = PromptBuilder(whitespace_tokenizer(), 10000)
+    record = make_record(20)
+    assert builder.build(record) == builder.render(record)
+    assert builder.stats()["trimmed"] == 0
+
+
+def test_questions_are_sent_even_when_they_exceed_the_budget():
+    builder = PromptBuilder(whitespace_tokenizer(), 5)
+    prompt = builder.build(make_record(20))
+    assert prompt == builder.render(dict(make_record(20), pre_text="", table="", post_text=""))
+    assert QUESTIONS[1] in prompt
+
+
+def test_for_model_budgets_what_the_response_leaves(monkeypatch):
+    monkeypatch.setattr("prompts.get_tokenizer", lambda provider, model: whitespace_tokenizer())
+    assert PromptBuilder.for_model("openai", "gpt-4", 64).max_prompt_tokens == 8192 - 64
+    assert PromptBuilder.for_model("openai", "gpt-4", 64, max_prompt_tokens=4000).max_prompt_tokens == 4000
+
+
+# The longest answers the prompt asks for, as a packed response numbers them
+ANSWERS = ["-1,234,567.89", "−98,765,432.1%", "$-12,345,678.90", "yes", "12.3: -1,234,567.89"]
+
+
+@pytest.mark.parametrize("questions", [1, 2, 16])
+def test_answer_budget_holds_a_signed_thousands_separated_number_per_question(questions):
+    # Every token of a byte-level tokenizer covers at least one byte, so the UTF-8 length bounds the count
+    for answer in ANSWERS:
+        response = "\t".join([answer] * questions)
+        assert len(response.encode("utf-8")) <= answer_max_tokens(questions)
+    assert answer_max_tokens(questions) == ANSWER_TOKENS_PER_QUESTION * questions
+
+
+@pytest.mark.parametrize("provider, model", [("anthropic", "claude-3-opus-20240229"), ("openai", "gpt-4")])
+def test_answer_budget_with_the_model_tokenizer(provider, model):
+    try:
+        tokenizer = get_tokenizer(provider, model)
+    except Exception as e:
+        # The tiktoken encodings are downloaded on first use
+        pytest.skip(f"The {provider} tokenizer is not available: {e}")
+    for answer in ANSWERS:
+        # Leave room for a short working such as "x = ..." on top of the answer
+        assert tokenizer.count(answer) * 2 <= ANSWER_TOKENS_PER_QUESTION
+        assert tokenizer.count("\n".join([answer] * 8)) <= answer_max_tokens(8)
@@ -0,0 +1,77 @@
+import os  # Module for file system operations
+
+import pyarrow.dataset as ds  # Multi-file datasets, for the fragments a filter reads
+import pyarrow.parquet as pq  # Parquet reading and writing, for a run written before the version column
+
+from helpers import to_json
+from results_store import SCHEMA, build_filter, convert_jsonl, load_items, load_values, open_store, partition_dir
+from scoring import SCORER_VERSION
+
+# Model and run names holding the characters that would otherwise split or misname the directories
+RUNS = [("openai", "org/gpt-4", "default"), ("openai", "org/gpt-4", "run=2 50%"), ("anthropic", "claude-3", "a/b")]
+
+
+def write_records(path: str, count: int, response: str):
+    with open(path, "w", encoding="utf-8") as f_out:
+        for index in range(count):
+            questions = 1 + index % 2
+            record = {"pre_text": f"page {index}", "table": "", "post_text": "",
+                      "qa_pairs": [{"question": f"question {q}?", "answer": "12.5"} for q in range(questions)],
+                      "response": "\t".join([response] * questions)}
+            f_out.write(to_json(record) + "\n")
+
+
+def fill_store(tmp_path) -> str:
+    store_dir = str(tmp_path / "store")
+    for count, (provider, model, run) in enumerate(RUNS, start=2):
+        path = str(tmp_path / f"run{count}.json")
+        write_records(path, count, str(count))
+        convert_jsonl(path, store_dir, provider, model, run)
+    return store_dir
+
+
+def test_names_round_trip_through_the_partition_directories(tmp_path):
+    store_dir = fill_store(tmp_path)
+    for provider, model, run in RUNS:
+        directory = partition_dir(store_dir, provider, model, run)
+        # Each name is a single directory level
+        assert os.path.relpath(directory, store_dir).count(os.sep) == 2
+        assert os.path.isfile(os.path.join(directory, "part-0.parquet"))
+
+    values = load_values(store_dir)
+    assert sorted(values) == sorted(RUNS)
+    for count, name in enumerate(RUNS, start=2):
+        targets, predictions = values[name]
+        # Every other instance has two questions
+        assert len(targets) == count + count // 2
+        assert set(predictions.tolist()) == {float(count)}
+    assert sorted(load_items(store_dir)) == sorted(RUNS)
+
+
+def test_filters_are_pushed_down_to_the_partitions(tmp_path):
+    store_dir = fill_store(tmp_path)
+    dataset = open_store(store_dir)
+    # A filter on a partition column only lists the files of the matching directories
+    fragments = list(dataset.get_fragments(filter=build_filter(models=["org/gpt-4"])))
+    assert len(fragments) == 2
+    assert all(os.sep + "model=org%2Fgpt-4" + os.sep in fragment.path for fragment in fragments)
+
+    values = load_values(store_dir, models=["org/gpt-4"], question_count=2)
+    assert sorted(values) == sorted(RUNS[:2])
+    assert [len(targets) for targets, _ in (values[name] for name in RUNS[:2])] == [2, 2]
+
+
+def test_values_carry_the_scorer_version_they_were_extracted_with(tmp_path):
+    store_dir = fill_store(tmp_path)
+    table = open_store(store_dir).to_table(columns=["scorer_version"])
+    assert set(table.column("scorer_version").to_pylist()) == {SCORER_VERSION}
+
+    # A run converted before the version column existed reads it as null, so a version filter leaves it out
+    directory = partition_dir(store_dir, "openai", "gpt-3.5", "old")
+    os.makedirs(directory)
+    old = open_store(store_dir).to_table(filter=ds.field("run") == "default").select(
+        [name for name in SCHEMA.names if name != "scorer_version"])
+    pq.write_table(old, os.path.join(directory, "part-0.parquet"))
+    assert ("openai", "gpt-3.5", "old") in load_values(store_dir)
+    assert sorted(load_values(store_dir, scorer_version=SCORER_VERSION)) == sorted(RUNS)
+    assert load_values(store_dir, scorer_version="0") == {}
@@ -0,0 +1,58 @@
+import itertools  # Module for the cross product of the edge values
+
+import numpy as np  # NumPy, a library for numerical computing
+import pytest  # The test runner, for parametrized cases
+
+from scoring import REASONS, check_parity, score_scalar, score_values, sweep_tolerances
+
+# Values around every edge of the rules: NaN, signed zeros, infinities, the 0.5 absolute tolerance, the 1%
+# relative tolerance, and values a factor of 100 apart in either direction
+EDGE_VALUES = [np.nan, 0.0, -0.0, np.inf, -np.inf, 0.5, -0.5, 0.4999999, 0.5000001, 1.0, -1.0, 0.01, 0.0101,
+               0.125, 12.5, -12.5, 50.0, 50.5, 49.5, 100.0, 101.0, 99.0, 100.99, 101.01, -100.0, -101.0, 1e6,
+               1.01e6, 1e-9, 1e300, -1e300]
+
+
+def edge_pairs():
+    pairs = np.array(list(itertools.product(EDGE_VALUES, repeat=2)), dtype=np.float64)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def random_pairs(count: int = 20000, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    targets = rng.choice([-1, 1], count) * 10 ** rng.uniform(-3, 6, count)
+    # Predictions near the target, near a hundredth or a hundred times it, or anywhere
+    factors = rng.choice([1.0, 0.01, 100.0], count)
+    noise = rng.normal(0, 0.02, count) * rng.choice([0.0, 1.0], count, p=[0.3, 0.7])
+    sources = targets * factors * (1 + noise)
+    sources[rng.random(count) < 0.05] = np.nan
+    targets[rng.random(count) < 0.05] = np.nan
+    return targets, sources
+
+
+@pytest.mark.parametrize("pairs", [edge_pairs(), random_pairs()], ids=["edges", "random"])
+def test_vectorized_scores_match_essentially_equals(pairs):
+    targets, sources = pairs
+    assert check_parity(targets, sources) == []
+
+
+@pytest.mark.parametrize("target, source, reason", [
+    (12.5, 12.5, "exact"),
+    (12.5, 12.9, "exact"),
+    (-12.5, 12.5, "absolute"),
+    (0.125, 12.5, "target_percent"),
+    (12.5, 0.125, "source_percent"),
+    (np.nan, 3.0, "exact"),
+    (3.0, np.nan, "incorrect"),
+    (np.nan, np.nan, "incorrect"),
+    (0.0, -1.0, "incorrect"),
+])
+def test_reasons(target, source, reason):
+    reasons = score_values(np.array([target]), np.array([source]))
+    assert REASONS[reasons[0]] == reason
+    assert score_scalar(target, source) == reasons[0]
+
+
+def test_sweep_at_default_tolerances_matches_scores():
+    targets, sources = random_pairs(2000, seed=1)
+    accuracy = sweep_tolerances(targets, sources, [0.5], [0.01])
+    assert accuracy[0, 0] == pytest.approx((score_values(targets, sources) > 0).mean())
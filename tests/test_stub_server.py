@@ -0,0 +1,67 @@
+import time  # Module for slowing down the creation of a connection pool
+from concurrent.futures import ThreadPoolExecutor  # Worker threads sending their first requests together
+
+import transport
+from enrichment import EnrichmentEngine
+from metrics import Metrics
+from providers import AnthropicProvider, OpenAIProvider
+from stub_server import StubState, serve_in_thread
+
+
+def make_records(count: int):
+    return [{"pre_text": f"document {index}", "table": "", "post_text": "",
+             "qa_pairs": [{"question": f"what is {index}?", "answer": "42"}]} for index in range(count)]
+
+
+def enrich_through_stub(provider_class, **params):
+    # The stub rejects some requests as overloaded, which the engine retries
+    state = StubState(latency=0.0, jitter=0.0, overload_rate=0.2, response_text="42")
+    server = serve_in_thread(state)
+    try:
+        provider = provider_class("test-key", params, f"http://127.0.0.1:{server.server_port}", metrics=Metrics())
+        engine = EnrichmentEngine(provider, concurrency=4, requests_per_minute=1e9, tokens_per_minute=1e12,
+                                  base_backoff=0.01, max_backoff=0.05, max_retries=50, max_transient_retries=50,
+                                  metrics=Metrics())
+        written = list()
+        engine.run(make_records(20), written.append)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return written, state
+
+
+def test_anthropic_enrichment_against_stub():
+    written, state = enrich_through_stub(AnthropicProvider, model="stub", max_tokens=16)
+    assert [record["pre_text"] for record in written] == [f"document {index}" for index in range(20)]
+    assert all(record["response"] == "42" for record in written)
+    assert state.counts["ok"] == 20
+
+
+def test_openai_enrichment_against_stub():
+    written, state = enrich_through_stub(OpenAIProvider, model="stub", max_tokens=16)
+    assert len(written) == 20 and all(record["response"] == "42" for record in written)
+
+
+def test_concurrent_first_requests_share_one_connection_pool(monkeypatch):
+    created = list()
+
+    class SlowTransport(transport.Transport):
+        # Opening the pool takes long enough for every thread to arrive while it is being created
+        def __init__(self, *args, **kwargs):
+            time.sleep(0.05)
+            super().__init__(*args, **kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(transport, "Transport", SlowTransport)
+    state = StubState(latency=0.0, jitter=0.0, response_text="42")
+    server = serve_in_thread(state)
+    try:
+        with AnthropicProvider("test-key", {"model": "stub", "max_tokens": 16},
+                               f"http://127.0.0.1:{server.server_port}", metrics=Metrics()) as provider:
+            with ThreadPoolExecutor(8) as executor:
+                assert list(executor.map(provider, [f"message {index}" for index in range(8)])) == ["42"] * 8
+            assert len(created) == 1
+            assert provider.transport_stats()["requests"] == state.counts["ok"] == 8
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,73 @@
+import pytest  # The test runner, for parametrized cases and expected exceptions
+
+from tables import Table, parse_table, question_terms, render_table
+
+# A table in the tab-delimited format written by the parser
+TABLE = "\n".join([
+    "\t2019\t2018\t2017",
+    "net revenue\t$1,234\t1,100\t980",
+    "operating income\t345\t(12)\t300",
+    "interest expense, net\t45\t40\t38",
+])
+
+
+def labels(table: Table):
+    return [row[0] for row in table.cells]
+
+
+def test_question_terms():
+    words, numbers = question_terms(["What was the net revenue in 2019?", "And the change from 1,100?"])
+    assert words == {"net", "revenue"}
+    assert numbers == {2019.0, 1100.0}
+
+
+def test_prune_keeps_the_header_label_column_and_named_rows_and_columns():
+    table = parse_table(TABLE).prune(["what was the operating income in 2019?"])
+    # The header row, the row the question names and its label, and the column the question names
+    assert table.cells == [["", "2019"], ["operating income", "345"]]
+    assert table.values[1].tolist()[1:] == [345.0]
+
+
+def test_prune_keeps_every_row_sharing_a_word_with_a_question():
+    table = parse_table(TABLE).prune(["what was the net revenue?"])
+    assert labels(table) == ["", "net revenue", "interest expense, net"]
+
+
+def test_prune_keeps_rows_holding_a_number_the_question_quotes():
+    table = parse_table(TABLE).prune(["what is the percentage change from 300 to 345?"])
+    assert labels(table) == ["", "operating income"]
+    # No header matches, so every column is kept
+    assert table.cells[0] == ["", "2019", "2018", "2017"]
+
+
+def test_prune_keeps_the_whole_table_when_nothing_matches():
+    table = parse_table(TABLE)
+    pruned = table.prune(["how many employees were hired?"])
+    assert pruned.cells == table.cells
+    assert pruned.shape == (4, 4)
+
+
+def test_prune_keeps_tables_too_small_to_prune():
+    table = Table([["revenue", "12"]])
+    assert table.prune(["what was the income?"]) is table
+
+
+@pytest.mark.parametrize("table_format, rendered", [
+    ("flat", "2019 2018 2017 net revenue $1,234 1,100 980 operating income 345 (12) 300 "
+             "interest expense, net 45 40 38"),
+    ("markdown", "|2019|2018|2017\nnet revenue|$1,234|1,100|980\noperating income|345|(12)|300\n"
+                 "interest expense, net|45|40|38"),
+    ("csv", ',2019,2018,2017\nnet revenue,"$1,234","1,100",980\noperating income,345,(12),300\n'
+            '"interest expense, net",45,40,38'),
+])
+def test_render(table_format, rendered):
+    assert render_table(TABLE, table_format) == rendered
+
+
+def test_render_pruned():
+    assert render_table(TABLE, "csv", ["what was operating income in 2018?"]) == ",2018\noperating income,(12)"
+
+
+def test_render_rejects_unknown_formats():
+    with pytest.raises(ValueError):
+        render_table(TABLE, "html")
@@ -0,0 +1,50 @@
+import socket  # Module for the listening socket and name resolution
+
+import httpcore  # Low-level HTTP connection pooling, for its connection errors
+import pytest  # The test runner, for parametrized cases and expected exceptions
+
+import transport
+from transport import NETWORK_ERRORS, TimedBackend, Transport
+
+
+def test_connect_falls_back_to_the_next_address(monkeypatch):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    port = listener.getsockname()[1]
+
+    # The host resolves to an IPv6 address nothing listens on before the IPv4 one; literal addresses resolve
+    # to themselves as usual
+    resolve = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host != "stub.invalid":
+            return resolve(host, port, *args, **kwargs)
+        return [(socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("::1", port, 0, 0)),
+                (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port))]
+
+    monkeypatch.setattr(transport.socket, "getaddrinfo", getaddrinfo)
+    try:
+        stream = TimedBackend().connect_tcp("stub.invalid", port, timeout=5)
+        assert stream.get_extra_info("socket").getpeername()[:2] == ("127.0.0.1", port)
+        stream.close()
+    finally:
+        listener.close()
+
+
+def unknown_host(*args, **kwargs):
+    raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+
+
+def no_addresses(*args, **kwargs):
+    return []
+
+
+@pytest.mark.parametrize("getaddrinfo", [unknown_host, no_addresses])
+def test_unresolvable_host_is_a_network_error(monkeypatch, getaddrinfo):
+    monkeypatch.setattr(transport.socket, "getaddrinfo", getaddrinfo)
+    # A network error is retried by the providers and counted by the circuit breaker, unlike a raw socket error
+    with Transport("http://stub.invalid", http2=False) as client:
+        with pytest.raises(NETWORK_ERRORS) as raised:
+            client.post("/v1/messages", b"{}")
+    assert isinstance(raised.value, httpcore.ConnectError)
@@ -0,0 +1,104 @@
+import os  # Module for file system operations
+
+import numpy as np  # NumPy, a library for numerical computing
+
+from helpers import to_json
+from scoring import REASONS, extract_pair_values, score_values
+from verdicts import VerdictCache
+
+# Responses scored every way: exactly, within the absolute tolerance, as a percentage, wrongly and not at all
+RESPONSES = ["12.5", "13", "1250", "7", "The document does not say"]
+
+
+def make_records(count: int):
+    records = list()
+    for index in range(count):
+        questions = 1 + index % 2
+        records.append({"pre_text": f"page {index}", "table": "", "post_text": "",
+                        "qa_pairs": [{"question": f"question {q}?", "answer": "12.5"} for q in range(questions)],
+                        "response": "\t".join(RESPONSES[(index + q) % len(RESPONSES)] for q in range(questions))})
+    return records
+
+
+def write_records(path: str, records, version: int):
+    with open(path, "w", encoding="utf-8") as f_out:
+        for record in records:
+            f_out.write(to_json(record) + "\n")
+    # A distinct modification time, so a rewrite of the same size is never mistaken for an unchanged file
+    os.utime(path, ns=(version * 10 ** 9, version * 10 ** 9))
+
+
+def full_rescore(records) -> np.ndarray:
+    pairs = [pair for record in records for pair in extract_pair_values(record)]
+    targets, predictions = np.array(pairs, dtype=np.float64).T
+    return np.bincount(score_values(targets, predictions), minlength=len(REASONS))
+
+
+def test_changed_response_rescores_only_its_items(tmp_path):
+    path = str(tmp_path / "enriched.json")
+    records = make_records(20)
+    write_records(path, records, 1)
+    with VerdictCache(str(tmp_path / "verdicts.sqlite")) as cache:
+        assert cache.update("model", path) == {"added_lines": 20, "removed_lines": 0, "scored_items": 30,
+                                                "reused_items": 0}
+        assert cache.totals("model").tolist() == full_rescore(records).tolist()
+        # Unchanged files are not read again
+        assert cache.update("model", path)["added_lines"] == 0
+
+        records[3]["response"] = "7\t12.5"
+        records.append(dict(records[0]))
+        write_records(path, records, 2)
+        # The edited two-question line is rescored; the duplicated line only adds its copy to the totals
+        assert cache.update("model", path) == {"added_lines": 1, "removed_lines": 1, "scored_items": 2,
+                                                "reused_items": 0}
+        assert cache.totals("model").tolist() == full_rescore(records).tolist()
+
+        del records[5:8]
+        write_records(path, records, 3)
+        assert cache.update("model", path)["removed_lines"] == 3
+        assert cache.totals("model").tolist() == full_rescore(records).tolist()
+
+
+def test_verdicts_are_shared_between_sources(tmp_path):
+    path = str(tmp_path / "enriched.json")
+    records = make_records(10)
+    write_records(path, records, 1)
+    with VerdictCache(str(tmp_path / "verdicts.sqlite")) as cache:
+        cache.update("first", path)
+        stats = cache.update("second", path)
+        assert (stats["scored_items"], stats["reused_items"]) == (0, 15)
+        assert cache.totals("second").tolist() == cache.totals("first").tolist()
+
+
+def test_new_scorer_version_rescores_everything_once(tmp_path):
+    path = str(tmp_path / "enriched.json")
+    records = make_records(10)
+    write_records(path, records, 1)
+    verdicts_path = str(tmp_path / "verdicts.sqlite")
+    with VerdictCache(verdicts_path, scorer_version="1") as cache:
+        cache.update("model", path)
+    with VerdictCache(verdicts_path, scorer_version="2") as cache:
+        assert cache.update("model", path)["scored_items"] == 15
+        assert cache.totals("model").tolist() == full_rescore(records).tolist()
+        # Within a version, only the edited line is rescored
+        records[0]["response"] = "7"
+        write_records(path, records, 2)
+        assert cache.update("model", path)["scored_items"] == 1
+        assert cache.totals("model").tolist() == full_rescore(records).tolist()
+    # The verdicts of the first version are kept, so going back only scores what changed since
+    with VerdictCache(verdicts_path, scorer_version="1") as cache:
+        stats = cache.update("model", path)
+        assert (stats["scored_items"], stats["reused_items"]) == (1, 14)
+        assert cache.totals("model").tolist() == full_rescore(records).tolist()
+
+
+def test_values_match_the_items_of_the_source(tmp_path):
+    path = str(tmp_path / "enriched.json")
+    records = make_records(6)
+    write_records(path, records, 1)
+    with VerdictCache(str(tmp_path / "verdicts.sqlite")) as cache:
+        cache.update("model", path)
+        targets, predictions, reasons = cache.values("model")
+    assert len(reasons) == 9
+    assert np.bincount(reasons, minlength=len(REASONS)).tolist() == full_rescore(records).tolist()
+    assert score_values(targets, predictions).tolist() == reasons.tolist()
@@ -0,0 +1,131 @@
+import asyncio  # Module for running the draws
+import math  # Module providing mathematical functions
+
+import pytest  # The test runner, for parametrized cases
+
+from cache import ResponseCache
+from enrichment import ProviderPool
+from metrics import Metrics
+from providers import ChatProvider
+from voting import SelfConsistency, agree, vote
+
+PARAMS = {"model": "model-1", "temperature": 0.9}
+
+
+class ScriptedProvider(ChatProvider):
+    # Answers each request with the next scripted response, recording the size of every request
+    name = "scripted"
+
+    def __init__(self, responses, supports_n=False, cache=None):
+        super().__init__(PARAMS, cache, Metrics())
+        self.responses = list(responses)
+        self.supports_n = supports_n
+        self.requests = list()
+
+    def complete(self, message):
+        self.requests.append(1)
+        return self.responses.pop(0)
+
+    def complete_n(self, message, n):
+        self.requests.append(n)
+        return [self.responses.pop(0) for _ in range(n)]
+
+
+def draw(provider, samples: int = 5, early_stop: bool = True, question_count: int = 1):
+    pool = ProviderPool(requests_per_minute=1e9, tokens_per_minute=1e12, metrics=Metrics())
+    voting = SelfConsistency(samples, early_stop, Metrics())
+    return asyncio.run(voting.draw(pool, provider, "message", question_count))
+
+
+@pytest.mark.parametrize("x, y, agreed", [
+    (12.5, 12.9, True),
+    (12.5, 13.0, False),
+    (1000.0, 1009.0, True),
+    (-1000.0, -1009.0, True),
+    (1000.0, -1000.0, False),
+    (math.nan, math.nan, False),
+    (math.nan, 1.0, False),
+])
+def test_agree(x, y, agreed):
+    assert agree(x, y) == agreed
+    assert agree(y, x) == agreed
+
+
+def test_vote_groups_within_tolerance_and_breaks_ties_by_first_group():
+    # Two groups of two within tolerance, the first formed by 10
+    value, members, leader, runner_up = vote([10.0, 20.0, 10.3, math.nan, 20.2])
+    assert (value, members, leader, runner_up) == (10.0, [0, 2], 2, 2)
+    assert vote([1.0, 5.0, 5.4, 1.2, 5.1])[:3] == (5.0, [1, 2, 4], 3)
+
+
+def test_vote_with_every_sample_abstaining():
+    value, members, leader, runner_up = vote([math.nan, math.nan])
+    assert math.isnan(value) and (members, leader, runner_up) == ([], 0, 0)
+
+
+@pytest.mark.parametrize("answers, size", [
+    ([], 3),
+    ([[1.0], [1.0], [1.0]], 0),
+    ([[1.0], [1.0], [2.0]], 1),
+    ([[1.0], [2.0], [3.0]], 2),
+    ([[1.0], [1.0], [1.0], [2.0]], 0),
+    ([[1.0], [1.0], [2.0], [2.0]], 1),
+])
+def test_round_size_stops_once_the_leader_cannot_be_overtaken(answers, size):
+    assert SelfConsistency(5, metrics=Metrics()).round_size(answers, 1) == size
+
+
+def test_round_size_draws_for_the_least_settled_question():
+    answers = [[1.0, 1.0], [1.0, 2.0], [1.0, 3.0]]
+    assert SelfConsistency(5, metrics=Metrics()).round_size(answers, 2) == 2
+    assert SelfConsistency(5, early_stop=False, metrics=Metrics()).round_size(answers, 2) == 2
+    assert SelfConsistency(7, early_stop=False, metrics=Metrics()).round_size(answers[:1], 2) == 6
+
+
+def test_unanimous_samples_stop_early():
+    provider = ScriptedProvider(["12.5"] * 5)
+    record = draw(provider)
+    assert record == {"response": "12.5", "samples": ["12.5"] * 3, "votes": [3]}
+    assert provider.requests == [1, 1, 1]
+
+
+def test_n_draws_a_round_in_one_request():
+    provider = ScriptedProvider(["12.5", "13.5", "12.6", "12.4", "13.4"], supports_n=True)
+    record = draw(provider)
+    # A round of three leaves 2 against 1, so one more sample settles the vote
+    assert provider.requests == [3, 1]
+    assert record["votes"] == [3] and record["response"] == "12.5"
+
+
+def test_no_early_stop_draws_every_sample():
+    provider = ScriptedProvider(["12.5"] * 5)
+    assert draw(provider, early_stop=False)["samples"] == ["12.5"] * 5
+
+
+def test_response_agrees_with_the_most_winning_answers():
+    provider = ScriptedProvider(["1\t7", "2\t8", "2\t7", "1\t9", "2\t7"])
+    record = draw(provider, question_count=2)
+    assert record["votes"] == [3, 3]
+    assert record["response"] == "2\t7"
+
+
+def test_every_sample_failing_to_answer_keeps_the_first():
+    provider = ScriptedProvider(["The document does not say"] * 3 + ["I cannot tell"] * 2)
+    record = draw(provider)
+    # No leader ever emerges, so every sample is drawn and the first stands for the vote
+    assert len(record["samples"]) == 5
+    assert record["response"] == "The document does not say"
+    assert record["votes"] == [0]
+
+
+def test_samples_are_cached_apart(tmp_path):
+    with ResponseCache(str(tmp_path / "cache.sqlite")) as response_cache:
+        provider = ScriptedProvider(["1", "2", "1", "2", "1"], cache=response_cache)
+        first = draw(provider)
+        assert len(first["samples"]) == 5
+        # A rerun reads every sample back from the cache, and a single-sample run reuses sample 0
+        provider.responses = list()
+        assert draw(provider) == first
+        assert provider("message") == "1"
+        assert len(provider.requests) == 5
+        assert response_cache.get(ResponseCache.make_key("scripted", dict(PARAMS, sample=3), "message")) == "2"
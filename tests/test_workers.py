@@ -0,0 +1,45 @@
+import os  # Module for file system operations
+
+from helpers import from_json, to_json
+from journal import EnrichmentJournal
+from metrics import Metrics
+from workers import ShardWorker
+
+
+def write_input(path: str, count: int):
+    with open(path, "w", encoding="utf-8") as f_out:
+        for index in range(count):
+            f_out.write(to_json({"pre_text": f"document {index}", "table": "", "post_text": "",
+                                 "qa_pairs": [{"question": "what?", "answer": "1"}]}) + "\n")
+
+
+def enrich_all(records, write, on_failure):
+    for record in records:
+        record["response"] = "1"
+        write(record)
+
+
+def test_other_workers_journals_are_only_read(tmp_path):
+    input_path = str(tmp_path / "input.json")
+    write_input(input_path, 4)
+    work_dir = str(tmp_path / "shards")
+    worker = ShardWorker(input_path, work_dir, shard_size=4, owner="second", metrics=Metrics())
+
+    # Another worker journalled the first record and is halfway through writing the next one
+    with open(input_path, encoding="utf-8") as f_in:
+        record = dict(from_json(f_in.readline()), response="1")
+    other = EnrichmentJournal(os.path.join(work_dir, "shard-00000.first.journal"), fsync=False)
+    with other:
+        other.append(record)
+    with open(other.path, "ab") as f_out:
+        f_out.write(b"partial")
+    size = os.path.getsize(other.path)
+
+    lease = worker.leases.claim("shard-00000")
+    assert worker.run_shard(0, lease, enrich_all)
+    lease.release(True)
+
+    assert os.path.getsize(other.path) == size
+    assert worker.merge(str(tmp_path / "output.json")) == 0
+    with open(tmp_path / "output.json", encoding="utf-8") as f_in:
+        assert len(f_in.readlines()) == 4
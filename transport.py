@@ -0,0 +1,320 @@
+import json  # Module for JSON serialization and deserialization
+import socket  # Module for name resolution
+import ssl  # Module for TLS contexts
+import threading  # Module for per-thread timing state and locking
+import time  # Module providing a monotonic clock
+from collections import Counter, deque  # Tallies of HTTP versions and a bounded history of timings
+from typing import Any, Dict, List, Optional, Tuple, Union  # Type hints for variables and functions
+
+import httpcore  # Low-level HTTP/1.1 and HTTP/2 connection pooling, used by httpx
+
+# The DNS lookup time of the connection being opened by the current thread
+_connecting = threading.local()
+
+# The headers of a request with a JSON body
+JSON_HEADERS = {"content-type": "application/json"}
+
+# The failures of a request that did not produce a response, worth retrying: timeouts, refused or reset
+# connections, and connections closed mid-response
+NETWORK_ERRORS = (httpcore.TimeoutException, httpcore.NetworkError, httpcore.RemoteProtocolError)
+
+
+def encode_headers(headers: Dict[str, str]) -> List[Tuple[bytes, bytes]]:
+    """
+    Encode headers for httpcore.
+
+    Args:
+        headers (Dict[str, str]): The header names and values.
+
+    Returns:
+        List[Tuple[bytes, bytes]]: The encoded header pairs.
+    """
+    return [(name.encode("ascii"), value.encode("latin-1")) for name, value in headers.items()]
+
+
+class TimedBackend(httpcore.SyncBackend):
+    """
+    The standard network backend, resolving host names itself so that DNS time is measured apart from
+    the TCP connect.
+    """
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        start = time.perf_counter()
+        # A failed lookup is a connection error like any other, so it is retried rather than escaping as a raw
+        # socket.gaierror
+        try:
+            addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            raise httpcore.ConnectError(f"Cannot resolve {host}: {e}") from e
+        if not addresses:
+            raise httpcore.ConnectError(f"No addresses found for {host}")
+        _connecting.dns = time.perf_counter() - start
+        _connecting.failed = 0.0
+        # Each address is tried in turn, as socket.create_connection does, so a host whose IPv6 route is broken
+        # still connects over IPv4; only the attempt that succeeds counts as connect time
+        error = None
+        for address in addresses:
+            attempt = time.perf_counter()
+            try:
+                # TLS is negotiated against the original host name, so connecting to the address is safe
+                return super().connect_tcp(address[4][0], port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+                _connecting.failed += time.perf_counter() - attempt
+        raise error
+
+
+class RequestTiming:
+    """
+    The phases of a single request, in seconds.
+
+    Attributes:
+        dns (float): Resolving the host name. Zero when the request reused an open connection.
+        connect (float): Opening the TCP connection and negotiating TLS. Zero on a reused connection.
+        ttfb (float): From sending the request to receiving the response headers.
+        total (float): The whole request, including reading the response body.
+        reused (bool): Whether the request was sent over an already open connection.
+        http_version (str): The protocol used, such as "HTTP/1.1" or "HTTP/2".
+    """
+
+    __slots__ = ("dns", "connect", "ttfb", "total", "reused", "http_version", "_marks")
+
+    def __init__(self):
+        self.dns = 0.0
+        self.connect = 0.0
+        self.ttfb = 0.0
+        self.total = 0.0
+        self.reused = True
+        self.http_version = ""
+        self._marks: Dict[str, float] = dict()
+
+    def trace(self, event: str, info: Dict[str, Any]):
+        # httpcore reports each phase as "<scope>.<phase>.started" and "<scope>.<phase>.complete"
+        now = time.perf_counter()
+        scope, _, phase = event.partition(".")
+        if phase in ("connect_tcp.started", "start_tls.started"):
+            self.reused = False
+            self._marks[phase] = now
+        elif phase == "connect_tcp.complete":
+            elapsed = now - self._marks["connect_tcp.started"]
+            self.dns = getattr(_connecting, "dns", 0.0)
+            self.connect += elapsed - self.dns - getattr(_connecting, "failed", 0.0)
+        elif phase == "start_tls.complete":
+            self.connect += now - self._marks["start_tls.started"]
+        elif phase == "send_request_headers.started":
+            self._marks["send"] = now
+        elif phase == "receive_response_headers.complete" and "send" in self._marks:
+            self.ttfb = now - self._marks["send"]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__ if not name.startswith("_")}
+
+
+class HTTPStatusError(Exception):
+    """
+    Raised for a response with an error status.
+
+    Args:
+        message (str): A description of the failure.
+        status_code (int): The HTTP status code.
+    """
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TransportResponse:
+    """
+    A fully read response.
+
+    Args:
+        status_code (int): The HTTP status code.
+        headers (Dict[str, str]): The response headers, with lowercase names.
+        content (bytes): The response body.
+        timing (RequestTiming): The phases of the request.
+    """
+
+    __slots__ = ("status_code", "headers", "content", "timing")
+
+    def __init__(self, status_code: int, headers: Dict[str, str], content: bytes, timing: RequestTiming):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.timing = timing
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        """
+        Raise an HTTPStatusError if the response has a 4xx or 5xx status.
+        """
+        if self.status_code >= 400:
+            raise HTTPStatusError(f"HTTP {self.status_code}: {self.text[:1000]}", self.status_code)
+
+
+class JsonBody:
+    """
+    A JSON request body whose fixed parameters are serialized once, so each request only serializes its
+    messages.
+
+    Args:
+        params (Dict[str, Any]): The parameters shared by every request, such as model and temperature.
+    """
+
+    def __init__(self, params: Dict[str, Any]):
+        # Everything but the closing brace, ready for the messages to be appended
+        self.prefix = json.dumps(params, ensure_ascii=True)[:-1].encode("ascii") + (b", " if params else b"")
+
+    def build(self, messages: List[Dict[str, Any]], extra: Optional[Dict[str, Any]] = None) -> bytes:
+        """
+        Serialize a request body.
+
+        Args:
+            messages (List[Dict[str, Any]]): The messages of the request.
+            extra (Optional[Dict[str, Any]]): Parameters of this request only, such as the number of samples.
+
+        Returns:
+            bytes: The body, equal to json.dumps(dict(params, **extra, messages=messages), ensure_ascii=True).
+        """
+        extra_fields = json.dumps(extra, ensure_ascii=True)[1:-1].encode("ascii") + b", " if extra else b""
+        return (self.prefix + extra_fields + b'"messages": ' + json.dumps(messages, ensure_ascii=True).encode("ascii")
+                + b"}")
+
+
+class Transport:
+    """
+    A connection pool shared by all requests to one API, keeping connections alive between requests and
+    multiplexing them over HTTP/2 where the server supports it. Safe to use from many threads.
+
+    Args:
+        base_url (str): The API base URL. An https URL negotiates HTTP/2 with ALPN when http2 is set.
+        headers (Dict[str, str]): The headers sent with every request, such as authentication.
+        http2 (bool): Whether to offer HTTP/2.
+        max_connections (int): The largest number of open connections.
+        max_keepalive_connections (Optional[int]): The largest number of idle connections kept open.
+        keepalive_expiry (float): How long an idle connection is kept open, in seconds.
+        connect_timeout (float): The timeout for opening a connection, in seconds.
+        read_timeout (float): The timeout for each read of the response, in seconds.
+        verify (Union[bool, str]): Whether to verify TLS certificates, or the path of a CA bundle to verify
+            them against, such as the certificate of a local stub server.
+        history (int): The number of recent request timings kept for `stats`.
+    """
+
+    def __init__(self,
+                 base_url: str,
+                 headers: Optional[Dict[str, str]] = None,
+                 http2: bool = True,
+                 max_connections: int = 10,
+                 max_keepalive_connections: Optional[int] = None,
+                 keepalive_expiry: float = 60.0,
+                 connect_timeout: float = 10.0,
+                 read_timeout: float = 600.0,
+                 verify: Union[bool, str] = True,
+                 history: int = 10000):
+        self.base_url = base_url.rstrip("/")
+        self.headers = encode_headers(headers or dict())
+        self.timeouts = {"connect": connect_timeout, "read": read_timeout, "write": read_timeout,
+                         "pool": read_timeout}
+        ssl_context = ssl.create_default_context(cafile=verify if isinstance(verify, str) else None)
+        if verify is False:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        if http2:
+            ssl_context.set_alpn_protocols(["h2", "http/1.1"])
+        self.pool = httpcore.ConnectionPool(ssl_context=ssl_context,
+                                            max_connections=max_connections,
+                                            max_keepalive_connections=max_keepalive_connections,
+                                            keepalive_expiry=keepalive_expiry,
+                                            http2=http2,
+                                            network_backend=TimedBackend())
+        self.timings = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close every pooled connection.
+        """
+        self.pool.close()
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> TransportResponse:
+        """
+        Send a request over a pooled connection and read the whole response.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path, appended to the base URL.
+            body (Optional[bytes]): The serialized request body.
+            headers (Optional[Dict[str, str]]): Headers sent with this request only.
+
+        Returns:
+            TransportResponse: The response, with the timing of each phase.
+        """
+        timing = RequestTiming()
+        request_headers = list(self.headers)
+        if headers:
+            request_headers.extend(encode_headers(headers))
+        _connecting.dns = 0.0
+        start = time.perf_counter()
+        response = self.pool.request(method, self.base_url + path,
+                                     headers=request_headers,
+                                     content=body,
+                                     extensions={"timeout": self.timeouts, "trace": timing.trace})
+        timing.total = time.perf_counter() - start
+        timing.http_version = response.extensions.get("http_version", b"").decode("ascii")
+        with self._lock:
+            self.timings.append(timing)
+        return TransportResponse(response.status,
+                                 {name.decode("latin-1").lower(): value.decode("latin-1")
+                                  for name, value in response.headers},
+                                 response.content,
+                                 timing)
+
+    def post(self, path: str, body: bytes, headers: Optional[Dict[str, str]] = None) -> TransportResponse:
+        """
+        Send a POST request with a serialized JSON body.
+
+        Args:
+            path (str): The path, appended to the base URL.
+            body (bytes): The serialized JSON body, for example from JsonBody.build.
+            headers (Optional[Dict[str, str]]): Headers sent with this request only.
+
+        Returns:
+            TransportResponse: The response.
+        """
+        return self.request("POST", path, body, dict(JSON_HEADERS, **(headers or dict())))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Summarize the timings of the recent requests.
+
+        Returns:
+            Dict[str, Any]: The number of requests, the connections opened, the HTTP versions used, and the
+            median and 99th percentile of each phase in milliseconds.
+        """
+        with self._lock:
+            timings = list(self.timings)
+        summary: Dict[str, Any] = {
+            "requests": len(timings),
+            "connections_opened": sum(not timing.reused for timing in timings),
+            "http_versions": dict(Counter(timing.http_version for timing in timings)),
+        }
+        for phase in ("dns", "connect", "ttfb", "total"):
+            values = sorted(getattr(timing, phase) for timing in timings)
+            if values:
+                summary[f"{phase}_p50_ms"] = round(values[len(values) // 2] * 1000, 3)
+                index = min(len(values) - 1, int(len(values) * 0.99))
+                summary[f"{phase}_p99_ms"] = round(values[index] * 1000, 3)
+        return summary
@@ -0,0 +1,274 @@
+import hashlib  # Module for hashing functions
+import os  # Module for file system operations
+import sqlite3  # Module for the on-disk SQLite database
+from collections import Counter  # Counts the copies of each line
+from typing import Any, Dict, List, Tuple  # Type hints for variables and functions
+
+import numpy as np  # NumPy, a library for numerical computing
+
+from helpers import create_instance_key, from_json
+from scoring import ABSOLUTE_TOLERANCE, RELATIVE_TOLERANCE, REASONS, SCORER_VERSION, extract_pair_values, \
+    score_values
+
+
+def digest(data: bytes) -> bytes:
+    """
+    Hash a line or a response for change detection.
+
+    Args:
+        data (bytes): The bytes to hash.
+
+    Returns:
+        bytes: A 16-byte BLAKE2b digest.
+    """
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def response_hash(data: Dict[str, Any], qa_index: int) -> bytes:
+    """
+    Hash what the verdict of a question-answer pair depends on besides its instance key.
+
+    Keys of the older schemes only cover the document, so the hash covers the gold answer and the number of
+    questions, which decides how the response is split into answers, as well as the response itself.
+
+    Args:
+        data (Dict[str, Any]): An enriched record.
+        qa_index (int): The index of the question-answer pair.
+
+    Returns:
+        bytes: The digest.
+    """
+    qa_pairs = data["qa_pairs"]
+    parts = [str(len(qa_pairs)), qa_pairs[qa_index]["answer"], data["response"]]
+    return digest("\0".join(parts).encode("utf-8"))
+
+
+class VerdictCache:
+    """
+    A persistent cache of per-item verdicts and per-source running totals, so re-scoring only touches the
+    items that are new or changed.
+
+    Verdicts are keyed by instance key, question-answer index, response hash and scorer version, and are
+    shared by every source: a response scored once is never scored again, whichever file it appears in.
+    Each source remembers the hash of every line it was last scored from and keeps its reason counts as
+    running sums, so an update reads the file, hashes its lines, and only parses the lines whose hash is
+    new, subtracting the lines that disappeared. A file whose size and modification time have not changed
+    is not read at all.
+
+    Args:
+        path (str): The path of the SQLite database.
+        scorer_version (str): Identifies the answer extraction and scoring rules. Verdicts of any other
+            version are ignored, so changing the rules rescores everything.
+    """
+
+    def __init__(self,
+                 path: str = "data/verdict_cache.sqlite",
+                 scorer_version: str = f"{SCORER_VERSION}:{ABSOLUTE_TOLERANCE}:{RELATIVE_TOLERANCE}"):
+        self.path = path
+        self.scorer_version = scorer_version
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS verdicts (
+                instance_key TEXT NOT NULL,
+                qa_index INTEGER NOT NULL,
+                response_hash BLOB NOT NULL,
+                scorer_version TEXT NOT NULL,
+                target REAL,
+                predicted REAL,
+                reason INTEGER NOT NULL,
+                PRIMARY KEY (instance_key, qa_index, response_hash, scorer_version)
+            );
+            CREATE TABLE IF NOT EXISTS source_items (
+                source TEXT NOT NULL,
+                line_hash BLOB NOT NULL,
+                qa_index INTEGER NOT NULL,
+                instance_key TEXT NOT NULL,
+                response_hash BLOB NOT NULL,
+                copies INTEGER NOT NULL,
+                PRIMARY KEY (source, line_hash, qa_index)
+            );
+            CREATE TABLE IF NOT EXISTS source_totals (
+                source TEXT NOT NULL,
+                reason INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (source, reason)
+            );
+            CREATE TABLE IF NOT EXISTS source_files (
+                source TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                scorer_version TEXT NOT NULL
+            );""")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the database.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _add_totals(self, source: str, deltas: Counter):
+        self._connection.executemany(
+            "INSERT INTO source_totals (source, reason, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (source, reason) DO UPDATE SET count = count + excluded.count",
+            [(source, reason, delta) for reason, delta in deltas.items() if delta])
+
+    def _line_reasons(self, source: str, line_hash: bytes) -> List[int]:
+        return [reason for reason, in self._connection.execute(
+            "SELECT v.reason FROM source_items AS i JOIN verdicts AS v "
+            "ON v.instance_key = i.instance_key AND v.qa_index = i.qa_index "
+            "AND v.response_hash = i.response_hash AND v.scorer_version = ? "
+            "WHERE i.source = ? AND i.line_hash = ?", (self.scorer_version, source, line_hash))]
+
+    def update(self, source: str, file_path: str) -> Dict[str, int]:
+        """
+        Bring the verdicts and totals of a source up to date with its enriched JSONL file.
+
+        Args:
+            source (str): The source name.
+            file_path (str): The path of the enriched JSONL file.
+
+        Returns:
+            Dict[str, int]: The number of lines added and removed since the last update, the number of items
+            scored and the number reused from the cache. All zero if the file was unchanged.
+        """
+        stats = {"added_lines": 0, "removed_lines": 0, "scored_items": 0, "reused_items": 0}
+        stat = os.stat(file_path)
+        signature = (file_path, stat.st_size, stat.st_mtime_ns, self.scorer_version)
+        row = self._connection.execute("SELECT path, size, mtime_ns, scorer_version FROM source_files "
+                                       "WHERE source = ?", (source,)).fetchone()
+        if row == signature:
+            return stats
+
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            if row is not None and row[3] != self.scorer_version:
+                # The totals were summed from verdicts of other rules, so the source starts over
+                self._connection.execute("DELETE FROM source_items WHERE source = ?", (source,))
+                self._connection.execute("DELETE FROM source_totals WHERE source = ?", (source,))
+            existing = dict(self._connection.execute(
+                "SELECT line_hash, MAX(copies) FROM source_items WHERE source = ? GROUP BY line_hash", (source,)))
+
+            # Hash every line, keeping only the lines not seen before for parsing
+            copies = Counter()
+            new_lines: Dict[bytes, bytes] = dict()
+            with open(file_path, "rb") as f_in:
+                for line in f_in:
+                    if not line.strip():
+                        continue
+                    line_hash = digest(line)
+                    copies[line_hash] += 1
+                    if line_hash not in existing:
+                        new_lines.setdefault(line_hash, line)
+
+            # Lines that disappeared, or whose number of copies changed, adjust the totals by their verdicts
+            deltas = Counter()
+            for line_hash, old_copies in existing.items():
+                new_copies = copies.get(line_hash, 0)
+                if new_copies == old_copies:
+                    continue
+                for reason in self._line_reasons(source, line_hash):
+                    deltas[reason] += new_copies - old_copies
+                if new_copies:
+                    self._connection.execute("UPDATE source_items SET copies = ? WHERE source = ? AND line_hash = ?",
+                                             (new_copies, source, line_hash))
+                else:
+                    stats["removed_lines"] += 1
+                    self._connection.execute("DELETE FROM source_items WHERE source = ? AND line_hash = ?",
+                                             (source, line_hash))
+
+            # New lines reuse the verdicts of items already scored anywhere, and the rest are scored together
+            items = list()
+            pending: List[Tuple[int, float, float]] = list()
+            for line_hash, line in new_lines.items():
+                stats["added_lines"] += 1
+                data = from_json(line.decode("utf-8"))
+                instance_key = create_instance_key(data)
+                values = None
+                for qa_index in range(len(data["qa_pairs"])):
+                    item_hash = response_hash(data, qa_index)
+                    verdict = self._connection.execute(
+                        "SELECT reason FROM verdicts WHERE instance_key = ? AND qa_index = ? AND response_hash = ? "
+                        "AND scorer_version = ?", (instance_key, qa_index, item_hash, self.scorer_version)).fetchone()
+                    items.append((source, line_hash, qa_index, instance_key, item_hash, copies[line_hash]))
+                    if verdict is not None:
+                        stats["reused_items"] += 1
+                        deltas[verdict[0]] += copies[line_hash]
+                        continue
+                    if values is None:
+                        values = extract_pair_values(data)
+                    pending.append((len(items) - 1,) + values[qa_index])
+
+            if pending:
+                targets = np.array([target for _, target, _ in pending], dtype=np.float64)
+                predictions = np.array([predicted for _, _, predicted in pending], dtype=np.float64)
+                reasons = score_values(targets, predictions)
+                verdicts = list()
+                for (index, target, predicted), reason in zip(pending, reasons.tolist()):
+                    _, line_hash, qa_index, instance_key, item_hash, count = items[index]
+                    verdicts.append((instance_key, qa_index, item_hash, self.scorer_version, target, predicted,
+                                     reason))
+                    deltas[reason] += count
+                # Several new lines can hold the same item, which is then stored once
+                self._connection.executemany("INSERT OR IGNORE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)", verdicts)
+                stats["scored_items"] = len(pending)
+
+            self._connection.executemany("INSERT OR REPLACE INTO source_items VALUES (?, ?, ?, ?, ?, ?)", items)
+            self._add_totals(source, deltas)
+            self._connection.execute("INSERT OR REPLACE INTO source_files VALUES (?, ?, ?, ?, ?)",
+                                     (source,) + signature)
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        return stats
+
+    def totals(self, source: str) -> np.ndarray:
+        """
+        Read the running count of each scoring reason of a source.
+
+        Args:
+            source (str): The source name.
+
+        Returns:
+            np.ndarray: The number of items per entry of REASONS, shape (len(REASONS),).
+        """
+        counts = np.zeros(len(REASONS), dtype=np.int64)
+        for reason, count in self._connection.execute("SELECT reason, count FROM source_totals WHERE source = ?",
+                                                      (source,)):
+            counts[reason] = count
+        return counts
+
+    def values(self, source: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Read the cached values and verdicts of every item of a source, for tolerance sweeps and parity checks.
+
+        Args:
+            source (str): The source name.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: The float64 target and predicted values and the index
+            into REASONS of each item. Items are in the order they were first scored, not in file order.
+        """
+        rows = self._connection.execute(
+            "SELECT v.target, v.predicted, v.reason, i.copies FROM source_items AS i JOIN verdicts AS v "
+            "ON v.instance_key = i.instance_key AND v.qa_index = i.qa_index "
+            "AND v.response_hash = i.response_hash AND v.scorer_version = ? "
+            "WHERE i.source = ? ORDER BY i.rowid", (self.scorer_version, source)).fetchall()
+        if not rows:
+            return np.empty(0), np.empty(0), np.empty(0, dtype=np.int8)
+        targets, predictions, reasons, counts = zip(*rows)
+        # SQLite stores NaN as NULL, which NumPy reads back as NaN
+        counts = np.array(counts)
+        return (np.repeat(np.array(targets, dtype=np.float64), counts),
+                np.repeat(np.array(predictions, dtype=np.float64), counts),
+                np.repeat(np.array(reasons, dtype=np.int8), counts))
@@ -0,0 +1,155 @@
+import asyncio  # Module for asynchronous I/O and concurrency
+import math  # Module providing mathematical functions
+from functools import partial  # Binds the sample indices of a request
+from typing import Any, Dict, List, Sequence, Tuple  # Type hints for variables and functions
+
+from answers import extract_answers
+from metrics import DEFAULT_METRICS, Metrics
+from scoring import ABSOLUTE_TOLERANCE, RELATIVE_TOLERANCE
+
+
+def agree(x: float, y: float) -> bool:
+    """
+    Check whether two answers agree, within the tolerances of essentially_equals.
+
+    Unlike essentially_equals, which compares a prediction with a target, missing answers never agree, and
+    the relative tolerance is taken of the larger magnitude so negative answers compare symmetrically.
+
+    Args:
+        x (float): The first answer.
+        y (float): The second answer.
+
+    Returns:
+        bool: True if both are numbers within the absolute or relative tolerance of each other.
+    """
+    if math.isnan(x) or math.isnan(y):
+        return False
+    delta = abs(x - y)
+    return delta < ABSOLUTE_TOLERANCE or delta < RELATIVE_TOLERANCE * max(abs(x), abs(y))
+
+
+def vote(values: Sequence[float]) -> Tuple[float, List[int], int, int]:
+    """
+    Take a tolerance-aware majority vote over the answers of several samples to one question.
+
+    Answers are grouped greedily: each joins the first group whose first answer it agrees with. Missing
+    answers abstain. Ties go to the group formed first.
+
+    Args:
+        values (Sequence[float]): The answer of each sample, NaN where it had none.
+
+    Returns:
+        Tuple[float, List[int], int, int]: The winning answer (the first of its group, NaN if every sample
+        abstained), the indices of the samples in the winning group, and the sizes of the winning and the
+        runner-up groups.
+    """
+    groups: List[List[int]] = list()
+    for index, value in enumerate(values):
+        if math.isnan(value):
+            continue
+        for group in groups:
+            if agree(values[group[0]], value):
+                group.append(index)
+                break
+        else:
+            groups.append([index])
+    if not groups:
+        return math.nan, list(), 0, 0
+    # A stable sort keeps the earliest group first among groups of equal size
+    groups.sort(key=len, reverse=True)
+    runner_up = len(groups[1]) if len(groups) > 1 else 0
+    return values[groups[0][0]], groups[0], len(groups[0]), runner_up
+
+
+class SelfConsistency:
+    """
+    Draw several samples of the response to a prompt and keep the one agreeing with the majority answer.
+
+    Samples are drawn in rounds. Each round draws, in parallel, just enough samples to settle every question
+    if they all agree with its current leader, and drawing stops as soon as no question's leader can be
+    overtaken by the samples left. With five samples and unanimous answers, three are drawn instead of five.
+    Providers whose API accepts `n` draw a round in one request, which sends and bills the prompt once; the
+    others draw each sample with a request of its own.
+
+    The record keeps the sample that agrees with the most winning answers as its "response", so scoring is
+    unchanged, and all the samples in "samples", with the size of the winning group of each question in
+    "votes".
+
+    Args:
+        samples (int): The largest number of samples drawn per prompt.
+        early_stop (bool): Whether to stop drawing once the vote is decided.
+        metrics (Metrics): The registry receiving the samples drawn and saved by early stopping.
+    """
+
+    def __init__(self, samples: int = 5, early_stop: bool = True, metrics: Metrics = DEFAULT_METRICS):
+        if samples < 1:
+            raise ValueError("At least one sample must be drawn")
+        self.samples = samples
+        self.early_stop = early_stop
+        self.metrics = metrics
+
+    def round_size(self, answers: List[List[float]], question_count: int) -> int:
+        """
+        Decide how many samples to draw next.
+
+        Args:
+            answers (List[List[float]]): The answers of each sample drawn so far, one value per question.
+            question_count (int): The number of questions.
+
+        Returns:
+            int: The number of samples to draw, zero when the vote is decided or every sample was drawn.
+        """
+        remaining = self.samples - len(answers)
+        if not self.early_stop or remaining == 0:
+            return remaining
+        size = 0
+        for question in range(question_count):
+            _, _, leader, runner_up = vote([sample[question] for sample in answers])
+            # The leader wins once it is ahead by more than the samples left; this many agreeing samples
+            # would get it there
+            if leader <= runner_up + remaining:
+                size = max(size, (runner_up + remaining - leader) // 2 + 1)
+        return min(size, remaining)
+
+    async def draw(self, pool, provider, message: str, question_count: int) -> Dict[str, Any]:
+        """
+        Draw the samples of a prompt through a provider pool and vote on their answers.
+
+        Args:
+            pool (ProviderPool): The pool whose budgets and retries every request goes through.
+            provider (ChatProvider): The provider, which draws numbered samples.
+            message (str): The prompt.
+            question_count (int): The number of questions the prompt asks.
+
+        Returns:
+            Dict[str, Any]: The "response", "samples" and "votes" fields of the record.
+        """
+        responses: List[str] = list()
+        answers: List[List[float]] = list()
+        while True:
+            size = self.round_size(answers, question_count)
+            if size == 0:
+                break
+            indices = list(range(len(responses), len(responses) + size))
+            batches = [indices] if provider.supports_n else [[index] for index in indices]
+            requests = list()
+            for batch in batches:
+                call = partial(provider.sample, indices=batch)
+                # The pool labels its metrics with the name of the call
+                call.name = provider.name
+                requests.append(pool.request(call, message, len(batch)))
+            for texts in await asyncio.gather(*requests):
+                responses.extend(texts)
+                answers.extend(extract_answers(text, question_count) for text in texts)
+
+        winners = [vote([sample[question] for sample in answers]) for question in range(question_count)]
+        # The response agreeing with the most winning answers stands for the vote, the earliest among equals
+        agreement = [sum(index in members for _, members, _, _ in winners) for index in range(len(responses))]
+        best = max(range(len(responses)), key=lambda index: (agreement[index], -index))
+        self.metrics.increment("voting_samples_total", len(responses), provider=provider.name)
+        self.metrics.increment("voting_samples_saved_total", self.samples - len(responses), provider=provider.name)
+        return {
+            "response": responses[best],
+            "samples": responses,
+            "votes": [leader for _, _, leader, _ in winners],
+        }
@@ -0,0 +1,203 @@
+import glob  # Module for file path expansion
+import itertools  # Module for slicing the input into shards
+import os  # Module for file system operations
+import time  # Module for waiting on the leases of other workers
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set  # Type hints for variables and functions
+
+from helpers import from_json
+from journal import DeadLetterLog, EnrichmentJournal, compact_journals
+from jsonl_index import JsonlIndex
+from leases import LeaseDirectory
+from metrics import DEFAULT_METRICS, Metrics
+
+# Enriches the records of a shard: called with the records, the function writing each enriched record, and
+# the function logging each record that failed, in the way of EnrichmentEngine.run
+Enrich = Callable[[Iterator[Dict[str, Any]], Callable[[Dict[str, Any]], None],
+                   Callable[[Dict[str, Any], Exception], None]], None]
+
+
+def shard_name(shard: int) -> str:
+    return f"shard-{shard:05d}"
+
+
+class ShardWorker:
+    """
+    Enrich an input file together with other worker processes, on one host or on several hosts sharing a
+    filesystem.
+
+    The input is split into shards of consecutive lines. Each worker claims a shard through a lease in the
+    work directory, enriches it into a journal of its own, marks it done, and claims the next one, until no
+    shard is left. A journal is only written, repaired or migrated by its own worker and only read by the
+    others, so a worker that stalls past its lease and a worker that took the shard over cannot corrupt each
+    other's records. A shard reclaimed from a crashed
+    worker resumes after the records that any worker already journalled for it. A shard with failed records
+    is released undone, so another worker, or the next run, retries it.
+
+    The ordered output is produced by `merge`, once every shard is done.
+
+    Args:
+        input_path (str): The path of the input JSONL file.
+        work_dir (str): The directory shared by the workers, holding the leases, journals and dead letters.
+        shard_size (int): The number of input lines per shard. Every worker must use the same size.
+        skip_keys (Optional[Set[str]]): The keys of records enriched before the run, such as those of the
+            journal of a single-process run, which are not requested again.
+        owner (Optional[str]): The name of this worker. Defaults to the host name and process ID.
+        lease_seconds (float): How long a shard stays claimed without a heartbeat.
+        max_claims (int): How many times a shard is claimed before it is given up on.
+        metrics (Metrics): The registry receiving the shards and records processed.
+    """
+
+    def __init__(self,
+                 input_path: str,
+                 work_dir: str,
+                 shard_size: int = 100,
+                 skip_keys: Optional[Set[str]] = None,
+                 owner: Optional[str] = None,
+                 lease_seconds: float = 120.0,
+                 max_claims: int = 5,
+                 metrics: Metrics = DEFAULT_METRICS):
+        self.input_path = input_path
+        self.work_dir = work_dir
+        self.shard_size = shard_size
+        self.skip_keys = skip_keys or set()
+        self.leases = LeaseDirectory(work_dir, owner, lease_seconds, max_claims, metrics)
+        self.metrics = metrics
+        with JsonlIndex(input_path) as index:
+            self.shard_count = -(-len(index) // shard_size)
+
+    @property
+    def owner(self) -> str:
+        return self.leases.owner
+
+    def shard_names(self) -> List[str]:
+        return [shard_name(shard) for shard in range(self.shard_count)]
+
+    def journals(self, name: str = "shard-*") -> List[EnrichmentJournal]:
+        """
+        Find the journals written by any worker for the shards matching a name.
+
+        Args:
+            name (str): A shard name, or a glob pattern of shard names.
+
+        Returns:
+            List[EnrichmentJournal]: The journals, sorted by path.
+        """
+        paths = sorted(glob.glob(os.path.join(glob.escape(self.work_dir), f"{name}.*.journal")))
+        # Other workers may still be appending to their journals, so they are only ever read here: reading
+        # neither cuts off a line being written nor migrates a file another process holds open
+        return [EnrichmentJournal(path) for path in paths]
+
+    def read_shard(self, shard: int, completed_keys: Set[str], lease) -> Iterator[Dict[str, Any]]:
+        """
+        Read the records of a shard that are still to be enriched.
+
+        Args:
+            shard (int): The shard number.
+            completed_keys (Set[str]): The keys already enriched.
+            lease (Lease): The lease on the shard. Reading stops as soon as it is lost.
+
+        Yields:
+            Dict[str, Any]: A record without a response.
+        """
+        start = shard * self.shard_size
+        with JsonlIndex(self.input_path) as index:
+            for key, position in itertools.islice(index.keys_in_order(), start, start + self.shard_size):
+                if lease.lost:
+                    return
+                if key in completed_keys:
+                    continue
+                # Identical instances share a key, so only the first one is requested
+                completed_keys.add(key)
+                yield from_json(index.line(position).decode("utf-8"))
+
+    def run_shard(self, shard: int, lease, enrich: Enrich) -> bool:
+        """
+        Enrich the pending records of a claimed shard into this worker's journal of the shard.
+
+        Args:
+            shard (int): The shard number.
+            lease (Lease): The lease on the shard.
+            enrich (Enrich): Enriches the records.
+
+        Returns:
+            bool: Whether every record of the shard is now journalled.
+        """
+        name = shard_name(shard)
+        journal = EnrichmentJournal(os.path.join(self.work_dir, f"{name}.{self.owner}.journal"))
+        # A worker only migrates its own journal, kept from an earlier run under the same owner name, to the
+        # current key scheme; the records of other workers keyed with another scheme are requested again
+        journal.migrate_keys()
+        completed_keys = set(self.skip_keys)
+        for other in self.journals(name):
+            completed_keys.update(other.scan())
+            if other.corrupt_lines:
+                print(f"{name}: skipped {other.corrupt_lines} damaged lines of {other.path}")
+        dead_letters = DeadLetterLog(os.path.join(self.work_dir, f"{name}.{self.owner}.dead.jsonl"))
+        with journal, dead_letters:
+            enrich(self.read_shard(shard, completed_keys, lease), journal.append, dead_letters.append)
+        self.metrics.increment("worker_shards_total", done=str(not dead_letters.count and not lease.lost))
+        if dead_letters.count:
+            print(f"{name}: {dead_letters.count} instances failed after every retry, see {dead_letters.path}")
+        return not dead_letters.count and not lease.lost
+
+    def run(self, enrich: Enrich, poll_interval: Optional[float] = None) -> Dict[str, int]:
+        """
+        Claim and enrich shards until none is left to this worker.
+
+        A worker waits while other workers hold the last shards, so it can take over those of a worker that
+        crashes. It does not claim again a shard it failed to finish itself.
+
+        Args:
+            enrich (Enrich): Enriches the records of a shard, for example by running an EnrichmentEngine.
+            poll_interval (Optional[float]): The number of seconds between looks at the shards held by other
+                workers. Defaults to a third of the lease period.
+
+        Returns:
+            Dict[str, int]: The number of shards in each state once this worker stopped, see
+            LeaseDirectory.status.
+        """
+        poll_interval = poll_interval or self.leases.lease_seconds / 3
+        attempted: Set[int] = set()
+        while True:
+            claimed = False
+            for shard in range(self.shard_count):
+                if shard in attempted:
+                    continue
+                lease = self.leases.claim(shard_name(shard))
+                if lease is None:
+                    continue
+                claimed = True
+                print(f"{self.owner} claimed {shard_name(shard)} (claim {lease.generation})")
+                with lease:
+                    done = self.run_shard(shard, lease, enrich)
+                lease.release(done)
+                if not done:
+                    attempted.add(shard)
+            if claimed:
+                continue
+            status = self.status()
+            # Only the shards held by other workers can still come back, if their workers crash
+            if not status["held"]:
+                return status
+            time.sleep(poll_interval)
+
+    def status(self) -> Dict[str, int]:
+        return self.leases.status(self.shard_names())
+
+    def merge(self, output_path: str, journals: Optional[List[EnrichmentJournal]] = None) -> int:
+        """
+        Merge the journals of every worker into the ordered output file.
+
+        Workers may merge at the same time, since each writes a temporary file of its own and the output is
+        replaced atomically.
+
+        Args:
+            output_path (str): The path of the ordered JSONL output.
+            journals (Optional[List[EnrichmentJournal]]): Other journals to merge first, such as the journal of
+                a single-process run. Records of the workers take precedence.
+
+        Returns:
+            int: The number of input instances missing from every journal.
+        """
+        return compact_journals((journals or list()) + self.journals(), self.input_path, output_path,
+                                f"{output_path}.{self.owner}.tmp")